@@ -4,6 +4,7 @@ DATA_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/css
 DATA_POSTFIX_CSV = ".csv"
 COUNTRY_REGION = "Country/Region"
 TAIWAN = "Taiwan*"
+TAIWAN_NAME = "Taiwan"
 TW = "TW"
 US = "US"
 
@@ -16,8 +17,132 @@ GT_FIGURE_NAME_PREFIX = "/GT_FIGURE/GoogleTrend_"
 GT_FIGURE_5_YR = "5_yrs"
 GT_FIGURE_5_YR_SIGNIFICANT = "5_yrs_significant"
 GT_FIGURE_WITH_COMFIRMED_CASE = 'with_ConfirmedCases'
+COMPARISON_GRID_COLUMNS = 3
+
+# Plot: every series is downsampled to PLOT_MAX_POINTS points, a keyword grid has about GT_GRID_ASPECT times more rows
+# than columns and every panel is GT_PANEL_SIZE inches
+PLOT_MAX_POINTS = 500
+PLOT_DOWNSAMPLING = 'lttb'
+GT_GRID_ASPECT = 2.5
+GT_PANEL_SIZE = (6, 2)
 
 # Keyword List
 KEY_WORDS_LIST_EN = ['disinfectants', 'thermometers', 'oat milk', 'rubbing alcohol', 'powdered milk',
                     'hydrogen peroxide', 'mask', 'sanitizer', 'toilet paper', 'disposable gloves']
 KEY_WORDS_LIST_TW = ['消毒', '額溫槍', '燕麥奶', '酒精', '奶粉', '漂白水', '口罩', '乾洗手', '衛生紙', '手套']
+
+# Google Trend fetching
+GT_MAX_KEYWORDS_PER_PAYLOAD = 5
+GT_FETCH_MAX_WORKERS = 4
+GT_REQUESTS_PER_SECOND = 2.0
+GT_BURST = 4
+GT_MAX_RETRIES = 5
+GT_BACKOFF_BASE = 1.0
+GT_BACKOFF_CAP = 60.0
+# Google Trend is daily up to GT_DAILY_MAX_DAYS, longer ranges are stitched from overlapping daily windows
+GT_DAILY_MAX_DAYS = 269
+GT_STITCH_WINDOW_DAYS = 240
+GT_STITCH_OVERLAP_DAYS = 60
+
+# Data root: every folder above lives under the data root, the working directory unless DATA_ROOT_ENV is set
+DATA_ROOT_ENV = "IS590PR_DATA_ROOT"
+
+# Fixtures: JHU tables and Google Trend payloads recorded once and replayed offline
+FIXTURES_DIR = "/FIXTURES"
+FIXTURES_MODE_ENV = "IS590PR_FIXTURES_MODE"
+FIXTURES_DIR_ENV = "IS590PR_FIXTURES_DIR"
+FIXTURES_GT_DIR = "/GT"
+FIXTURES_JHU_DIR = "/JHU"
+# Google Trend timeframes of the default study of main(), 5-year and short-term, seeded for replay
+FIXTURES_GT_TIMEFRAMES = ["2015-04-19 2020-04-22", "2020-01-01 2020-04-22"]
+
+# Cache
+DATA_CACHE_DIR = "/DATA_CACHE"
+CACHE_MANIFEST = "manifest.json"
+CACHE_POSTFIX = ".npz"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+GT_SOURCE = "google_trend"
+JHU_SOURCE = "jhu_confirmed_global"
+
+# JHU time series
+JHU_DATE_FORMAT = "%m/%d/%y"
+PROVINCE_STATE = "Province/State"
+JHU_NON_DATE_COLUMNS = ["Province/State", "Country/Region", "Lat", "Long"]
+COVID_STORE_FILE = "/COVID19_store.npz"
+COVID_STORE_META_POSTFIX = ".json"
+JHU_CHUNK_ROWS = 10000
+
+# JHU US time series: one row per county, summed per Province_State
+DATA_URL_US = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US"
+JHU_US_SOURCE = "jhu_confirmed_us"
+PROVINCE_STATE_US = "Province_State"
+JHU_US_NON_DATE_COLUMNS = ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State", "Country_Region", "Lat",
+                           "Long_", "Combined_Key", "Population"]
+US_STATES = {'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+             'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'DC': 'District of Columbia', 'FL': 'Florida',
+             'GA': 'Georgia', 'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
+             'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
+             'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri',
+             'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey',
+             'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
+             'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
+             'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia',
+             'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming'}
+
+# Keyword screening
+COVID19_CUTOFF_DATE = "2020-01-01"
+IMPACTED_MIN_SKEW = 4
+IMPACTED_MAX_PAST_TREND = 50
+REPRESENTATIVE_WINDOW_DAYS = 14
+REPRESENTATIVE_MAX_PAST_TREND = 30
+REPRESENTATIVE_MIN_CURRENT_TREND = 90
+# Change points: penalty in units of noise variance x log(dates), onset rise on the 0-100 scale
+CHANGEPOINT_PENALTY = 3.0
+CHANGEPOINT_MAX = 5
+CHANGEPOINT_MIN_SIZE = 7
+CHANGEPOINT_MIN_SIGMA = 0.5
+CHANGEPOINT_MIN_MAGNITUDE = 20
+
+# Pipeline
+PIPELINE_DIR = "/PIPELINE_CACHE"
+PIPELINE_POSTFIX = ".pkl"
+PIPELINE_MAX_WORKERS = 4
+
+# Benchmark
+BENCHMARK_RESULT_FILE = "/BENCHMARK_RESULTS.json"
+BENCHMARK_REPEAT = 3
+BENCHMARK_TOLERANCE = 0.2
+
+# Instrumentation
+METRICS_LOG_FILE = "/PIPELINE_METRICS.jsonl"
+PROFILE_DIR = "/PROFILE"
+
+# Lag analysis
+LAG_MAX_DAYS = 28
+LAG_CHUNK_PAIRS = 4096
+
+# Matrix store
+MATRIX_STORE_DIR = "/MATRIX_STORE"
+MATRIX_POSTFIX = ".npy"
+MATRIX_META_POSTFIX = ".json"
+CASES_MATRIX = "CASES"
+TREND_MISSING = 255
+CASES_MISSING = -1
+
+# Batch
+BATCH_DIR = "/BATCH"
+BATCH_MAX_WORKERS = 4
+BATCH_SUMMARY_FILE = "batch_summary.json"
+
+# Awareness index
+AWARENESS_INDEX_FILE = "/AWARENESS_INDEX.sqlite"
+AWARENESS_SERVICE_PORT = 8590
+# as-of date of the latest snapshot
+AWARENESS_LATEST = "9999-12-31"
+
+# Resampling: resamples of a shard are drawn from one child seed, in chunks of at most RESAMPLING_CHUNK_ELEMENTS draws
+RESAMPLING_RESAMPLES = 10000
+RESAMPLING_CONFIDENCE = 0.95
+RESAMPLING_SEED = 590
+RESAMPLING_SHARD_SIZE = 1000
+RESAMPLING_CHUNK_ELEMENTS = 1 << 22
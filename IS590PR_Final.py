@@ -7,21 +7,33 @@ Created on Sat Apr 18 21:53:56 2020
 
 import pandas as pd
 import datetime
-import matplotlib.pyplot as plt
-from pytrends.request import TrendReq
+from typing import TYPE_CHECKING
 import Constant
-import doctest
+from alignment import align_to_periods
+from covid19_data import build_case_table, build_state_case_table, combine_case_tables, first_confirmed_dates, \
+    get_country_cases, load_COVID19_cases, load_COVID19_store, read_US_state_cases
+from data_cache import DataCache, query_key
+from fixtures import FIXTURE_MODES, data_path, data_root, jhu_source, set_data_root, use_fixtures
+from instrumentation import StageRecorder, count_request
+from keyword_screening import select_impacted_keywords, select_representative_keywords
+from pipeline import Pipeline
+from regions import REGIONS, country_geos, get_region, subregion_geos
 import os
+import time
+
+if TYPE_CHECKING:
+    from pytrends.request import TrendReq
 
 
 def create_data_folder(sub_directory: str):
     """
-    Create new folder
+    Create new folder under the data root
     :param sub_directory: the folder name
     :return: None
     >>> test_directory = "/test"
     >>> create_data_folder(test_directory)
     Successfully created the directory
+    >>> os.rmdir(data_path(test_directory))
     >>> test_directory = "/COVID_RAW_DATA"
     >>> create_data_folder(test_directory)
     /COVID_RAW_DATAData folder existed
@@ -29,9 +41,7 @@ def create_data_folder(sub_directory: str):
     >>> create_data_folder(empty_dir)
     Data folder existed
     """
-    path = os.getcwd()
-    # print("[DEBUG] The current working directory is %s" % path)
-
+    path = data_root()
     # check whether current path has data folder
     path += sub_directory
     if os.path.exists(path):
@@ -49,6 +59,7 @@ def create_data_folder(sub_directory: str):
 def get_country_df(origin_df: pd.DataFrame, country: str = "") -> pd.DataFrame:
     """
     Access the specific COVID-19 data in the target country
+    For many countries, build the case table once with build_case_table() and slice it with get_country_cases()
     :param origin_df: origin data frame has specific date range and multiple conutries
     :param country: the target country string
     :return: a pandas dataframe of COVID-19 data in the country
@@ -63,31 +74,32 @@ def get_country_df(origin_df: pd.DataFrame, country: str = "") -> pd.DataFrame:
     >>> end = datetime.datetime.strptime("01-23-20", Constant.DATE_FORMAT)
     >>> origin_df = fetch_countries_COVID19_data_with_dates(end)
     >>> tw_df = get_country_df(origin_df, Constant.TAIWAN)
-    >>> tw_df.iloc[0]["Confirmed"]
+    >>> int(tw_df.iloc[0]["Confirmed"])
     1
     """
-    if country == Constant.TW:
-        country = Constant.TAIWAN
-
-    if country not in [Constant.TAIWAN, Constant.US] or country == "" or country is None:
+    if country not in REGIONS and country not in [region.jhu_name for region in REGIONS.values()]:
         raise ValueError("No such country")
 
     if origin_df is None:
         raise ValueError("Origin data frame is not existed")
 
-    df = origin_df[origin_df['Country/Region'] == country].copy()
-    df.loc[df['Country/Region'] == 'Taiwan*', 'Country/Region'] = 'Taiwan'
-    df = pd.melt(df, id_vars='Country/Region', value_vars=df.columns[1:])
-    df.columns = ['Country', 'Date', 'Confirmed']
-    df['Date'] = pd.to_datetime(df['Date'])
+    # provinces of the country are summed into one row per day
+    df = build_case_table(origin_df[origin_df['Country/Region'] == get_region(country).jhu_name]).reset_index()
 
     return df
 
 
-def fetch_countries_COVID19_data_with_dates(end: datetime) -> pd.DataFrame:
+def fetch_countries_COVID19_data_with_dates(end: datetime, cache: DataCache = None, incremental: bool = False,
+                                            source: str = None) -> pd.DataFrame:
     """
-    Create new time-series data frame of COVID-19 by sending request to JHU open-sourced project on Github
+    Create new time-series data frame of COVID-19 by sending request to JHU open-sourced project on Github, or by
+    reading its recording when fixtures are replayed
+    In incremental mode, one local store keeps every day fetched so far, only days newer than the store are appended,
+    and any end date is answered by slicing the store.
     :param end: datetime
+    :param cache: optional DataCache keyed by the end date, used instead of the COVID19_till_<date>.csv file
+    :param incremental: use the incremental local store instead of one file per end date
+    :param source: URL or local path of the JHU table, default is the JHU Github repository or its recording
     :return: a data frame of COVID-19 within specific countries and time
     >>> fetch_countries_COVID19_data_with_dates("")
     Traceback (most recent call last):
@@ -101,28 +113,64 @@ def fetch_countries_COVID19_data_with_dates(end: datetime) -> pd.DataFrame:
         raise ValueError("Empty end date")
         return
 
-    file_path = os.getcwd() + Constant.COVID_RAW_DATA_DIR + "/COVID19_till_" + end.strftime('%Y-%m-%d') + Constant.DATA_POSTFIX_CSV
+    if incremental:
+        return load_COVID19_store(end, data_path(Constant.COVID_RAW_DATA_DIR + Constant.COVID_STORE_FILE), source)
+
+    file_path = data_path(Constant.COVID_RAW_DATA_DIR + "/COVID19_till_" + end.strftime('%Y-%m-%d') +
+                          Constant.DATA_POSTFIX_CSV)
+    cache_key = query_key(Constant.JHU_SOURCE, [], 'global', end.strftime(Constant.PLOT_DATE_FORMAT))
     whole_df = None
-    if os.path.exists(file_path) is False:
-        try:
-            request_url = Constant.DATA_URL + Constant.DATA_POSTFIX_CSV
-            whole_df = pd.read_csv(request_url, usecols=lambda x: x not in (['Province/State', 'Lat', 'Long']))
-
-        except FileNotFoundError as error:
-            print("FileNotFoundError occurs: " + repr(error))
-            return
-
-        # calculate how many columns need to save
-        start = datetime.datetime.strptime("01-22-20", Constant.DATE_FORMAT)
-        num_of_col = 1 + (end - start).days
-        whole_df = whole_df.iloc[:, 0:num_of_col + 1]
-        whole_df.to_csv(file_path, header=True, index=False)
+    if cache is not None:
+        whole_df = cache.get(cache_key)
+        if whole_df is not None:
+            return whole_df
+    elif os.path.exists(file_path):
+        return pd.read_csv(file_path)
+
+    try:
+        request_url = source if source is not None else jhu_source(Constant.DATA_URL + Constant.DATA_POSTFIX_CSV)
+        count_request(request_url)
+        whole_df = pd.read_csv(request_url, usecols=lambda x: x not in (['Province/State', 'Lat', 'Long']))
+
+    except FileNotFoundError as error:
+        print("FileNotFoundError occurs: " + repr(error))
+        return
+
+    # calculate how many columns need to save
+    start = datetime.datetime.strptime("01-22-20", Constant.DATE_FORMAT)
+    num_of_col = 1 + (end - start).days
+    whole_df = whole_df.iloc[:, 0:num_of_col + 1]
+    if cache is not None:
+        cache.put(cache_key, whole_df, {'source': Constant.JHU_SOURCE, 'geo': 'global',
+                                        'timeframe': end.strftime(Constant.PLOT_DATE_FORMAT)})
     else:
-        whole_df = pd.read_csv(file_path)
+        whole_df.to_csv(file_path, header=True, index=False)
 
     return whole_df
 
 
+def fetch_COVID19_case_table(end: datetime, countries: list, source: str = None) -> pd.DataFrame:
+    """
+    Build the case table of the countries till the end date from the incremental local store, reading only the rows
+    of the countries and the days up to the end date
+    :param end: datetime
+    :param countries: geo codes of registered regions, a subregion adds its country
+    :param source: URL or local path of the JHU table, default is the JHU Github repository or its recording
+    :return: a data frame with Confirmed indexed by the sorted (Country, Date)
+    >>> end = datetime.datetime.strptime("01-23-20", Constant.DATE_FORMAT)
+    >>> import contextlib, io
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     case_table = fetch_COVID19_case_table(end, ['TW', 'US'])
+    >>> case_table.index.get_level_values('Country').unique().tolist(), int(case_table['Confirmed'].sum())
+    (['Taiwan', 'US'], 4)
+    """
+    regions = [get_region(country) for country in countries]
+    jhu_names = sorted({region.jhu_name if region.parent is None else get_region(region.parent).jhu_name
+                        for region in regions})
+    return load_COVID19_cases(end, data_path(Constant.COVID_RAW_DATA_DIR + Constant.COVID_STORE_FILE), jhu_names,
+                              source)
+
+
 def get_keyword_list(country: str) -> list:
     """
     Access the keyword list for google search
@@ -140,33 +188,46 @@ def get_keyword_list(country: str) -> list:
         raise ValueError("Country is empty")
 
     keywords = []
-    if country == Constant.US:
-        keywords = Constant.KEY_WORDS_LIST_EN
-    elif country == Constant.TW:
-        keywords = Constant.KEY_WORDS_LIST_TW
+    if country in REGIONS:
+        keywords = REGIONS[country].keywords
 
     return keywords
 
 
-def create_google_trend_df(pytrend: TrendReq, keywords: list, region: str,
-                           start_date: str, end_date: str, save_csv: bool = False) -> pd.DataFrame:
+def create_google_trend_df(pytrend: 'TrendReq', keywords: list, region: str,
+                           start_date: str, end_date: str, save_csv: bool = False,
+                           max_workers: int = Constant.GT_FETCH_MAX_WORKERS, cache: DataCache = None,
+                           stitch: bool = False) -> pd.DataFrame:
     """
-    Create google trend data frame with list of keywords, region, start date, and end date
-    :param pytrend:
+    Create google trend data frame with list of keywords, region, start date, and end date.
+    Keywords are fetched up to 5 per request on the rate-limit-aware scheduler of trend_scheduler: requests are
+    throttled by a token bucket, at most max_workers are in flight and 429 responses are retried after a jittered
+    backoff. The number of requests, 429 responses and wall time of the fetch are kept in df.attrs['fetch_stats'].
+    With a cache, every keyword is looked up by the hash of (keyword, region, start date, end date) and only the
+    missing keywords are fetched; without it, the GT_<region>.csv file is used when it exists.
+    Google Trend is weekly for ranges longer than GT_DAILY_MAX_DAYS. With stitch, such a range is fetched as
+    overlapping daily windows that are put on one scale, and the number of windows and the stitching error are
+    kept in the fetch stats as well.
+    :param pytrend: TrendReq client, or any client with the same interface such as StubTrendReq. None creates a
+    TrendReq only if something has to be fetched
     :param keywords: a list contains keywords used to search on google trend
     :param region: the region for search
     :param start_date: the start date for search
     :param end_date: the end date for search
     :param save_csv: a boolean value for saving the file to local directory
+    :param max_workers: max number of requests in flight
+    :param cache: optional DataCache holding every keyword's trend
+    :param stitch: fetch a long range as daily windows and stitch them into a daily series
     :return: a pandas data frame of google trend data
-    >>> pytrend = TrendReq(hl='en-US', tz=360)
+    >>> from google_trend_fetcher import default_trend_client
+    >>> pytrend = default_trend_client()
     >>> start_date = "2020-01-20"
     >>> end_date = "2020-01-31"
     >>> keyword_list = ['mask', 'sanitizer', 'toilet paper']
     >>> US_df = create_google_trend_df(pytrend, keyword_list, "US", start_date, end_date)
     >>> str(US_df.iloc[-1]["date"])
     '2020-04-22 00:00:00'
-    >>> US_df.iloc[-1]["mask"]
+    >>> int(US_df.iloc[-1]["mask"])
     29
     >>> spain_df = create_google_trend_df(pytrend, keyword_list, "Spain", start_date, end_date)
     Traceback (most recent call last):
@@ -174,33 +235,43 @@ def create_google_trend_df(pytrend: TrendReq, keywords: list, region: str,
     """
     google_trend_df = None
 
-    if region not in [Constant.TW, Constant.US]:
+    if region not in REGIONS:
         raise ValueError("Region is not well defined")
         return None
 
-    file_path = os.getcwd() + Constant.GT_5_YR_DATA_DIR + "/GT_" + region + Constant.DATA_POSTFIX_CSV
+    file_path = data_path(Constant.GT_5_YR_DATA_DIR + "/GT_" + region + Constant.DATA_POSTFIX_CSV)
     if datetime.datetime.strptime(start_date, Constant.PLOT_DATE_FORMAT) > \
             datetime.datetime.strptime("2019-12-31", Constant.PLOT_DATE_FORMAT):
-        file_path = os.getcwd() + Constant.GT_RECENT_DATA_DIR + "/GT_" + region + Constant.DATA_POSTFIX_CSV
+        file_path = data_path(Constant.GT_RECENT_DATA_DIR + "/GT_" + region + Constant.DATA_POSTFIX_CSV)
+    stitch = stitch and (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days >= Constant.GT_DAILY_MAX_DAYS
+    if stitch:
+        file_path = file_path.replace(Constant.DATA_POSTFIX_CSV, "_daily" + Constant.DATA_POSTFIX_CSV)
 
-    if os.path.exists(file_path):
+    if cache is None and os.path.exists(file_path):
         google_trend_df = pd.read_csv(file_path)
         google_trend_df['date'] = pd.to_datetime(google_trend_df['date'])
         return google_trend_df
 
-    for i in range(len(keywords)):
-        pytrend.build_payload(kw_list=[keywords[i]], cat=0, timeframe=start_date + " " + end_date, geo=region, gprop='')
-        tmp_GT_df = pytrend.interest_over_time()
-        if i == 0:
-            google_trend_df = tmp_GT_df.reset_index().drop(['isPartial'], axis=1)
-        else:
-            google_trend_df[keywords[i]] = tmp_GT_df.reset_index()[keywords[i]]
+    # send the payloads concurrently within the rate limit, every finished payload is cached at once
+    if stitch:
+        from trend_stitching import fetch_google_trend_stitched
+        google_trend_df, fetch_stats = fetch_google_trend_stitched(pytrend, keywords, region, start_date, end_date,
+                                                                   cache, max_concurrency=max_workers)
+        print("[GT] " + region + ": " + str(fetch_stats['windows']) + " daily window(s), stitching error %.2f" %
+              fetch_stats['stitch_error'])
+    else:
+        from trend_scheduler import fetch_google_trend_scheduled
+        timeframe = start_date + " " + end_date
+        google_trend_df, fetch_stats = fetch_google_trend_scheduled(pytrend, keywords, region, timeframe, cache,
+                                                                    max_concurrency=max_workers)
+    print("[GT] " + region + ": " + str(fetch_stats['requests']) + " request(s), " + str(fetch_stats['rate_limited']) +
+          " rate limited in %.2fs" % fetch_stats['wall_time'])
 
     # convert the column name to English for non-English speaking countries
-    col_names = Constant.KEY_WORDS_LIST_EN.copy()
-    col_names.insert(0, 'date')
-    google_trend_df.columns = col_names
+    columns = REGIONS[region].columns
+    google_trend_df.columns = ['date'] + [columns.get(kw, kw) for kw in keywords]
     google_trend_df['date'] = pd.to_datetime(google_trend_df['date'])
+    google_trend_df.attrs['fetch_stats'] = fetch_stats
 
     if save_csv and os.path.exists(file_path) is False:
         google_trend_df.to_csv(file_path, header=True, index=False)
@@ -208,16 +279,35 @@ def create_google_trend_df(pytrend: TrendReq, keywords: list, region: str,
     return google_trend_df
 
 
+def figure_path(task: tuple) -> str:
+    """
+    Image file saved by a plot task of render_figures()
+    :param task: (plot function name, dictionary of its arguments)
+    :return: path of the image under the data root
+    >>> from figure_rendering import plot_task
+    >>> figure_path(plot_task('plot_google_trend_of_item', region='US', figure_stage='5_yrs'))[-35:]
+    '/GT_FIGURE/GoogleTrend_US_5_yrs.png'
+    """
+    plot_name, kwargs = task
+    if plot_name == 'plot_confirmed_number_and_awareness_comparison':
+        return data_root() + '/Confirmed_Number_Comparison.png'
+    figure_stage = kwargs.get('figure_stage', '') if plot_name == 'plot_google_trend_of_item' else \
+        Constant.GT_FIGURE_WITH_COMFIRMED_CASE
+    return data_root() + Constant.GT_FIGURE_NAME_PREFIX + kwargs['region'] + '_' + figure_stage + '.png'
+
+
 def plot_google_trend_of_item(df: pd.DataFrame, region: str, figure_stage='', select=[]):
     """
     Plot the google trend of each item. Item in the select list will be drew by red line. figure_stage is for figure
-    saving name.
+    saving name. The grid is sized to the number of items and every item is downsampled to PLOT_MAX_POINTS points, so
+    long daily series draw as fast as short ones.
     :param df: google trend data frame
     :param region: region of plot
     :param figure_stage:
     :param select: list of items that are selected and will be drew by red line.
     :return:
-    >>> pytrend = TrendReq(hl='en-US', tz=360)
+    >>> from google_trend_fetcher import default_trend_client
+    >>> pytrend = default_trend_client()
     >>> keyword_list = ['mask', 'sanitizer', 'toilet paper']
     >>> df = create_google_trend_df(pytrend, keyword_list, "US", "2020-01-20", "2020-01-31", True)
     >>> df.iloc[0]
@@ -238,33 +328,49 @@ def plot_google_trend_of_item(df: pd.DataFrame, region: str, figure_stage='', se
     >>> plot_google_trend_of_item(df, "US", "test2", ['mask', 'disposable gloves'])
 
     """
-    fig, ax = plt.subplots(nrows=5, ncols=2, figsize=(12, 10))
-    x = df['date']
-
-    for i in range(df.shape[1] - 1):
-        if df.columns[i + 1] in select:
-            ax[i % 5, int(i / 5)].plot(x, df[df.columns[i + 1]], color='red')
+    from downsampling import downsample_indices
+    from figure_rendering import date_axis, grid_shape, new_figure, plot_task, save_figure
+
+    items = list(df.columns[1:])
+    nrows, ncols = grid_shape(len(items))
+    fig = new_figure((Constant.GT_PANEL_SIZE[0] * ncols, Constant.GT_PANEL_SIZE[1] * nrows))
+    ax = fig.subplots(nrows=nrows, ncols=ncols, squeeze=False)
+    x = df['date'].to_numpy()
+    values = df[items].to_numpy(dtype=float)
+    # every item keeps the peaks and dips of its own series
+    kept_rows = downsample_indices(values)
+
+    for i, item in enumerate(items):
+        panel = ax[i % nrows, i // nrows]
+        if item in select:
+            panel.plot(x[kept_rows[i]], values[kept_rows[i], i], color='red')
         else:
-            ax[i % 5, int(i / 5)].plot(x, df[df.columns[i + 1]])
-        ax[i % 5, int(i / 5)].grid(True)
-        ax[i % 5, int(i / 5)].set_title(region + ' - ' + df.columns[i + 1], fontsize=14)
-        ax[i % 5, int(i / 5)].set_ylabel('Google Trend', fontsize=12)
-
-    fig.autofmt_xdate()
+            panel.plot(x[kept_rows[i]], values[kept_rows[i], i])
+        panel.grid(True)
+        panel.set_title(region + ' - ' + item, fontsize=14)
+        panel.set_ylabel('Google Trend', fontsize=12)
+        date_axis(panel)
+    for i in range(len(items), nrows * ncols):
+        fig.delaxes(ax[i % nrows, i // nrows])
+
+    fig.autofmt_xdate(rotation=0, ha='center')
     fig.tight_layout()
-    file_path = os.getcwd() + Constant.GT_FIGURE_NAME_PREFIX + region + '_' + figure_stage + '.png'
-    fig.savefig(file_path, bbox_inches="tight")
+    save_figure(fig, figure_path(plot_task('plot_google_trend_of_item', region=region, figure_stage=figure_stage)))
 
 
-def select_item_impacted_by_covid19(df: pd.DataFrame) -> list:
+def select_item_impacted_by_covid19(df: pd.DataFrame, min_skew: float = Constant.IMPACTED_MIN_SKEW,
+                                    max_past_trend: float = Constant.IMPACTED_MAX_PAST_TREND) -> list:
     """
     Select the items impacted by COVID-19 in long-term observation.
     The selection criteria:
     1. high skew of the trend (extreme left skew)
     2. low max value of the search volume before COVID-19
     :param df: google trend dataframe of the items
+    :param min_skew: skew an item has to exceed
+    :param max_past_trend: max search volume before COVID-19 an item has to stay under
     :return: list of items impacted by COVID-19
-    >>> pytrend = TrendReq(hl='en-US', tz=360)
+    >>> from google_trend_fetcher import default_trend_client
+    >>> pytrend = default_trend_client()
     >>> start_date = "2015-04-19"
     >>> end_date = "2020-04-22"
     >>> keyword_list = get_keyword_list(Constant.US)
@@ -279,16 +385,14 @@ def select_item_impacted_by_covid19(df: pd.DataFrame) -> list:
     if df is None:
         raise ValueError("Data frame not exist")
 
-    kw_list = []
-    for item in df.columns[1:]:
-        skew = df[item].skew()
-        past_max = df[df['date'].dt.date < datetime.date(2020, 1, 1)][item].max()
-        if skew > 4 and past_max < 50:
-            kw_list.append(item)
-    return kw_list
+    # skew and max before 2020 of every keyword are computed at once
+    return select_impacted_keywords(df, min_skew=min_skew, max_past_trend=max_past_trend)
 
 
-def select_representative_kw(df: pd.DataFrame, impacted_item: list) -> (list, dict):
+def select_representative_kw(df: pd.DataFrame, impacted_item: list,
+                             window_days: int = Constant.REPRESENTATIVE_WINDOW_DAYS,
+                             max_past_trend: float = Constant.REPRESENTATIVE_MAX_PAST_TREND,
+                             min_current_trend: float = Constant.REPRESENTATIVE_MIN_CURRENT_TREND) -> (list, dict):
     """
     Select the representative items which has sharp increase due to COVID-19.
     The selection criteria:
@@ -297,8 +401,12 @@ def select_representative_kw(df: pd.DataFrame, impacted_item: list) -> (list, di
     - Create a dictionary for record of items' max value date
     :param df: google trend dataframe of the items
     :param impacted_item: items list generated by select_item_impacted_by_covid19()
+    :param window_days: days of the sharp increase before the peak
+    :param max_past_trend: max search volume before the sharp increase an item has to stay under
+    :param min_current_trend: max search volume during COVID-19 an item has to exceed
     :return: representative keywords list and dictionary of items' trend max date
-    >>> pytrend = TrendReq(hl='en-US', tz=360)
+    >>> from google_trend_fetcher import default_trend_client
+    >>> pytrend = default_trend_client()
     >>> start_date = "2015-04-19"
     >>> end_date = "2020-04-22"
     >>> keyword_list = get_keyword_list(Constant.US)
@@ -318,18 +426,9 @@ def select_representative_kw(df: pd.DataFrame, impacted_item: list) -> (list, di
         raise ValueError("Data frame not exist")
     if impacted_item != []:
         df = pd.concat([df['date'], df[impacted_item]], sort=False, axis=1)
-    kw_list = []
-    keywords_maxdate_pairs = {}
-    for item in df.columns[1:]:
-        max_idx = df[item].idxmax()
-        keywords_maxdate_pairs[item] = df['date'][max_idx]
-        # Use two weeks as sharply increase time. So the local max value before global max value should be low.
-        date_bound = df['date'][max_idx] - datetime.timedelta(days=14)
-        past_max = df[df['date'] < date_bound][item].max()
-        current_max = df[df['date'] > date_bound][item].max()
-        if past_max < 30 and current_max > 90:
-            kw_list.append(item)
-    return kw_list, keywords_maxdate_pairs
+    # Use two weeks as sharply increase time. So the local max value before global max value should be low.
+    return select_representative_keywords(df, window_days=window_days, max_past_trend=max_past_trend,
+                                          min_current_trend=min_current_trend)
 
 
 def plot_items_with_confirmed_case(region_df: pd.DataFrame, item_name_list: list, first_confirmed_date: datetime,
@@ -341,7 +440,8 @@ def plot_items_with_confirmed_case(region_df: pd.DataFrame, item_name_list: list
     :param item_name_list: representative keywords list
     :param region: region of plot
     :return: None
-    >>> pytrend = TrendReq(hl='en-US', tz=360)
+    >>> from google_trend_fetcher import default_trend_client
+    >>> pytrend = default_trend_client()
     >>> start_date = "2015-04-19"
     >>> end_date = "2020-04-22"
     >>> keyword_list = get_keyword_list(Constant.US)
@@ -351,34 +451,34 @@ def plot_items_with_confirmed_case(region_df: pd.DataFrame, item_name_list: list
     Traceback (most recent call last):
     ValueError: Data frame not exist
     """
+    from downsampling import downsample_frame
+    from figure_rendering import date_axis, new_figure, plot_task, save_figure
+
     if region_df is None:
         raise ValueError("Data frame not exist")
 
-    x = region_df['date'].dt.date
-    fig, ax = plt.subplots(figsize=(10, 4))
+    region_df = downsample_frame(region_df, ['Confirmed'] + list(item_name_list))
+    x = region_df['date']
+    fig = new_figure((10, 4))
+    ax = fig.subplots()
     ax.plot(x, region_df['Confirmed'], lw=2, label='Confirmed Num', color='black')
     ax.axvline(x=first_confirmed_date, color='darkred')
     ax.text(first_confirmed_date - datetime.timedelta(days=15), region_df['Confirmed'].max() / 3,
             'first confirmed date', bbox={'facecolor': 'white', 'pad': 5})
     ax.grid(True)
-    ax.set_xticks(x[::3])
-    ax.set_xticklabels(x[::3], rotation=45)
+    date_axis(ax)
     ax.set_title(region, fontsize=20)
     ax.set_ylabel('Confirmed Number', fontsize=18, color="black")
 
     ax2 = ax.twinx()
     for i in item_name_list:
         ax2.plot(x, region_df[i], lw=2, label=i)
-    ax2.set_xticks(x[::3])
-    ax2.set_xticklabels(x[::3], rotation=45)
     ax2.set_ylabel('Google Trend', fontsize=18, color="Red")
     lines, labels = ax.get_legend_handles_labels()
     lines2, labels2 = ax2.get_legend_handles_labels()
     ax2.legend(lines + lines2, labels + labels2, fontsize=8, loc='upper left')
 
-    file_path = os.getcwd() + Constant.GT_FIGURE_NAME_PREFIX + region + '_' + \
-                Constant.GT_FIGURE_WITH_COMFIRMED_CASE + '.png'
-    fig.savefig(file_path, bbox_inches="tight")
+    save_figure(fig, figure_path(plot_task('plot_items_with_confirmed_case', region=region)))
 
 
 def convert_country_abbreviation_to_fullname(abbreviation: str) -> str:
@@ -389,8 +489,8 @@ def convert_country_abbreviation_to_fullname(abbreviation: str) -> str:
     >>> convert_country_abbreviation_to_fullname("TW")
     'Taiwan*'
     """
-    if abbreviation == Constant.TW:
-        return Constant.TAIWAN
+    if abbreviation in REGIONS:
+        return REGIONS[abbreviation].jhu_name
     else:
         return None
 
@@ -407,7 +507,8 @@ def awareness_date_report(first_confirmed_date: datetime, keywords_max_dates_pai
     :return: dictionary that record the first confirmed date, awareness date and time gap between first confirmed
     date and awareness date
     >>> first_confirmed_date = datetime.date(2020, 1, 21)
-    >>> pytrend = TrendReq(hl='en-US', tz=360)
+    >>> from google_trend_fetcher import default_trend_client
+    >>> pytrend = default_trend_client()
     >>> start_date = "2015-04-19"
     >>> end_date = "2020-04-22"
     >>> keyword_list = get_keyword_list(Constant.US)
@@ -431,193 +532,484 @@ def awareness_date_report(first_confirmed_date: datetime, keywords_max_dates_pai
     return report
 
 
-def plot_confirmed_number_and_awareness_comparison(data_manager: dict, region1: str, region2: str):
+def awareness_table(first_confirmed_dates: dict, **keywords_max_dates_pairs) -> pd.DataFrame:
+    """
+    Report the awareness of every region at once: the time gaps between the first confirmed date and the max date of
+    every item of every region are computed in one pass and averaged per region, like awareness_date_report() does.
+    :param first_confirmed_dates: dictionary of every region's first confirmed date
+    :param keywords_max_dates_pairs: region=dictionary of each item's google trend max date
+    :return: data frame indexed by region with the first confirmed date, time gap, awareness date and number of items,
+    from the most aware region
+    >>> table = awareness_table({'TW': datetime.date(2020, 1, 21), 'US': datetime.date(2020, 1, 22)},
+    ...                         TW={'mask': pd.Timestamp('2020-02-01'), 'milk': pd.Timestamp('2020-02-04')},
+    ...                         US={'mask': pd.Timestamp('2020-03-15')})
+    >>> table['awareness_time_gap(days)'].to_dict(), table['items'].to_dict()
+    ({'TW': 12, 'US': 53}, {'TW': 2, 'US': 1})
+    >>> table.loc['TW', 'mean_awareness_date']
+    datetime.date(2020, 2, 2)
     """
-    Plot confirmed number trend with first confirmed date and awareness date for two countries comparison.
-    :param data_manager:
-    :param region1: 1st country name
-    :param region2: 2nd country name
+    peaks = pd.DataFrame([(region, date) for region, pairs in keywords_max_dates_pairs.items()
+                          for date in pairs.values()], columns=['region', 'max_date'])
+    first_dates = pd.to_datetime(pd.Series(first_confirmed_dates))
+    peaks['time_gap'] = (pd.to_datetime(peaks['max_date']).dt.normalize() - peaks['region'].map(first_dates)).dt.days
+
+    # int() of the mean like awareness_date_report(), so the gap is truncated toward zero
+    grouped = peaks.groupby('region')['time_gap']
+    time_gap = (grouped.sum() / grouped.count()).astype(int)
+    first_dates = first_dates[time_gap.index]
+    table = pd.DataFrame({'first_confirmed_date': first_dates.dt.date, 'awareness_time_gap(days)': time_gap,
+                          'mean_awareness_date': (first_dates + pd.to_timedelta(time_gap, unit='D')).dt.date,
+                          'items': grouped.count()})
+    table.index.name = 'region'
+    return table.sort_values('awareness_time_gap(days)', kind='stable')
+
+
+def plot_confirmed_number_and_awareness_comparison(data_manager: dict, *regions):
+    """
+    Plot confirmed number trend with first confirmed date and awareness date of every region on a grid of small
+    multiples: one column for up to two regions, COMPARISON_GRID_COLUMNS columns for more.
+    :param data_manager: region -> merged data frame, awareness report and optional (low, high) confidence interval of
+    the awareness time gap of the region
+    :param regions: regions to compare, default is every region of data_manager
     :return:
     >>> plot_confirmed_number_and_awareness_comparison({}, 'TW', 'US')
     Traceback (most recent call last):
     ValueError: Data manager is null
     """
+    from downsampling import downsample_frame
+    from figure_rendering import date_axis, new_figure, plot_task, save_figure
+
     if data_manager == {}:
         raise ValueError("Data manager is null")
 
-    # 1st country's merged data frame of items google trend and confirmed number
-    region1_df = data_manager[region1]['COVID_19_with_google_trend']
-    region1_awareness_report = data_manager[region1]['awareness_report']
-
-    # 2nd country's merged data frame of items google trend and confirmed number
-    region2_df = data_manager[region2]['COVID_19_with_google_trend']
-    region2_awareness_report = data_manager[region2]['awareness_report']
-
-    fig, ax = plt.subplots(nrows=2, ncols=1, figsize=(12, 10))
-    for i in range(2):
-        if i == 0:
-            region_df, region, region_awareness_report = region1_df, region1, region1_awareness_report
-        else:
-            region_df, region, region_awareness_report = region2_df, region2, region2_awareness_report
-        x = region_df['date'].dt.date
-
-        ax[i].plot(x, region_df['Confirmed'], lw=2, label='Confirmed Number')
-        ax[i].axvline(x=region_awareness_report['first_confirmed_date'], color='darkred', lw=2)
-        ax[i].text(region_awareness_report['first_confirmed_date'] - datetime.timedelta(days=8),
-                   region_df['Confirmed'].max() / 3, 'first confirmed date', bbox={'facecolor': 'white', 'pad': 5})
-        ax[i].axvline(x=region_awareness_report['mean_awareness_date'], color='darkred', lw=2)
-        ax[i].text(region_awareness_report['mean_awareness_date'] - datetime.timedelta(days=5),
-                   region_df['Confirmed'].max() / 2, 'awareness date', bbox={'facecolor': 'white', 'pad': 5})
-        ax[i].axvspan(region_awareness_report['first_confirmed_date'], region_awareness_report['mean_awareness_date'],
-                      alpha=0.5, color='yellow')
-        ax[i].text(region_awareness_report['mean_awareness_date'] - datetime.timedelta(
+    regions = list(regions) if regions != () else list(data_manager)
+    ncols = 1 if len(regions) <= 2 else Constant.COMPARISON_GRID_COLUMNS
+    nrows = -(-len(regions) // ncols)
+    fig = new_figure((12 if ncols == 1 else 6 * ncols, 5 * nrows))
+    axes = fig.subplots(nrows=nrows, ncols=ncols, squeeze=False).ravel()
+    for ax, region in zip(axes, regions):
+        # merged data frame of items google trend and confirmed number, and awareness report of the region
+        region_df = data_manager[region]['COVID_19_with_google_trend']
+        region_awareness_report = data_manager[region]['awareness_report']
+        region_df = downsample_frame(region_df, ['Confirmed'])
+        x = region_df['date']
+
+        ax.plot(x, region_df['Confirmed'], lw=2, label='Confirmed Number')
+        ax.axvline(x=region_awareness_report['first_confirmed_date'], color='darkred', lw=2)
+        ax.text(region_awareness_report['first_confirmed_date'] - datetime.timedelta(days=8),
+                region_df['Confirmed'].max() / 3, 'first confirmed date', bbox={'facecolor': 'white', 'pad': 5})
+        ax.axvline(x=region_awareness_report['mean_awareness_date'], color='darkred', lw=2)
+        ax.text(region_awareness_report['mean_awareness_date'] - datetime.timedelta(days=5),
+                region_df['Confirmed'].max() / 2, 'awareness date', bbox={'facecolor': 'white', 'pad': 5})
+        ax.axvspan(region_awareness_report['first_confirmed_date'], region_awareness_report['mean_awareness_date'],
+                   alpha=0.5, color='yellow')
+        if 'awareness_interval' in data_manager[region]:
+            # bootstrap confidence interval of the awareness date
+            low, high = data_manager[region]['awareness_interval']
+            ax.axvspan(region_awareness_report['first_confirmed_date'] + datetime.timedelta(days=low),
+                       region_awareness_report['first_confirmed_date'] + datetime.timedelta(days=high),
+                       alpha=0.3, color='darkorange', label='awareness date confidence interval')
+        ax.text(region_awareness_report['mean_awareness_date'] - datetime.timedelta(
             days=region_awareness_report['awareness_time_gap(days)'] / 2 + 3), region_df['Confirmed'].max() / 1.5,
-                   str(int(region_awareness_report['awareness_time_gap(days)'])) + ' days',
-                   bbox={'boxstyle': 'darrow,pad=0.8', 'fc': 'r', 'ec': 'k', 'alpha': 0.5})
-        ax[i].grid(True)
-        ax[i].set_xticks(x[::3])
-        ax[i].set_xticklabels(x[::3], rotation=45)
-        ax[i].set_title(region, fontsize=20)
-        ax[i].set_ylabel('Google Trend', fontsize=18, color='blue')
-        ax[i].legend()
+                str(int(region_awareness_report['awareness_time_gap(days)'])) + ' days',
+                bbox={'boxstyle': 'darrow,pad=0.8', 'fc': 'r', 'ec': 'k', 'alpha': 0.5})
+        ax.grid(True)
+        date_axis(ax)
+        ax.set_title(region, fontsize=20)
+        ax.set_ylabel('Google Trend', fontsize=18, color='blue')
+        ax.legend()
+    for ax in axes[len(regions):]:
+        fig.delaxes(ax)
     fig.tight_layout()
-    fig.savefig('Confirmed_Number_Comparison.png', bbox_inches="tight")
+    save_figure(fig, figure_path(plot_task('plot_confirmed_number_and_awareness_comparison')))
 
 
-if __name__ == '__main__':
+def merge_google_trend_with_cases(gt_df: pd.DataFrame, representative_items: list, country_COVID_19_df: pd.DataFrame,
+                                  country: str) -> pd.DataFrame:
+    """
+    Combine confirmed data and the google trend of the representative items. The confirmed number of every google
+    trend date is the cumulative count as of the last day of its period, so weekly and monthly trends get the count
+    at the end of their week or month instead of the count of their first day.
+    :param gt_df: daily, weekly or monthly google trend data frame
+    :param representative_items: representative keywords list
+    :param country_COVID_19_df: COVID-19 data frame of the country
+    :param country: country abbreviation
+    :return: merged data frame of items google trend and confirmed number
+    >>> gt_df = pd.DataFrame({'date': pd.to_datetime(['2020-01-21', '2020-01-22']), 'mask': [10, 100], 'milk': [1, 2]})
+    >>> cases_df = pd.DataFrame({'Country': ['US'], 'Date': pd.to_datetime(['2020-01-22']), 'Confirmed': [1]})
+    >>> merge_google_trend_with_cases(gt_df, ['mask'], cases_df, 'US')
+            date  mask Country  Confirmed
+    0 2020-01-21    10      US        0.0
+    1 2020-01-22   100      US        1.0
+    >>> weekly_df = pd.DataFrame({'date': pd.to_datetime(['2020-01-19', '2020-01-26']), 'mask': [10, 100]})
+    >>> cases_df = pd.DataFrame({'Country': 'US', 'Date': pd.date_range('2020-01-22', periods=7),
+    ...                          'Confirmed': [1, 1, 2, 2, 5, 5, 8]})
+    >>> merge_google_trend_with_cases(weekly_df, ['mask'], cases_df, 'US')['Confirmed'].tolist()
+    [2.0, 8.0]
+    """
+    # Use final representative keywords of google trend
+    new_country_GT_df = pd.concat([gt_df['date'], gt_df[representative_items]], sort=False, axis=1)
+
+    # as-of join of the confirmed number on the google trend periods
+    confirmed = country_COVID_19_df.set_index('Date')[['Confirmed']]
+    new_country_GT_df['Country'] = get_region(country).case_name
+    aligned = align_to_periods(gt_df['date'], confirmed, how='last')
+    new_country_GT_df['Confirmed'] = aligned['Confirmed'].fillna(0).to_numpy()
+    return new_country_GT_df
+
+
+def comparison_plot_task(regions: list, significance: pd.DataFrame = None, **merged_dfs_and_reports) -> tuple:
+    """
+    Pack plot_confirmed_number_and_awareness_comparison() of many countries as a task of render_figures()
+    :param regions: regions to compare
+    :param significance: optional awareness time gap intervals of awareness_significance()
+    :param merged_dfs_and_reports: <region>_df=merged data frame and <region>_report=awareness report of every region
+    :return: (plot function name, dictionary of its arguments)
+    """
+    from figure_rendering import plot_task
+
+    data_manager = {region: {'COVID_19_with_google_trend': merged_dfs_and_reports[region + '_df'],
+                             'awareness_report': merged_dfs_and_reports[region + '_report']} for region in regions}
+    if significance is not None:
+        for region in regions:
+            if region in significance.index:
+                data_manager[region]['awareness_interval'] = (significance.loc[region, 'ci_low'],
+                                                              significance.loc[region, 'ci_high'])
+    return plot_task('plot_confirmed_number_and_awareness_comparison', data_manager=data_manager)
+
+
+def build_analysis_pipeline(selected_countries: list, end_date: datetime, gt_start_date: str,
+                            gt_recent_start_date: str, gt_end_date: str, impacted_thresholds: dict = None,
+                            representative_thresholds: dict = None,
+                            cache: DataCache = None, recorder: StageRecorder = None,
+                            max_lag: int = Constant.LAG_MAX_DAYS, stitch_5_yr: bool = False, keywords: dict = None,
+                            store_dir: str = None, prune_stale: bool = True, screening: str = 'threshold',
+                            awareness_signal: str = 'peak', changepoint_thresholds: dict = None,
+                            resampling: dict = None, resampling_workers: int = None) -> Pipeline:
+    """
+    Build the analysis as a stage DAG. Each country has its own branch of stages named '<stage>:<country>':
+    cases, gt_5_yr, gt_recent, impacted, representative, onsets, merged, awareness and the plot stages. The first
+    confirmed dates, the awareness table, its significance and the comparison plot are shared by every country. Only
+    stages whose parameters or inputs changed since the last run are computed again. When US states are selected,
+    their cases are summed from the JHU US county table and stacked on the country case table.
+    :param selected_countries: geo codes of registered regions
+    :param end_date: last day of COVID-19 data
+    :param gt_start_date: start date of the long-term google trend
+    :param gt_recent_start_date: start date of the short-term google trend
+    :param gt_end_date: end date of the google trend
+    :param impacted_thresholds: keyword arguments of select_item_impacted_by_covid19()
+    :param representative_thresholds: keyword arguments of select_representative_kw()
+    :param cache: the DataCache of google trend
+    :param recorder: optional StageRecorder of every stage's metrics
+    :param max_lag: largest lag in days of the cross-correlation between search interest and new cases
+    :param stitch_5_yr: stitch the long-term google trend from daily windows instead of weekly points
+    :param keywords: geo code -> keywords to search, default is the keywords of the registered region
+    :param store_dir: folder of the stage outputs, default is PIPELINE_CACHE of the data root
+    :param prune_stale: remove the outputs of older fingerprints, False when several studies share the store
+    :param screening: 'threshold' for the skew, window and max thresholds, 'changepoint' for the onsets of
+    change_points.py
+    :param awareness_signal: 'peak' to date the awareness by the max dates of the items, 'onset' by their onsets
+    :param changepoint_thresholds: penalty and min_magnitude of the change point screening and onsets
+    :param resampling: resamples, confidence and seed of awareness_significance()
+    :param resampling_workers: number of processes of the resampling, default is the number of CPUs
+    :return: the pipeline
+    """
+    from change_points import onset_dates, onset_table, select_changepoint_impacted, select_changepoint_representative
+    from figure_rendering import plot_task
+    from lag_analysis import lag_table
+    from resampling import awareness_significance
+
+    if screening not in ['threshold', 'changepoint'] or awareness_signal not in ['peak', 'onset']:
+        raise ValueError("Screening or awareness signal is not well defined")
+    changepoint_thresholds = {} if changepoint_thresholds is None else changepoint_thresholds
+    onset_options = {key: value for key, value in changepoint_thresholds.items() if key != 'min_magnitude'}
+    if screening == 'changepoint':
+        impacted_func, impacted_thresholds = select_changepoint_impacted, changepoint_thresholds
+        representative_func, representative_thresholds = select_changepoint_representative, changepoint_thresholds
+    else:
+        impacted_func, representative_func = select_item_impacted_by_covid19, select_representative_kw
+    store_dir = data_path(Constant.PIPELINE_DIR) if store_dir is None else store_dir
+    pipeline = Pipeline(store_dir, recorder=recorder, prune_stale=prune_stale)
+    if any(REGIONS[country].parent is not None for country in selected_countries if country in REGIONS):
+        pipeline.add_stage('covid19_us_raw', read_US_state_cases, params={'end': end_date})
+        pipeline.add_stage('state_case_table', build_state_case_table, inputs={'us_df': 'covid19_us_raw'})
+        pipeline.add_stage('country_case_table', fetch_COVID19_case_table,
+                           params={'end': end_date, 'countries': selected_countries})
+        pipeline.add_stage('case_table', combine_case_tables,
+                           inputs={'country_table': 'country_case_table', 'state_table': 'state_case_table'})
+    else:
+        pipeline.add_stage('case_table', fetch_COVID19_case_table,
+                           params={'end': end_date, 'countries': selected_countries})
+    pipeline.add_stage('first_confirmed_dates', first_confirmed_dates, inputs={'case_table': 'case_table'},
+                       params={'countries': selected_countries})
+
+    for country in selected_countries:
+        keyword_list = get_keyword_list(country) if keywords is None or country not in keywords else keywords[country]
+        pipeline.add_stage('cases:' + country, get_country_cases, inputs={'case_table': 'case_table'},
+                           params={'country': country})
+
+        # Long-term(5 years) google trend for observing the search trend and short-term(this year) google trend
+        pipeline.add_stage('gt_5_yr:' + country, create_google_trend_df,
+                           params={'pytrend': None, 'keywords': keyword_list, 'region': country,
+                                   'start_date': gt_start_date, 'end_date': gt_end_date, 'stitch': stitch_5_yr},
+                           resources={'cache': cache})
+        pipeline.add_stage('gt_recent:' + country, create_google_trend_df,
+                           params={'pytrend': None, 'keywords': keyword_list, 'region': country,
+                                   'start_date': gt_recent_start_date, 'end_date': gt_end_date},
+                           resources={'cache': cache})
+
+        # Select the items that impacted by COVID-19 from the long-term google trend, then the representative items
+        # which has sharp increase google trend during COVID-19 from the short-term google trend
+        pipeline.add_stage('impacted:' + country, impacted_func,
+                           inputs={'df': 'gt_5_yr:' + country}, params=impacted_thresholds)
+        pipeline.add_stage('representative:' + country, representative_func,
+                           inputs={'df': 'gt_recent:' + country, 'impacted_item': 'impacted:' + country},
+                           params=representative_thresholds)
+        # Onset of the items whose max dates date the awareness, when the awareness is dated by the onsets
+        pipeline.add_stage('onsets:' + country, onset_dates,
+                           inputs={'df': 'gt_recent:' + country, 'keywords': ('representative:' + country, 1)},
+                           params=onset_options)
+        signal = ('representative:' + country, 1) if awareness_signal == 'peak' else 'onsets:' + country
+
+        # Combine confirmed data and google trend data, then report the awareness date
+        pipeline.add_stage('merged:' + country, merge_google_trend_with_cases,
+                           inputs={'gt_df': 'gt_recent:' + country,
+                                   'representative_items': ('representative:' + country, 0),
+                                   'country_COVID_19_df': 'cases:' + country}, params={'country': country})
+        pipeline.add_stage('awareness:' + country, awareness_date_report,
+                           inputs={'keywords_max_dates_pairs': signal,
+                                   'first_confirmed_date': ('first_confirmed_dates', country)})
+
+        # Figures of the country
+        pipeline.add_stage('plot_5_yr:' + country, plot_task, inputs={'df': 'gt_5_yr:' + country},
+                           params={'plot_name': 'plot_google_trend_of_item', 'region': country,
+                                   'figure_stage': Constant.GT_FIGURE_5_YR}, code=[plot_google_trend_of_item])
+        pipeline.add_stage('plot_5_yr_significant:' + country, plot_task,
+                           inputs={'df': 'gt_5_yr:' + country, 'select': 'impacted:' + country},
+                           params={'plot_name': 'plot_google_trend_of_item', 'region': country,
+                                   'figure_stage': Constant.GT_FIGURE_5_YR_SIGNIFICANT},
+                           code=[plot_google_trend_of_item])
+        pipeline.add_stage('plot_representative:' + country, plot_task,
+                           inputs={'df': 'gt_recent:' + country, 'select': ('representative:' + country, 0)},
+                           params={'plot_name': 'plot_google_trend_of_item', 'region': country,
+                                   'figure_stage': 'representative'}, code=[plot_google_trend_of_item])
+        pipeline.add_stage('plot_with_confirmed_case:' + country, plot_task,
+                           inputs={'region_df': 'merged:' + country,
+                                   'item_name_list': ('representative:' + country, 0),
+                                   'first_confirmed_date': ('first_confirmed_dates', country)},
+                           params={'plot_name': 'plot_items_with_confirmed_case', 'region': country},
+                           code=[plot_items_with_confirmed_case])
+
+    # Does search interest lead the new cases? Cross-correlation of every keyword with the new cases of its country,
+    # on the daily short-term trend and on the weekly long-term trend against weekly sums of new cases
+    for lag_stage, trend_stage in [('lag_table', 'gt_recent:'), ('lag_table_5_yr', 'gt_5_yr:')]:
+        lag_inputs = {country: trend_stage + country for country in selected_countries}
+        lag_inputs['case_table'] = 'case_table'
+        pipeline.add_stage(lag_stage, lag_table, inputs=lag_inputs, params={'max_lag': max_lag})
+
+    # Onset and rise of every keyword of every country, detected on one keyword x country matrix
+    pipeline.add_stage('onset_table', onset_table,
+                       inputs={country: 'gt_recent:' + country for country in selected_countries},
+                       params={'options': onset_options})
+
+    # Awareness of every country in one table
+    table_inputs = {country: ('representative:' + country, 1) if awareness_signal == 'peak' else 'onsets:' + country
+                    for country in selected_countries}
+    table_inputs['first_confirmed_dates'] = 'first_confirmed_dates'
+    pipeline.add_stage('awareness_table', awareness_table, inputs=table_inputs)
+    # Confidence intervals of the time gaps and p-values of the differences between countries
+    pipeline.add_stage('awareness_significance', awareness_significance, inputs=table_inputs, params=resampling,
+                       resources={'max_workers': resampling_workers})
+
+    # Plot confirmed number trend and time gap between first confirmed date and awareness date of every country.
+    if len(selected_countries) >= 2:
+        comparison_inputs = {}
+        for country in selected_countries:
+            comparison_inputs[country + '_df'] = 'merged:' + country
+            comparison_inputs[country + '_report'] = 'awareness:' + country
+        comparison_inputs['significance'] = ('awareness_significance', 0)
+        pipeline.add_stage('plot_comparison', comparison_plot_task, inputs=comparison_inputs,
+                           params={'regions': selected_countries},
+                           code=[plot_confirmed_number_and_awareness_comparison])
+    return pipeline
+
+
+def main(argv: list = None):
     """
     Hypothesis 1:
     Steps:
-    1) Pick 10 popular items in Google Trend during COVID-19 from Journals and other resources  
+    1) Pick 10 popular items in Google Trend during COVID-19 from Journals and other resources
     2) In a macro viewpoint: Find the item which increase because of COVID-19 by examining each popular item in a 5-year trend
     3) In a micro viewpoint: Find representative item by filtering time interval
-    
+
     Hypothesis 2:
     1) Plot to see the trend between COVID-19 and popular items
     2) Find the time interval between the time of the 1st confirmed case and the time of the max volume of each popular item
     3) Determine which country has better public awareness about the COVID-19 by comparing the time inteval in different region
-    """
-    # ------------------------------------------------------------------------------------------------------
-    # Create COVID-19 data frame from start date to end date (default is 04-22-2020)
-    create_data_folder(Constant.COVID_RAW_DATA_DIR)
-    end_date = datetime.datetime.strptime("04-22-20", Constant.DATE_FORMAT)
-    df = fetch_countries_COVID19_data_with_dates(end_date)
 
-    # Establish the target countries in Abbreviation format
-    selected_countries = [Constant.TW, Constant.US]
-
-    """
-    data_manager:{
-        'TW': {'COVID_19_raw_data': COVID_df, 'GT_DF': GT_DF},
-        'US': {'COVID_19_raw_data': COVID_df, 'GT_DF': GT_DF}
-    }
+    Subcommands run the analysis up to a step: fetch, store, screen, report, significance, index, lag or plot. Every
+    step is a stage of build_analysis_pipeline(), so a run only computes the stages whose inputs or thresholds
+    changed, only loads pytrends when some keyword is missing from the cache, and only plot loads matplotlib. store
+    writes the case matrix and every google trend frame into the memory-mapped matrix store. significance prints the
+    confidence intervals of the awareness time gaps and the p-values of their differences. index refreshes the
+    awareness index that awareness_index.py serves.
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    >>> import contextlib, io, tempfile
+    >>> from fixtures import fixture_mode, offline_run, project_dir
+    >>> output = io.StringIO()
+    >>> with offline_run(data_root(), *fixture_mode()), contextlib.redirect_stdout(output):
+    ...     main(['report', '--countries', 'TW', 'US', '--fixtures', 'replay', '--fixtures-dir',
+    ...           project_dir() + Constant.FIXTURES_DIR, '--data-root', tempfile.mkdtemp()])
+    >>> print('\\n'.join(output.getvalue().splitlines()[-3:-1]))
+    TW               2020-01-22                        10          2020-02-01      6
+    US               2020-01-22                        56          2020-03-18      9
     """
-    data_manager = {}
-
-    # ------------------------------------------------------------------------------------------------------
-    # Store each country's COVID-19 data frame
-    for country in selected_countries:
-        country_raw_df = get_country_df(df, country)
-        data_manager[country] = {}
-        data_manager[country]["COVID_19_raw_data"] = country_raw_df
-        # print("--------- country " + country + "---------------------------------")
-        # print(country_raw_df.head(10))
-
-    # ------------------------------------------------------------------------------------------------------
-    # Plot the long-term(5 years) google trend of each item for observing the search trend.
-    create_data_folder(Constant.GT_5_YR_DATA_DIR)
-    pytrend = TrendReq(hl='en-US', tz=360)
-    gt_start_date = "2015-04-19"
-    gt_end_date = "2020-04-22"
-    create_data_folder(Constant.GT_FIGURE_DIR)
-
-    for country in selected_countries:
-        keyword_list = get_keyword_list(country)
-
-        # Create long-term(5 years) google trend for observation
-        gt_country_raw_df = create_google_trend_df(pytrend, keyword_list, country, gt_start_date, gt_end_date, True)
-        data_manager[country]["GT_DF"] = gt_country_raw_df
-
-        # Plot the long-term(5 years) google trend of each item for observing the search trend.
-        plot_google_trend_of_item(gt_country_raw_df, country, Constant.GT_FIGURE_5_YR)
-
-    # ------------------------------------------------------------------------------------------------------
-    # Select the items that impacted by COVID-19, then plot it
-    # We assume that all items would have very low search volume before COVID-19
-    # , but reach high search volume during the COVID-19 outbreak.
-    # The selection criteria:
-    # 1. high skew of the trend (extreme left skew)
-    # 2. low max value of the search volume before COVID-19
-    # Plot the long-term(5 years) google trend of the items which is highly impacted by COVID-19 (in red)
-    for country in selected_countries:
-        GT_df = data_manager[country]["GT_DF"]
-        impacted_keyword_list = select_item_impacted_by_covid19(GT_df)
-        data_manager[country]["impacted_keyword_list"] = impacted_keyword_list
-        plot_google_trend_of_item(GT_df, country, Constant.GT_FIGURE_5_YR_SIGNIFICANT, impacted_keyword_list)
-
-    # ------------------------------------------------------------------------------------------------------
-    # Short-term google trend observation(this year)
-    # From the long-term keyword selection, we then further select the representative items which has sharp increase
-    # google trend during COVID-19 by observing short-term(this year) trend.
-    # The selection criteria:
-    # 1. low max value of the trend 2 weeks before the peak
-    # 2. high max value of the trend during COVID-19
-    # Plot the short-term(this year) google trend of each item for observing the search trend and make the selected
-    # representative items drew by red line.
-    create_data_folder(Constant.GT_RECENT_DATA_DIR)
-    gt_start_date = "2020-01-01"
-    for country in selected_countries:
-        # Creat Google Trend data frame for each country
-        keywords_list = get_keyword_list(country)
-
-        # update google trend data frame from 5-yr to recent (2020-Present)
-        GT_df = create_google_trend_df(pytrend, keywords_list, country, gt_start_date, gt_end_date, True)
-        data_manager[country]["GT_DF"] = GT_df
-
-        impacted_keyword_list = data_manager[country]["impacted_keyword_list"]
-        representative_items, max_dates_of_keywords_pairs = select_representative_kw(GT_df, impacted_keyword_list)
-        data_manager[country]['representative_items'] = representative_items
-        data_manager[country]['max_dates_of_keywords_pairs'] = max_dates_of_keywords_pairs
-        plot_google_trend_of_item(GT_df, country, 'representative', representative_items)
-
-    # ------------------------------------------------------------------------------------------------------
-    # Combind confirmed data and google trend data
-    # Plot comparison between confirmed cases trend and google trend
-    # Source: US: https://www.cdc.gov/coronavirus/2019-ncov/cases-updates/cases-in-us.html
-    first_confirmed_date_dict = {Constant.TW: datetime.date(2020, 1, 21), Constant.US: datetime.date(2020, 1, 22)}
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Google Trend of panic-buying items and COVID-19 awareness")
+    parser.add_argument('command', choices=['fetch', 'store', 'screen', 'report', 'significance', 'index', 'lag',
+                                            'plot'])
+    parser.add_argument('--countries', nargs='+', choices=list(REGIONS), default=country_geos())
+    parser.add_argument('--us-states', action='store_true', help="add the 50 US states and DC to the countries")
+    parser.add_argument('--end-date', default="04-22-20",
+                        help="last day of COVID-19 data, " + Constant.DATE_FORMAT.replace('%', '%%'))
+    parser.add_argument('--gt-start-date', default="2015-04-19")
+    parser.add_argument('--gt-recent-start-date', default="2020-01-01")
+    parser.add_argument('--gt-end-date', default="2020-04-22")
+    parser.add_argument('--min-skew', type=float, default=Constant.IMPACTED_MIN_SKEW)
+    parser.add_argument('--max-past-trend', type=float, default=Constant.IMPACTED_MAX_PAST_TREND)
+    parser.add_argument('--window-days', type=int, default=Constant.REPRESENTATIVE_WINDOW_DAYS)
+    parser.add_argument('--max-window-past-trend', type=float, default=Constant.REPRESENTATIVE_MAX_PAST_TREND)
+    parser.add_argument('--min-current-trend', type=float, default=Constant.REPRESENTATIVE_MIN_CURRENT_TREND)
+    parser.add_argument('--screening', choices=['threshold', 'changepoint'], default='threshold',
+                        help="screen the items by fixed thresholds or by the onsets of change point detection")
+    parser.add_argument('--awareness-signal', choices=['peak', 'onset'], default='peak',
+                        help="date the awareness by the max dates or by the onsets of the items")
+    parser.add_argument('--changepoint-penalty', type=float, default=Constant.CHANGEPOINT_PENALTY)
+    parser.add_argument('--min-onset-magnitude', type=float, default=Constant.CHANGEPOINT_MIN_MAGNITUDE)
+    parser.add_argument('--resamples', type=int, default=Constant.RESAMPLING_RESAMPLES,
+                        help="bootstrap resamples and permutations of the awareness time gaps")
+    parser.add_argument('--confidence', type=float, default=Constant.RESAMPLING_CONFIDENCE)
+    parser.add_argument('--seed', type=int, default=Constant.RESAMPLING_SEED)
+    parser.add_argument('--max-lag', type=int, default=Constant.LAG_MAX_DAYS,
+                        help="largest lag in days between search interest and new cases")
+    parser.add_argument('--daily-5-yr', action='store_true',
+                        help="stitch the 5-year google trend from overlapping daily windows")
+    parser.add_argument('--metrics-log', help="JSON lines file of every stage's metrics, default is " +
+                        Constant.METRICS_LOG_FILE[1:] + " of the data root")
+    parser.add_argument('--profile-stage', nargs='+', default=[], help="stages to dump cProfile stats of")
+    parser.add_argument('--data-root', help="folder of every data folder, default is the working directory")
+    parser.add_argument('--fixtures', choices=FIXTURE_MODES,
+                        help="record the JHU tables and Google Trend payloads, or replay them without network")
+    parser.add_argument('--fixtures-dir', help="folder of the fixtures, default is " + Constant.FIXTURES_DIR[1:] +
+                        " of the data root")
+    args = parser.parse_args(argv)
+    if args.data_root is not None:
+        os.makedirs(args.data_root, exist_ok=True)
+        set_data_root(args.data_root)
+    use_fixtures(args.fixtures, args.fixtures_dir)
+    if args.metrics_log is None:
+        args.metrics_log = data_path(Constant.METRICS_LOG_FILE)
+    if args.us_states:
+        args.countries += [geo for geo in subregion_geos(Constant.US) if geo not in args.countries]
 
-    for country in selected_countries:
-        # Use final representative keywords of google trend
-        country_GT_df = data_manager[country]["GT_DF"]
-        representative_items = data_manager[country]['representative_items']
-        country_GT_df = pd.concat([country_GT_df['date'], country_GT_df[representative_items]], sort=False, axis=1)
-        country_COVID_19_df = data_manager[country]['COVID_19_raw_data']
-        new_country_GT_df = country_GT_df.copy()
-
-        # merge google trend and COVID-19 data frame
-        new_country_GT_df = pd.merge(new_country_GT_df, country_COVID_19_df, left_on=['date'], right_on=['Date'], how='left').drop(['Date'], axis=1)
-        country_full_name = country
-        if country == Constant.TW:
-            country_full_name = convert_country_abbreviation_to_fullname(Constant.TW)
-
-        new_country_GT_df['Country'] = new_country_GT_df['Country'].fillna(country_full_name)
-        new_country_GT_df = new_country_GT_df.fillna(0)
-        data_manager[country]['COVID_19_with_google_trend'] = new_country_GT_df
-        first_confirmed_date = first_confirmed_date_dict[country]
-        plot_items_with_confirmed_case(new_country_GT_df, representative_items, first_confirmed_date, country)
-        
-    # ------------------------------------------------------------------------------------------------------
-    # Determine which country has better public awareness about the COVID-19 by comparing the time interval
-    # in different region by plotting the number of confirmed cases and awareness date of Taiwan and US
-    for country in selected_countries:
-        first_confirmed_date = first_confirmed_date_dict[country]
-        max_dates_of_keywords_pairs = data_manager[country]['max_dates_of_keywords_pairs']
+    create_data_folder(Constant.COVID_RAW_DATA_DIR)
+    create_data_folder(Constant.DATA_CACHE_DIR)
+    cache = DataCache(data_path(Constant.DATA_CACHE_DIR))
+    recorder = StageRecorder(args.metrics_log, args.profile_stage, data_path(Constant.PROFILE_DIR))
+    end_date = datetime.datetime.strptime(args.end_date, Constant.DATE_FORMAT)
+
+    # the first confirmed date of every country comes from the JHU data
+    pipeline = build_analysis_pipeline(args.countries, end_date, args.gt_start_date, args.gt_recent_start_date,
+                                       args.gt_end_date,
+                                       {'min_skew': args.min_skew, 'max_past_trend': args.max_past_trend},
+                                       {'window_days': args.window_days,
+                                        'max_past_trend': args.max_window_past_trend,
+                                        'min_current_trend': args.min_current_trend}, cache, recorder,
+                                       args.max_lag, args.daily_5_yr, screening=args.screening,
+                                       awareness_signal=args.awareness_signal,
+                                       changepoint_thresholds={'penalty': args.changepoint_penalty,
+                                                               'min_magnitude': args.min_onset_magnitude},
+                                       resampling={'resamples': args.resamples, 'confidence': args.confidence,
+                                                   'seed': args.seed})
+
+    stage_prefixes = {'fetch': ['cases:', 'gt_5_yr:', 'gt_recent:'],
+                      'store': ['case_table', 'gt_5_yr:', 'gt_recent:'], 'screen': ['impacted:', 'representative:'],
+                      'report': ['awareness_table'] + (['onset_table'] if args.awareness_signal == 'onset' else []),
+                      'significance': ['awareness_significance'], 'index': ['first_confirmed_dates', 'representative:'],
+                      'lag': ['lag_table'], 'plot': ['plot_']}[args.command]
+    targets = [name for name in pipeline.stages if any(name.startswith(prefix) for prefix in stage_prefixes)]
+    start_time = time.perf_counter()
+    if args.command == 'fetch':
+        # every region's google trend is fetched into the cache at once, under one rate limit
+        queries = [(get_keyword_list(country), country, args.gt_recent_start_date + " " + args.gt_end_date)
+                   for country in args.countries]
+        if not args.daily_5_yr:
+            queries += [(get_keyword_list(country), country, args.gt_start_date + " " + args.gt_end_date)
+                        for country in args.countries]
+        from trend_scheduler import prefetch_google_trends
+        stats = recorder.run('prefetch_google_trends', prefetch_google_trends,
+                             {'pytrend': None, 'queries': queries, 'cache': cache})
+        print("[GT] prefetched " + str(stats['queries']) + " queries, " + str(stats['requests']) + " request(s), " +
+              str(stats['failed']) + " failed in %.2fs" % stats['wall_time'])
+    outputs = pipeline.run(targets)
+    cache.close()
+    print("[Pipeline] computed " + str(len(pipeline.computed)) + " stage(s), loaded " + str(len(pipeline.loaded)) +
+          " in %.2fs" % (time.perf_counter() - start_time))
+
+    for country in args.countries:
+        if args.command == 'screen':
+            print(country + " impacted items: " + ", ".join(outputs['impacted:' + country]))
+            print(country + " representative items: " + ", ".join(outputs['representative:' + country][0]))
+
+    if args.command == 'store':
+        from matrix_store import store_analysis_matrices
+        create_data_folder(Constant.MATRIX_STORE_DIR)
+        trend_dfs = {}
+        for country in args.countries:
+            trend_dfs['GT_5_YR_' + country] = outputs['gt_5_yr:' + country]
+            trend_dfs['GT_RECENT_' + country] = outputs['gt_recent:' + country]
+        names = recorder.run('store_matrices', store_analysis_matrices,
+                             {'folder': data_path(Constant.MATRIX_STORE_DIR), 'case_table': outputs['case_table'],
+                              **trend_dfs})
+        print("[Store] " + str(len(names)) + " matrices written to " + data_path(Constant.MATRIX_STORE_DIR))
+
+    if args.command == 'index':
+        from awareness_index import index_awareness
+        index_path = data_path(Constant.AWARENESS_INDEX_FILE)
+        representative_outputs = {country: outputs['representative:' + country] for country in args.countries}
+        counts = recorder.run('index_awareness', index_awareness,
+                              {'index_path': index_path, 'as_of': args.gt_end_date,
+                               'first_confirmed_dates': outputs['first_confirmed_dates'], **representative_outputs})
+        print("[Index] " + str(counts['updated']) + " snapshot(s) updated, " + str(counts['unchanged']) +
+              " unchanged in " + index_path)
+
+    if args.command == 'lag':
+        print("Daily google trend:")
+        print(outputs['lag_table'].to_string(index=False))
+        print("Weekly google trend:")
+        print(outputs['lag_table_5_yr'].to_string(index=False))
+
+    if args.command == 'report':
+        print(outputs['awareness_table'].to_string())
+        if args.awareness_signal == 'onset':
+            print(outputs['onset_table'].to_string(index=False))
+
+    if args.command == 'significance':
+        intervals, differences = outputs['awareness_significance']
+        print(intervals.to_string())
+        print(differences.to_string(index=False))
+
+    if args.command == 'plot':
+        from figure_rendering import render_figures
+        # the figures whose data changed are drawn again, and so is every figure whose image is missing
+        create_data_folder(Constant.GT_FIGURE_DIR)
+        tasks = [outputs[name] for name in targets
+                 if name in pipeline.computed or not os.path.exists(figure_path(outputs[name]))]
+        recorder.run('render_figures', render_figures, {'tasks': tasks})
+    print("[Metrics] " + str(len(recorder.records)) + " stage record(s) appended to " + args.metrics_log)
 
-        # Use the average awareness date and its time interval
-        # average awareness date: calculated from peak time of each items in Google Trend
-        # time interval of each item: a period from the first confirmed date of COVID-19 to item's peak search time
-        awareness_report = awareness_date_report(first_confirmed_date, max_dates_of_keywords_pairs)
-        data_manager[country]['awareness_report'] = awareness_report
 
-    # Plot confirmed number trend and time gap between first confirmed date and awareness date for two countries.
-    plot_confirmed_number_and_awareness_comparison(data_manager, Constant.TW, Constant.US)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Alignment of daily COVID-19 cases with Google Trend series of any granularity. Google Trend returns one value per day,
+week or month depending on the time range, and every value covers the period from its date to the day before the next
+date. Cases are resampled on those periods for all countries at once: cumulative counts are joined as of the last day
+of the period and new cases are summed over the period.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def series_frequency(dates) -> int:
+    """
+    Typical number of days between two dates of a series: 1 for daily, 7 for weekly, about 30 for monthly
+    :param dates: sorted dates of the series
+    :return: median step in days
+    >>> series_frequency(pd.date_range('2020-01-05', periods=4, freq='W'))
+    7
+    >>> series_frequency(pd.to_datetime(['2020-01-01']))
+    1
+    """
+    days = pd.DatetimeIndex(dates).values.astype('datetime64[D]')
+    if len(days) < 2:
+        return 1
+    return int(np.median(np.diff(days).astype(int)))
+
+
+def period_bounds(dates) -> (pd.DatetimeIndex, pd.DatetimeIndex):
+    """
+    First and last day of the period of every date: a value covers its date up to the day before the next date, and
+    the last value covers one typical step
+    :param dates: sorted dates of the series
+    :return: start and end of every period
+    >>> starts, ends = period_bounds(pd.to_datetime(['2020-01-05', '2020-01-12']))
+    >>> [str(day.date()) for day in ends]
+    ['2020-01-11', '2020-01-18']
+    """
+    starts = pd.DatetimeIndex(dates).normalize()
+    step = pd.Timedelta(days=series_frequency(starts))
+    if len(starts) == 0:
+        return starts, starts
+    return starts, starts[1:].append(pd.DatetimeIndex([starts[-1] + step])) - pd.Timedelta(days=1)
+
+
+def covered_periods(dates, daily_index) -> np.ndarray:
+    """
+    Flag the periods lying wholly inside the days of a daily series
+    :param dates: sorted dates of the series to align on
+    :param daily_index: sorted dates of the daily series
+    :return: boolean array, one per date
+    >>> covered_periods(pd.to_datetime(['2020-01-05', '2020-01-12']), pd.date_range('2020-01-01', '2020-01-15'))
+    array([ True, False])
+    """
+    starts, ends = period_bounds(dates)
+    if len(daily_index) == 0:
+        return np.zeros(len(starts), dtype=bool)
+    return np.asarray((starts >= daily_index[0]) & (ends <= daily_index[-1]))
+
+
+def _as_of(daily: pd.DataFrame, days: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Last value of every column on or before each day, NaN before the first day
+    """
+    positions = daily.index.searchsorted(days, side='right') - 1
+    values = daily.to_numpy(dtype=float)[np.clip(positions, 0, None)]
+    values[positions < 0] = np.nan
+    return values
+
+
+def align_to_periods(dates, daily: pd.DataFrame, how: str = 'last') -> pd.DataFrame:
+    """
+    Resample daily series of many countries on the periods of a google trend series, without a row-by-row merge
+    - 'last': as-of join, the value on the last day of the period, for cumulative counts. A period ending after the
+      daily data takes the last value, a period starting after it is NaN.
+    - 'sum': sum over the days of the period, for new cases, from differences of the running sum. A period only
+      partly inside the daily data is summed over the days it has.
+    :param dates: sorted dates of the google trend series
+    :param daily: data frame indexed by sorted days with one column per country
+    :param how: 'last' or 'sum'
+    :return: data frame indexed by the dates with the columns of daily
+    >>> daily = pd.DataFrame({'US': [1, 2, 3, 4, 5, 6, 7, 8]}, index=pd.date_range('2020-01-01', periods=8))
+    >>> weeks = pd.to_datetime(['2019-12-25', '2020-01-01', '2020-01-08', '2020-01-15'])
+    >>> align_to_periods(weeks, daily, 'last')['US'].tolist()
+    [nan, 7.0, 8.0, nan]
+    >>> align_to_periods(weeks, daily.diff().fillna(daily), 'sum')['US'].tolist()
+    [0.0, 7.0, 1.0, nan]
+    """
+    if how not in ['last', 'sum']:
+        raise ValueError("Unknown resampling")
+    starts, ends = period_bounds(dates)
+    daily = daily.sort_index()
+    after_data = np.asarray(starts > daily.index[-1]) if len(daily) > 0 else np.ones(len(starts), dtype=bool)
+
+    if how == 'last':
+        values = _as_of(daily, ends)
+    else:
+        running = daily.fillna(0).cumsum()
+        before = np.nan_to_num(_as_of(running, starts - pd.Timedelta(days=1)))
+        values = np.nan_to_num(_as_of(running, ends)) - before
+    values[after_data] = np.nan
+    return pd.DataFrame(values, index=pd.DatetimeIndex(dates), columns=daily.columns)
+
+
+def align_cases(dates, case_table: pd.DataFrame, countries: list, how: str = 'last') -> pd.DataFrame:
+    """
+    Confirmed cases of many countries of the table from build_case_table() on the periods of a google trend series
+    :param dates: sorted dates of the google trend series
+    :param case_table: long table indexed by (Country, Date)
+    :param countries: country names in the case table
+    :param how: 'last' for the cumulative count at the end of the period, 'sum' for the new cases of the period
+    :return: data frame indexed by the dates with one column per country
+    >>> from covid19_data import build_case_table
+    >>> case_table = build_case_table(pd.DataFrame({'Country/Region': ['US', 'China'], '1/22/20': [1, 444],
+    ...                                             '1/23/20': [3, 444], '1/24/20': [4, 549]}))
+    >>> weeks = pd.to_datetime(['2020-01-19', '2020-01-26'])
+    >>> align_cases(weeks, case_table, ['US', 'China'], 'sum').to_dict('list')
+    {'US': [3.0, nan], 'China': [105.0, nan]}
+    >>> align_cases(weeks, case_table, ['US', 'China'], 'last').to_dict('list')
+    {'US': [4.0, nan], 'China': [549.0, nan]}
+    """
+    cumulative = case_table['Confirmed'].unstack(level=0).sort_index()[countries]
+    if how == 'last':
+        return align_to_periods(dates, cumulative, how)
+    # new cases start the day after the first count, corrections lowering the count are clipped to 0
+    return align_to_periods(dates, cumulative.diff().iloc[1:].clip(lower=0), how)
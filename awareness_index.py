@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed awareness index: the first confirmed date of every region and the peak date and time gap of every keyword
+are kept in SQLite per (region, as-of date) snapshot, so the awareness of any region and keyword set is a lookup.
+A small local HTTP service answers lookups and aggregates as JSON while the index is refreshed next to it.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import contextlib
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import Constant
+from fixtures import data_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (region TEXT, as_of TEXT, first_confirmed_date TEXT, fingerprint TEXT,
+                                      indexed_at TEXT, PRIMARY KEY (region, as_of));
+CREATE TABLE IF NOT EXISTS peaks (region TEXT, as_of TEXT, keyword TEXT, peak_date TEXT, gap_days INTEGER,
+                                  representative INTEGER, PRIMARY KEY (region, as_of, keyword));
+CREATE INDEX IF NOT EXISTS peaks_keyword ON peaks (keyword, as_of);
+"""
+
+
+def _iso_date(value) -> str:
+    """
+    Date of a date, datetime, Timestamp or "YYYY-MM-DD" string as "YYYY-MM-DD"
+    """
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10]).isoformat()
+    if isinstance(value, datetime.datetime) or hasattr(value, 'to_pydatetime'):
+        value = value.date()
+    return value.isoformat()
+
+
+def _awareness(first_confirmed_date: str, gap_sum: int, items: int) -> dict:
+    """
+    Time gap and awareness date like awareness_date_report(): int() of the mean gap, truncated toward zero
+    """
+    time_gap = int(gap_sum / float(items))
+    first_date = datetime.date.fromisoformat(first_confirmed_date)
+    return {'first_confirmed_date': first_confirmed_date, 'awareness_time_gap(days)': time_gap,
+            'mean_awareness_date': (first_date + datetime.timedelta(days=time_gap)).isoformat(), 'items': items}
+
+
+class AwarenessIndex:
+    """
+    SQLite index of awareness snapshots. Every call opens its own connection, so the index can be read by many
+    threads of the query service while another process refreshes it; WAL mode keeps the readers from blocking.
+    >>> import os, tempfile
+    >>> index = AwarenessIndex(os.path.join(tempfile.mkdtemp(), 'index.sqlite'))
+    >>> index.update('US', '2020-04-22', datetime.date(2020, 1, 22), {'mask': '2020-03-15', 'milk': '2020-03-20'},
+    ...              ['mask'])
+    True
+    >>> index.update('US', '2020-04-22', datetime.date(2020, 1, 22), {'mask': '2020-03-15', 'milk': '2020-03-20'},
+    ...              ['mask'])
+    False
+    >>> index.awareness('US')['awareness_time_gap(days)'], index.awareness('US', ['mask'])['mean_awareness_date']
+    (55, '2020-03-15')
+    >>> index.awareness('US', as_of='2020-04-01')
+    Traceback (most recent call last):
+    ValueError: No awareness of US as of 2020-04-01
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # commit on success, roll back on error, and always close
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def update(self, region: str, as_of, first_confirmed_date, peak_dates: dict, representative: list = None) -> bool:
+        """
+        Store the snapshot of a region as of a date, unless the same snapshot is stored already
+        :param region: geo code of the region
+        :param as_of: last day of the data of the snapshot
+        :param first_confirmed_date: date of the first confirmed case of the region
+        :param peak_dates: keyword -> google trend max date
+        :param representative: the representative keywords among them
+        :return: True when the snapshot was written, False when it did not change
+        """
+        as_of, first_date = _iso_date(as_of), _iso_date(first_confirmed_date)
+        representative = set(representative or [])
+        rows = sorted((keyword, _iso_date(peak_date)) for keyword, peak_date in peak_dates.items())
+        content = json.dumps([first_date, rows, sorted(representative)], ensure_ascii=False)
+        fingerprint = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+        with self._connect() as connection:
+            stored = connection.execute("SELECT fingerprint FROM snapshots WHERE region = ? AND as_of = ?",
+                                        (region, as_of)).fetchone()
+            if stored is not None and stored[0] == fingerprint:
+                return False
+            first_day = datetime.date.fromisoformat(first_date)
+            connection.execute("DELETE FROM peaks WHERE region = ? AND as_of = ?", (region, as_of))
+            connection.executemany("INSERT INTO peaks VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(region, as_of, keyword, peak_date,
+                                     (datetime.date.fromisoformat(peak_date) - first_day).days,
+                                     int(keyword in representative)) for keyword, peak_date in rows])
+            connection.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+                               (region, as_of, first_date, fingerprint,
+                                datetime.datetime.now().isoformat(timespec='seconds')))
+        return True
+
+    def snapshots(self) -> dict:
+        """
+        As-of dates of every region in the index
+        :return: region -> sorted list of as-of dates
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT region, as_of FROM snapshots ORDER BY region, as_of").fetchall()
+        snapshots = {}
+        for region, as_of in rows:
+            snapshots.setdefault(region, []).append(as_of)
+        return snapshots
+
+    def peaks(self, region: str, as_of=None) -> dict:
+        """
+        Peak date, time gap and representative flag of every keyword of a region's latest snapshot up to as_of
+        :param region: geo code of the region
+        :param as_of: date of the data, default is the latest snapshot
+        :return: dictionary of the snapshot and its keywords
+        """
+        with self._connect() as connection:
+            snapshot = self._snapshot(connection, region, as_of)
+            rows = connection.execute("SELECT keyword, peak_date, gap_days, representative FROM peaks "
+                                      "WHERE region = ? AND as_of = ? ORDER BY peak_date, keyword",
+                                      (region, snapshot[0])).fetchall()
+        return {'region': region, 'as_of': snapshot[0], 'first_confirmed_date': snapshot[1],
+                'keywords': [{'keyword': keyword, 'peak_date': peak_date, 'gap_days': gap_days,
+                              'representative': bool(flag)} for keyword, peak_date, gap_days, flag in rows]}
+
+    def _snapshot(self, connection: sqlite3.Connection, region: str, as_of) -> tuple:
+        latest = Constant.AWARENESS_LATEST if as_of is None else _iso_date(as_of)
+        snapshot = connection.execute("SELECT as_of, first_confirmed_date FROM snapshots WHERE region = ? AND "
+                                      "as_of <= ? ORDER BY as_of DESC LIMIT 1", (region, latest)).fetchone()
+        if snapshot is None:
+            raise ValueError("No awareness of " + region + ("" if as_of is None else " as of " + latest))
+        return snapshot
+
+    @staticmethod
+    def _keyword_filter(keywords: list, representative_only: bool) -> (str, list):
+        condition, params = "", []
+        if keywords:
+            condition += " AND keyword IN (" + ", ".join("?" * len(keywords)) + ")"
+            params += list(keywords)
+        if representative_only:
+            condition += " AND representative = 1"
+        return condition, params
+
+    def awareness(self, region: str, keywords: list = None, as_of=None, representative_only: bool = False) -> dict:
+        """
+        Awareness of a region from its latest snapshot up to as_of, like awareness_date_report()
+        :param region: geo code of the region
+        :param keywords: keywords to average, default is every keyword of the snapshot
+        :param as_of: date of the data, default is the latest snapshot
+        :param representative_only: only average the representative keywords
+        :return: dictionary of the first confirmed date, time gap, awareness date and number of items
+        """
+        condition, params = self._keyword_filter(keywords, representative_only)
+        with self._connect() as connection:
+            snapshot = self._snapshot(connection, region, as_of)
+            gaps = [gap for gap, in connection.execute("SELECT gap_days FROM peaks WHERE region = ? AND as_of = ?" +
+                                                       condition, [region, snapshot[0]] + params)]
+        if gaps == []:
+            raise ValueError("No such keyword")
+        return dict(region=region, as_of=snapshot[0], **_awareness(snapshot[1], sum(gaps), len(gaps)))
+
+    def aggregate(self, keywords: list = None, as_of=None, regions: list = None,
+                  representative_only: bool = False) -> dict:
+        """
+        Awareness of every region from its latest snapshot up to as_of, from the most aware region, with the mean,
+        min and max time gap over the regions
+        :param keywords: keywords to average, default is every keyword of each snapshot
+        :param as_of: date of the data, default is the latest snapshots
+        :param regions: regions to report, default is every region of the index
+        :param representative_only: only average the representative keywords
+        :return: dictionary of the regions' awareness and the summary of their time gaps
+        """
+        condition, params = self._keyword_filter(keywords, representative_only)
+        as_of = Constant.AWARENESS_LATEST if as_of is None else _iso_date(as_of)
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT p.region, s.as_of, s.first_confirmed_date, SUM(p.gap_days), COUNT(*) FROM peaks p "
+                "JOIN snapshots s ON p.region = s.region AND p.as_of = s.as_of "
+                "WHERE s.as_of = (SELECT MAX(as_of) FROM snapshots WHERE region = s.region AND as_of <= ?)" +
+                condition + " GROUP BY p.region", [as_of] + params).fetchall()
+
+        table = []
+        for region, snapshot_as_of, first_date, gap_sum, items in rows:
+            if regions and region not in regions:
+                continue
+            table.append(dict(region=region, as_of=snapshot_as_of, **_awareness(first_date, gap_sum, items)))
+        table.sort(key=lambda report: report['awareness_time_gap(days)'])
+
+        gaps = [report['awareness_time_gap(days)'] for report in table]
+        summary = {'regions': len(gaps), 'mean_gap': sum(gaps) / len(gaps) if gaps else None,
+                   'min_gap': min(gaps) if gaps else None, 'max_gap': max(gaps) if gaps else None}
+        return {'awareness': table, 'summary': summary}
+
+
+def index_awareness(index_path: str, as_of, first_confirmed_dates: dict, **representative_outputs) -> dict:
+    """
+    Refresh the index with the output of the pipeline. Snapshots that did not change are left alone, so refreshing
+    after new data lands only writes the regions whose peaks or first confirmed date moved.
+    :param index_path: path of the SQLite index
+    :param as_of: last day of the google trend data
+    :param first_confirmed_dates: dictionary of every region's first confirmed date
+    :param representative_outputs: region=(representative keywords, dictionary of each item's max date)
+    :return: number of updated and unchanged snapshots
+    """
+    index = AwarenessIndex(index_path)
+    counts = {'updated': 0, 'unchanged': 0}
+    for region, (representative, peak_dates) in representative_outputs.items():
+        if peak_dates == {}:
+            continue
+        updated = index.update(region, as_of, first_confirmed_dates[region], peak_dates, representative)
+        counts['updated' if updated else 'unchanged'] += 1
+    return counts
+
+
+class AwarenessService:
+    """
+    Local HTTP server answering JSON queries on an AwarenessIndex:
+    - /awareness?region=US&keywords=mask,sanitizer&as_of=2020-04-22&representative=1
+    - /aggregate?keywords=..&as_of=..&regions=US,TW&representative=1
+    - /peaks?region=US&as_of=..
+    - /snapshots
+    >>> import os, tempfile, urllib.request
+    >>> index = AwarenessIndex(os.path.join(tempfile.mkdtemp(), 'index.sqlite'))
+    >>> index.update('TW', '2020-04-22', '2020-01-21', {'mask': '2020-02-01', 'milk': '2020-02-04'})
+    True
+    >>> with AwarenessService(index) as service:
+    ...     body = urllib.request.urlopen(service.url + '/aggregate?keywords=mask').read()
+    >>> json.loads(body)['awareness'][0]['awareness_time_gap(days)']
+    11
+    """
+    def __init__(self, index: AwarenessIndex, host: str = '127.0.0.1', port: int = 0):
+        self.index = index
+        self._thread = None
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                service.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = 'http://' + host + ':' + str(self._httpd.server_address[1])
+
+    def answer(self, path: str, query: dict):
+        """
+        Answer one query
+        :param path: route of the request
+        :param query: parsed query string
+        :return: JSON-serializable answer
+        """
+        def values(name: str) -> list:
+            return [value for item in query.get(name, []) for value in item.split(',') if value != ''] or None
+
+        as_of = query.get('as_of', [None])[0]
+        representative_only = query.get('representative', ['0'])[0] in ['1', 'true']
+        if path == '/awareness':
+            if 'region' not in query:
+                raise ValueError("Region is not well defined")
+            return self.index.awareness(query['region'][0], values('keywords'), as_of, representative_only)
+        if path == '/aggregate':
+            return self.index.aggregate(values('keywords'), as_of, values('regions'), representative_only)
+        if path == '/peaks':
+            if 'region' not in query:
+                raise ValueError("Region is not well defined")
+            return self.index.peaks(query['region'][0], as_of)
+        if path == '/snapshots':
+            return self.index.snapshots()
+        raise KeyError(path)
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        url = urllib.parse.urlparse(request.path)
+        try:
+            status, content = 200, self.answer(url.path, urllib.parse.parse_qs(url.query))
+        except KeyError:
+            status, content = 404, {'error': "No such query"}
+        except ValueError as error:
+            status, content = 400, {'error': str(error)}
+
+        body = json.dumps(content, ensure_ascii=False).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self) -> 'AwarenessService':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve(self):
+        """
+        Serve in this thread until interrupted
+        """
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv: list = None):
+    """
+    Serve the awareness index until interrupted
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="JSON query service of the awareness index")
+    parser.add_argument('--index', default=data_path(Constant.AWARENESS_INDEX_FILE))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=Constant.AWARENESS_SERVICE_PORT)
+    args = parser.parse_args(argv)
+
+    service = AwarenessService(AwarenessIndex(args.index), args.host, args.port)
+    print("[Index] serving " + args.index + " on " + service.url)
+    service.serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Batch runner of many studies, each a set of regions, keywords, date range and thresholds, listed in a JSON config.
+Google Trend and COVID-19 data are fetched once in this process on the shared cache and rate limit, then the
+independent studies are screened, reported and plotted on a process pool. Every study is a build_analysis_pipeline()
+on one shared stage store, so studies that overlap load each other's stages instead of computing them again; once
+the batch is done, the outputs no study of the batch uses any more are pruned from the store.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import copy
+import datetime
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import Constant
+from data_cache import DataCache
+from fixtures import data_path, data_root, set_data_root
+from instrumentation import StageRecorder
+from pipeline import prune_store
+from regions import REGIONS, country_geos
+
+# the study of the command line defaults, every study of a config starts from it; no countries means every
+# registered country, US states are listed by their geo codes such as 'US-CA'
+STUDY_DEFAULTS = {'countries': None, 'keywords': None, 'end_date': "04-22-20", 'gt_start_date': "2015-04-19",
+                  'gt_recent_start_date': "2020-01-01", 'gt_end_date': "2020-04-22",
+                  'impacted_thresholds': {'min_skew': Constant.IMPACTED_MIN_SKEW,
+                                          'max_past_trend': Constant.IMPACTED_MAX_PAST_TREND},
+                  'representative_thresholds': {'window_days': Constant.REPRESENTATIVE_WINDOW_DAYS,
+                                                'max_past_trend': Constant.REPRESENTATIVE_MAX_PAST_TREND,
+                                                'min_current_trend': Constant.REPRESENTATIVE_MIN_CURRENT_TREND},
+                  'changepoint_thresholds': {'penalty': Constant.CHANGEPOINT_PENALTY,
+                                             'min_magnitude': Constant.CHANGEPOINT_MIN_MAGNITUDE},
+                  'resampling': {'resamples': Constant.RESAMPLING_RESAMPLES,
+                                 'confidence': Constant.RESAMPLING_CONFIDENCE, 'seed': Constant.RESAMPLING_SEED},
+                  'screening': 'threshold', 'awareness_signal': 'peak',
+                  'max_lag': Constant.LAG_MAX_DAYS, 'daily_5_yr': False, 'plots': False}
+
+FETCH_STAGE_PREFIXES = ['case_table', 'first_confirmed_dates', 'cases:', 'gt_5_yr:', 'gt_recent:']
+REPORT_STAGE_PREFIXES = ['awareness:', 'awareness_table', 'awareness_significance', 'lag_table', 'impacted:',
+                         'representative:']
+
+
+def load_studies(config: dict) -> list:
+    """
+    Fill every study of a config with the defaults of the config and STUDY_DEFAULTS, and check it. Thresholds are
+    filled one by one, so a study only lists the thresholds it changes.
+    :param config: {"defaults": {...}, "studies": [{"name": ..., ...}, ...]}
+    :return: list of complete study dictionaries
+    >>> studies = load_studies({'defaults': {'countries': ['US']},
+    ...                         'studies': [{'name': 'masks', 'keywords': ['mask', 'sanitizer']}, {'name': 'all'}]})
+    >>> studies[0]['countries'], studies[0]['keywords'], studies[1]['keywords']
+    (['US'], {'US': ['mask', 'sanitizer']}, None)
+    >>> load_studies({'studies': [{'name': 'skew', 'impacted_thresholds': {'min_skew': 2}}]})[0]['impacted_thresholds']
+    {'min_skew': 2, 'max_past_trend': 50}
+    >>> load_studies({'studies': [{'name': 'spain', 'countries': ['ES']}]})
+    Traceback (most recent call last):
+    ValueError: Region is not well defined
+    """
+    defaults = dict(STUDY_DEFAULTS, **config.get('defaults', {}))
+    studies = []
+    for entry in config.get('studies', []):
+        study = copy.deepcopy(dict(defaults, **entry))
+        for thresholds in ['impacted_thresholds', 'representative_thresholds', 'changepoint_thresholds',
+                           'resampling']:
+            study[thresholds] = {**STUDY_DEFAULTS[thresholds], **defaults[thresholds], **entry.get(thresholds, {})}
+        if study['countries'] is None:
+            study['countries'] = country_geos()
+        name = str(study.get('name', ''))
+        if name == '' or any(not (c.isalnum() or c in '-_') for c in name):
+            raise ValueError("Study name is not well defined")
+        if name in [other['name'] for other in studies]:
+            raise ValueError("Study name is used twice")
+        if any(country not in REGIONS for country in study['countries']):
+            raise ValueError("Region is not well defined")
+
+        # one keyword list is searched in every region of the study
+        if isinstance(study['keywords'], list):
+            study['keywords'] = {country: study['keywords'] for country in study['countries']}
+        studies.append(study)
+    return studies
+
+
+def study_pipeline(study: dict, base_dir: str, recorder: StageRecorder = None, cache: DataCache = None):
+    """
+    Build the pipeline of a study on the stage store and the cache of base_dir
+    :param study: complete study dictionary
+    :param base_dir: folder of the shared PIPELINE_CACHE and DATA_CACHE
+    :param recorder: optional StageRecorder of every stage's metrics
+    :param cache: the DataCache of base_dir to use, default is a new one
+    :return: the pipeline
+    """
+    import IS590PR_Final as final
+
+    end_date = datetime.datetime.strptime(study['end_date'], Constant.DATE_FORMAT)
+    cache = DataCache(base_dir + Constant.DATA_CACHE_DIR) if cache is None else cache
+    # studies already run on a process pool, so the resampling of a study stays in its process
+    return final.build_analysis_pipeline(study['countries'], end_date, study['gt_start_date'],
+                                         study['gt_recent_start_date'], study['gt_end_date'],
+                                         study['impacted_thresholds'], study['representative_thresholds'],
+                                         cache, recorder, study['max_lag'],
+                                         study['daily_5_yr'], study['keywords'],
+                                         store_dir=base_dir + Constant.PIPELINE_DIR, prune_stale=False,
+                                         screening=study['screening'], awareness_signal=study['awareness_signal'],
+                                         changepoint_thresholds=study['changepoint_thresholds'],
+                                         resampling=study['resampling'], resampling_workers=1)
+
+
+def stage_targets(pipeline, prefixes: list) -> list:
+    return [name for name in pipeline.stages if any(name.startswith(prefix) for prefix in prefixes)]
+
+
+def fetch_studies(studies: list, base_dir: str) -> dict:
+    """
+    Fetch the data of every study one study after another, so all requests go through one rate limit and a query
+    shared by several studies is fetched once
+    :param studies: complete study dictionaries
+    :param base_dir: folder of the shared PIPELINE_CACHE and DATA_CACHE
+    :return: study name -> error message of the studies whose data could not be fetched
+    """
+    failed = {}
+    cache = DataCache(base_dir + Constant.DATA_CACHE_DIR)
+    for study in studies:
+        pipeline = study_pipeline(study, base_dir, cache=cache)
+        try:
+            pipeline.run(stage_targets(pipeline, FETCH_STAGE_PREFIXES))
+        except Exception as error:
+            failed[study['name']] = repr(error)
+            continue
+        finally:
+            cache.close()
+        print("[Batch] " + study['name'] + ": fetched " + str(len(pipeline.computed)) + " stage(s), loaded " +
+              str(len(pipeline.loaded)))
+    return failed
+
+
+def run_study(study: dict, base_dir: str, output_dir: str) -> dict:
+    """
+    Screen, report and optionally plot one study, writing everything into output_dir/<study name>. Runs in a worker
+    process, whose data root is the study folder so the figures land there.
+    :param study: complete study dictionary
+    :param base_dir: folder of the shared PIPELINE_CACHE and DATA_CACHE
+    :param output_dir: folder of the study folders
+    :return: summary of the study
+    """
+    from figure_rendering import render_figures
+
+    study_dir = os.path.join(output_dir, study['name'])
+    os.makedirs(study_dir + Constant.GT_FIGURE_DIR, exist_ok=True)
+    previous_root = os.environ.get(Constant.DATA_ROOT_ENV)
+    summary = {'study': study['name'], 'status': 'ok', 'folder': study_dir}
+    cache = DataCache(base_dir + Constant.DATA_CACHE_DIR)
+    start_time = time.perf_counter()
+    try:
+        set_data_root(study_dir)
+        recorder = StageRecorder(study_dir + Constant.METRICS_LOG_FILE)
+        pipeline = study_pipeline(study, base_dir, recorder, cache)
+        targets = stage_targets(pipeline, REPORT_STAGE_PREFIXES + (['plot_'] if study['plots'] else []))
+        outputs = pipeline.run(targets)
+
+        outputs['awareness_table'].to_csv(os.path.join(study_dir, 'awareness_table.csv'))
+        intervals, differences = outputs['awareness_significance']
+        intervals.to_csv(os.path.join(study_dir, 'awareness_intervals.csv'))
+        differences.to_csv(os.path.join(study_dir, 'awareness_differences.csv'), index=False)
+        outputs['lag_table'].to_csv(os.path.join(study_dir, 'lag_table.csv'), index=False)
+        outputs['lag_table_5_yr'].to_csv(os.path.join(study_dir, 'lag_table_5_yr.csv'), index=False)
+        items = {country: {'impacted': outputs['impacted:' + country],
+                           'representative': outputs['representative:' + country][0]}
+                 for country in study['countries']}
+        with open(os.path.join(study_dir, 'items.json'), 'w', encoding='utf-8') as file:
+            json.dump(items, file, ensure_ascii=False, indent=2)
+
+        figures = render_figures([outputs[name] for name in targets if name.startswith('plot_')], max_workers=1)
+        summary.update({'computed': len(pipeline.computed), 'loaded': len(pipeline.loaded), 'figures': len(figures)})
+    except Exception as error:
+        summary.update({'status': 'error', 'error': repr(error), 'traceback': traceback.format_exc()})
+    finally:
+        cache.close()
+        set_data_root(previous_root)
+    summary['wall_time'] = time.perf_counter() - start_time
+    return summary
+
+
+def run_batch(config: dict, base_dir: str, output_dir: str, max_workers: int = Constant.BATCH_MAX_WORKERS) -> list:
+    """
+    Run every study of a config: fetch in this process, then screen, report and plot on a process pool, and finally
+    remove the stage outputs of older fingerprints of the studies' stages from the shared store
+    :param config: {"defaults": {...}, "studies": [...]}
+    :param base_dir: folder of the shared PIPELINE_CACHE and DATA_CACHE
+    :param output_dir: folder of the study folders and the batch summary
+    :param max_workers: number of processes
+    :return: summary of every study in the order of the config
+    """
+    studies = load_studies(config)
+    os.makedirs(output_dir, exist_ok=True)
+    failed = fetch_studies(studies, base_dir)
+
+    ready = [study for study in studies if study['name'] not in failed]
+    summaries = {name: {'study': name, 'status': 'error', 'error': error} for name, error in failed.items()}
+    if ready != []:
+        with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(ready)))) as executor:
+            futures = [executor.submit(run_study, study, base_dir, output_dir) for study in ready]
+            for future in futures:
+                summary = future.result()
+                summaries[summary['study']] = summary
+                print("[Batch] " + summary['study'] + ": " + summary['status'] +
+                      (" in %.2fs" % summary['wall_time'] if summary['status'] == 'ok' else ", " + summary['error']))
+
+    removed = prune_store([study_pipeline(study, base_dir) for study in studies])
+    print("[Batch] removed " + str(removed) + " stale stage output(s)")
+
+    ordered = [summaries[study['name']] for study in studies]
+    with open(os.path.join(output_dir, Constant.BATCH_SUMMARY_FILE), 'w', encoding='utf-8') as file:
+        json.dump(ordered, file, ensure_ascii=False, indent=2)
+    return ordered
+
+
+def main(argv: list = None):
+    """
+    Run the studies of a JSON config, e.g. python batch_runner.py studies.json --workers 8
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run many awareness studies listed in a JSON config")
+    parser.add_argument('config', help="JSON file with 'defaults' and a list of 'studies'")
+    parser.add_argument('--output', default=data_path(Constant.BATCH_DIR), help="folder of the study results")
+    parser.add_argument('--workers', type=int, default=Constant.BATCH_MAX_WORKERS, help="number of processes")
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding='utf-8') as file:
+        config = json.load(file)
+    summaries = run_batch(config, data_root(), args.output, args.workers)
+    done = len([summary for summary in summaries if summary['status'] == 'ok'])
+    print("[Batch] " + str(done) + " of " + str(len(summaries)) + " study(ies) done, summary in " +
+          os.path.join(args.output, Constant.BATCH_SUMMARY_FILE))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the analysis steps on synthetic Google Trend and JHU data, so it runs offline and at any scale.
+Wall time and peak memory of every step are written to a JSON file that later runs can be compared with.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import Constant
+from fixtures import data_path, set_data_root
+
+# number of keywords and days of the Google Trend frames, number of countries and days of the JHU table
+BENCHMARK_SCALES = {'small': {'keywords': 10, 'days': 120, 'countries': 50},
+                    'medium': {'keywords': 100, 'days': 1000, 'countries': 200},
+                    'large': {'keywords': 1000, 'days': 1826, 'countries': 1000}}
+
+
+def synthetic_trend_df(num_keywords: int, num_days: int, end_date: str = "2020-04-22", spike_ratio: float = 0.5,
+                       seed: int = 0) -> pd.DataFrame:
+    """
+    Create a Google Trend like data frame: a date column and one 0-100 column per keyword. A share of the keywords
+    has a spike injected after the COVID-19 cutoff date, the others only have a noisy baseline.
+    :param num_keywords: number of keyword columns
+    :param num_days: number of days till the end date
+    :param end_date: last day of the frame
+    :param spike_ratio: share of the keywords with a spike
+    :param seed: seed of the random generator
+    :return: data frame with date and the keyword columns
+    >>> df = synthetic_trend_df(12, 200)
+    >>> df.shape, list(df.columns[:3])
+    ((200, 13), ['date', 'disinfectants', 'thermometers'])
+    >>> int(df.iloc[:, 1:].max().max())
+    100
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=end_date, periods=num_days, freq='D')
+    keywords = (Constant.KEY_WORDS_LIST_EN + ['item ' + str(i) for i in range(num_keywords)])[:num_keywords]
+
+    volume = rng.gamma(4.0, 5.0, size=(num_days, num_keywords))
+    spiked = rng.random(num_keywords) < spike_ratio
+    after_cutoff = np.flatnonzero(dates >= pd.Timestamp(Constant.COVID19_CUTOFF_DATE))
+    if len(after_cutoff) > 0 and spiked.any():
+        days = np.arange(num_days)[:, None]
+        peaks = rng.choice(after_cutoff, size=spiked.sum())
+        widths = rng.uniform(3, 15, size=spiked.sum())
+        volume[:, spiked] += rng.uniform(200, 600, size=spiked.sum()) * np.exp(-0.5 * ((days - peaks) / widths) ** 2)
+
+    values = np.rint(volume * 100 / volume.max(axis=0)).astype(np.int64)
+    df = pd.DataFrame(values, columns=keywords)
+    df.insert(0, 'date', dates)
+    return df
+
+
+def synthetic_jhu_df(num_countries: int, num_days: int, provinces: int = 3, seed: int = 0) -> pd.DataFrame:
+    """
+    Create a wide JHU like table of cumulative confirmed cases from 1/22/20. Taiwan* and US are always in it, and
+    every tenth country is split into provinces.
+    :param num_countries: number of countries
+    :param num_days: number of date columns
+    :param provinces: number of provinces of a split country
+    :param seed: seed of the random generator
+    :return: data frame with Province/State, Country/Region, Lat, Long and one column per day
+    >>> df = synthetic_jhu_df(12, 5)
+    >>> list(df.columns[:5]), df.shape
+    (['Province/State', 'Country/Region', 'Lat', 'Long', '1/22/20'], (14, 9))
+    >>> bool((df.iloc[:, 5:].to_numpy() >= df.iloc[:, 4:-1].to_numpy()).all())
+    True
+    """
+    rng = np.random.default_rng(seed)
+    countries = ([Constant.TAIWAN, Constant.US] + ['Country ' + str(i) for i in range(num_countries)])[:num_countries]
+
+    rows = []
+    for i, country in enumerate(countries):
+        if i % 10 == 9:
+            rows += [(country + ' province ' + str(p), country) for p in range(provinces)]
+        else:
+            rows.append((None, country))
+
+    start = datetime.datetime(2020, 1, 22)
+    dates = [start + datetime.timedelta(days=d) for d in range(num_days)]
+    date_columns = [str(date.month) + '/' + str(date.day) + '/' + date.strftime('%y') for date in dates]
+    cases = np.cumsum(rng.poisson(rng.uniform(0, 50, size=(len(rows), 1)), size=(len(rows), num_days)), axis=1)
+
+    df = pd.DataFrame(cases, columns=date_columns)
+    df.insert(0, 'Long', rng.uniform(-180, 180, size=len(rows)))
+    df.insert(0, 'Lat', rng.uniform(-90, 90, size=len(rows)))
+    df.insert(0, Constant.COUNTRY_REGION, [row[1] for row in rows])
+    df.insert(0, Constant.PROVINCE_STATE, [row[0] for row in rows])
+    return df
+
+
+def measure(func, repeat: int = Constant.BENCHMARK_REPEAT) -> dict:
+    """
+    Time a call several times, then trace the peak memory of one more call. Anything the call prints is discarded.
+    :param func: function without arguments
+    :param repeat: number of timed calls
+    :return: dictionary of best and mean wall time in seconds and peak traced memory in bytes
+    >>> result = measure(lambda: list(range(100000)), repeat=2)
+    >>> sorted(result), result['peak_memory_bytes'] > 100000
+    (['mean_time', 'peak_memory_bytes', 'wall_time'], True)
+    """
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {'wall_time': min(times), 'mean_time': sum(times) / len(times), 'peak_memory_bytes': peak}
+
+
+def benchmark_cases(scale: dict) -> list:
+    """
+    Build the steps to benchmark at one scale. The keyword grid gets the first 10 keywords, so the plot benchmarks only
+    follow the length of the series.
+    :param scale: dictionary of keywords, days and countries
+    :return: list of (benchmark name, function without arguments)
+    """
+    import IS590PR_Final as final
+    from google_trend_fetcher import StubTrendReq
+    from change_points import onset_dates, select_changepoint_impacted, select_changepoint_representative
+
+    gt_df = synthetic_trend_df(scale['keywords'], scale['days'])
+    jhu_df = synthetic_jhu_df(scale['countries'], scale['days'])
+    first_confirmed_date = datetime.date(2020, 1, 21)
+
+    impacted_items = final.select_item_impacted_by_covid19(gt_df)
+    representative_items, max_dates = final.select_representative_kw(gt_df, impacted_items)
+    cases_df = final.get_country_df(jhu_df, Constant.US)
+    merged_df = final.merge_google_trend_with_cases(gt_df, representative_items, cases_df, Constant.US)
+    report = final.awareness_date_report(first_confirmed_date, max_dates) if max_dates != {} else None
+
+    plot_df = gt_df.iloc[:, :11]
+    end_date = gt_df['date'].iloc[-1]
+    start_date = (end_date - datetime.timedelta(days=scale['days'] - 1)).strftime(Constant.PLOT_DATE_FORMAT)
+    plot_items = [item for item in representative_items if item in plot_df.columns]
+    data_manager = {region: {'COVID_19_with_google_trend': merged_df, 'awareness_report': report}
+                    for region in [Constant.TW, Constant.US]}
+
+    cases = [('get_country_df', lambda: final.get_country_df(jhu_df, Constant.US)),
+             ('create_google_trend_df',
+              lambda: final.create_google_trend_df(StubTrendReq(), Constant.KEY_WORDS_LIST_EN, Constant.US, start_date,
+                                                   end_date.strftime(Constant.PLOT_DATE_FORMAT))),
+             ('select_item_impacted_by_covid19', lambda: final.select_item_impacted_by_covid19(gt_df)),
+             ('select_representative_kw', lambda: final.select_representative_kw(gt_df, impacted_items)),
+             ('merge_google_trend_with_cases',
+              lambda: final.merge_google_trend_with_cases(gt_df, representative_items, cases_df, Constant.US)),
+             ('select_changepoint_impacted', lambda: select_changepoint_impacted(gt_df)),
+             ('select_changepoint_representative', lambda: select_changepoint_representative(gt_df, impacted_items)),
+             ('onset_dates', lambda: onset_dates(gt_df, max_dates)),
+             ('plot_google_trend_of_item',
+              lambda: final.plot_google_trend_of_item(plot_df, Constant.US, 'benchmark', plot_items)),
+             ('plot_items_with_confirmed_case',
+              lambda: final.plot_items_with_confirmed_case(merged_df, plot_items, first_confirmed_date, Constant.US))]
+    if report is not None:
+        cases += [('awareness_date_report', lambda: final.awareness_date_report(first_confirmed_date, max_dates)),
+                  ('plot_confirmed_number_and_awareness_comparison',
+                   lambda: final.plot_confirmed_number_and_awareness_comparison(data_manager, Constant.TW,
+                                                                                Constant.US))]
+    return cases
+
+
+def run_benchmarks(scale_names: list, repeat: int = Constant.BENCHMARK_REPEAT, only: list = None) -> dict:
+    """
+    Run every benchmark at every scale in a temporary data root, so figures and data files of the project are left
+    alone
+    :param scale_names: names of BENCHMARK_SCALES
+    :param repeat: number of timed calls of every benchmark
+    :param only: names of the benchmarks to run, default is all of them
+    :return: dictionary of the environment and the list of results
+    """
+    results = []
+    previous_root = os.environ.get(Constant.DATA_ROOT_ENV)
+    set_data_root(tempfile.mkdtemp())
+    try:
+        os.mkdir(data_path(Constant.GT_FIGURE_DIR))
+        for scale_name in scale_names:
+            scale = BENCHMARK_SCALES[scale_name]
+            for name, func in benchmark_cases(scale):
+                if only is not None and name not in only:
+                    continue
+                result = {'benchmark': name, 'scale': scale_name, **scale, 'repeat': repeat, **measure(func, repeat)}
+                print("[Benchmark] %s (%s): %.4fs, peak %.1f MB" % (name, scale_name, result['wall_time'],
+                                                                    result['peak_memory_bytes'] / 2 ** 20))
+                results.append(result)
+    finally:
+        set_data_root(previous_root)
+
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'results': results}
+
+
+def compare_benchmarks(previous: dict, current: dict, tolerance: float = Constant.BENCHMARK_TOLERANCE) -> list:
+    """
+    Find the benchmarks that got slower or used more memory than the tolerance allows
+    :param previous: result of an earlier run_benchmarks()
+    :param current: result of this run_benchmarks()
+    :param tolerance: allowed relative growth, e.g. 0.2 is 20%
+    :return: list of (benchmark, scale, metric, previous value, current value)
+    >>> previous = {'results': [{'benchmark': 'a', 'scale': 'small', 'wall_time': 1.0, 'peak_memory_bytes': 100}]}
+    >>> current = {'results': [{'benchmark': 'a', 'scale': 'small', 'wall_time': 1.5, 'peak_memory_bytes': 110}]}
+    >>> compare_benchmarks(previous, current)
+    [('a', 'small', 'wall_time', 1.0, 1.5)]
+    """
+    previous_results = {(r['benchmark'], r['scale']): r for r in previous['results']}
+    regressions = []
+    for result in current['results']:
+        before = previous_results.get((result['benchmark'], result['scale']))
+        if before is None:
+            continue
+        for metric in ['wall_time', 'peak_memory_bytes']:
+            if result[metric] > before[metric] * (1 + tolerance):
+                regressions.append((result['benchmark'], result['scale'], metric, before[metric], result[metric]))
+    return regressions
+
+
+def main(argv: list = None):
+    """
+    Run the benchmarks, write the results and report regressions against an earlier result file
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the analysis steps on synthetic data")
+    parser.add_argument('--scales', nargs='+', choices=list(BENCHMARK_SCALES), default=['small', 'medium'])
+    parser.add_argument('--repeat', type=int, default=Constant.BENCHMARK_REPEAT)
+    parser.add_argument('--only', nargs='+', help="names of the benchmarks to run")
+    parser.add_argument('--output', default=data_path(Constant.BENCHMARK_RESULT_FILE))
+    parser.add_argument('--compare', help="result file of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=Constant.BENCHMARK_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    output = run_benchmarks(args.scales, args.repeat, args.only)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(output, file, indent=2)
+    print("Benchmark results saved to " + args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            previous = json.load(file)
+        regressions = compare_benchmarks(previous, output, args.tolerance)
+        for name, scale_name, metric, before, after in regressions:
+            print("[Regression] %s (%s) %s: %s -> %s" % (name, scale_name, metric, before, after))
+        if regressions == []:
+            print("No regression over %d%%" % (args.tolerance * 100))
+
+
+if __name__ == '__main__':
+    main()
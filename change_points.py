@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized change-point detection: binary segmentation of the mean with a linear-time cost, run on the whole
+(dates x series) matrix at once. Every series gets its change points, and its onset, the change point with the
+largest rise of the mean, with the size of the rise. Keywords are screened and dated by their onset instead of fixed
+skew and max thresholds and the global peak.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import numpy as np
+import pandas as pd
+
+import Constant
+
+
+def noise_level(values: np.ndarray, min_sigma: float = Constant.CHANGEPOINT_MIN_SIGMA) -> np.ndarray:
+    """
+    Robust standard deviation of the noise of every column from the median absolute first difference, which
+    level shifts hardly move
+    :param values: 2-D array (dates x series)
+    :param min_sigma: floor of the noise, the rounding of google trend to integers
+    :return: noise of every column
+    >>> noise_level(np.array([[0., 5.], [1., 5.], [0., 5.], [1., 5.]])).round(3)
+    array([1.048, 0.5  ])
+    """
+    differences = np.abs(np.diff(values, axis=0))
+    sigma = np.median(differences, axis=0) / (0.6745 * np.sqrt(2)) if len(values) > 1 else np.zeros(values.shape[1])
+    return np.maximum(sigma, min_sigma)
+
+
+def _segment_bounds(cuts: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Start and end of the segment of every boundary position: the last cut at or before it and the first cut after it
+    :param cuts: boolean array (series x dates + 1) with the cuts, True at 0 and at the end
+    :return: start and end index arrays of the same shape
+    """
+    positions = np.broadcast_to(np.arange(cuts.shape[1]), cuts.shape)
+    starts = np.maximum.accumulate(np.where(cuts, positions, 0), axis=1)
+    after = np.where(cuts, positions, cuts.shape[1] - 1)
+    ends = np.minimum.accumulate(after[:, ::-1], axis=1)[:, ::-1]
+    # the end of a position is the first cut strictly after it
+    ends = np.concatenate([ends[:, 1:], ends[:, -1:]], axis=1)
+    return starts, ends
+
+
+def change_points(values: np.ndarray, penalty: float = Constant.CHANGEPOINT_PENALTY,
+                  max_change_points: int = Constant.CHANGEPOINT_MAX,
+                  min_size: int = Constant.CHANGEPOINT_MIN_SIZE) -> np.ndarray:
+    """
+    Binary segmentation of the mean of every column. Each round splits, in every series at once, the segment whose
+    best split lowers the squared error the most, if it lowers it by more than penalty * sigma^2 * log(dates). The
+    gain of every split point comes from cumulative sums, so a round is linear in the size of the matrix.
+    :param values: 2-D array (dates x series) without NaN
+    :param penalty: cost of one more change point, in units of the noise variance times log(dates)
+    :param max_change_points: largest number of change points of a series
+    :param min_size: fewest dates of a segment
+    :return: boolean array (series x dates + 1), True at 0, at the end and at the first date of every new segment
+    >>> values = np.zeros((60, 2))
+    >>> values[40:, 0] = 50
+    >>> np.flatnonzero(change_points(values)[0]).tolist(), np.flatnonzero(change_points(values)[1]).tolist()
+    ([0, 40, 60], [0, 60])
+    """
+    values = np.asarray(values, dtype=float).T
+    num_of_series, num_of_dates = values.shape
+    sums = np.concatenate([np.zeros((num_of_series, 1)), np.cumsum(values, axis=1)], axis=1)
+    threshold = penalty * noise_level(values.T) ** 2 * np.log(max(num_of_dates, 2))
+
+    cuts = np.zeros((num_of_series, num_of_dates + 1), dtype=bool)
+    cuts[:, [0, -1]] = True
+    rows = np.arange(num_of_series)
+    for _ in range(max_change_points):
+        starts, ends = _segment_bounds(cuts)
+        split = np.arange(num_of_dates + 1)
+        left, right = split - starts, ends - split
+        left_sum = sums - np.take_along_axis(sums, starts, axis=1)
+        right_sum = np.take_along_axis(sums, ends, axis=1) - sums
+        total = left_sum + right_sum
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = left_sum ** 2 / left + right_sum ** 2 / right - total ** 2 / (left + right)
+        gain[(left < min_size) | (right < min_size) | cuts] = -np.inf
+
+        best = np.argmax(gain, axis=1)
+        accepted = gain[rows, best] > threshold
+        if not accepted.any():
+            break
+        cuts[rows[accepted], best[accepted]] = True
+    return cuts
+
+
+def detect_onsets(dates: np.ndarray, values: np.ndarray, since: str = None, **options) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Onset of every column: the change point with the largest rise from the mean of the segment before to the mean
+    of the segment after
+    :param dates: datetime64 array, one per row
+    :param values: 2-D array (dates x series), NaN is treated as 0
+    :param since: first date an onset may have, e.g. the COVID-19 cutoff for a 5-year trend
+    :param options: penalty, max_change_points and min_size of change_points()
+    :return: onset date of every column (NaT without a rise), size of the rise and number of change points
+    >>> dates = pd.date_range('2020-01-01', periods=60).values
+    >>> values = np.zeros((60, 2))
+    >>> values[20:, 0], values[45:, 0] = 10, 80
+    >>> onset_dates, magnitudes, counts = detect_onsets(dates, values)
+    >>> str(onset_dates[0])[:10], float(magnitudes[0]), counts.tolist(), str(onset_dates[1])
+    ('2020-02-15', 70.0, [2, 0], 'NaT')
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    cuts = change_points(values, **options)
+    starts, ends = _segment_bounds(cuts)
+    sums = np.concatenate([np.zeros((values.shape[1], 1)), np.cumsum(values.T, axis=1)], axis=1)
+    rows = np.arange(values.shape[1])[:, np.newaxis]
+    means = (sums[rows, ends] - sums[rows, starts]) / np.maximum(ends - starts, 1)
+
+    # rise at every change point: mean of the segment it opens minus mean of the segment it closes
+    rise = np.full(cuts.shape, -np.inf)
+    inner = cuts.copy()
+    inner[:, [0, -1]] = False
+    rise[:, 1:-1] = np.where(inner[:, 1:-1], means[:, 1:-1] - means[:, :-2], -np.inf)
+    if since is not None:
+        rise[:, :-1][:, np.asarray(dates) < np.datetime64(since)] = -np.inf
+
+    best = np.argmax(rise, axis=1)
+    magnitudes = rise[rows[:, 0], best]
+    found = magnitudes > 0
+    onset_dates = np.full(values.shape[1], np.datetime64('NaT'), dtype='datetime64[ns]')
+    onset_dates[found] = np.asarray(dates, dtype='datetime64[ns]')[best[found]]
+    return onset_dates, np.where(found, magnitudes, 0.0), inner.sum(axis=1)
+
+
+def onset_dates(df: pd.DataFrame, keywords: list = None, since: str = None, **options) -> dict:
+    """
+    Onset date of every keyword with a rise, in the form of the max date dictionary of select_representative_kw(),
+    so awareness_date_report() can date the awareness by the onsets instead of the peaks
+    :param df: google trend data frame with 'date' and one column per keyword
+    :param keywords: keywords to date, e.g. the max date dictionary of select_representative_kw(), default is every
+    keyword
+    :param since: first date an onset may have
+    :param options: penalty, max_change_points and min_size of change_points()
+    :return: dictionary of each item's onset date
+    >>> df = pd.DataFrame({'date': pd.date_range('2020-01-01', periods=40), 'mask': [0] * 30 + [100] * 10,
+    ...                    'milk': [50] * 40})
+    >>> onset_dates(df)
+    {'mask': Timestamp('2020-01-31 00:00:00')}
+    """
+    keywords = list(df.columns[1:]) if keywords is None else list(keywords)
+    df = df.sort_values('date', kind='stable')
+    dates, _, _ = detect_onsets(df['date'].values, df[keywords].to_numpy(dtype=float), since, **options)
+    return {kw: pd.Timestamp(date) for kw, date in zip(keywords, dates) if not pd.isna(date)}
+
+
+def select_changepoint_impacted(df: pd.DataFrame, since: str = Constant.COVID19_CUTOFF_DATE,
+                                min_magnitude: float = Constant.CHANGEPOINT_MIN_MAGNITUDE, **options) -> list:
+    """
+    Screen the items impacted by COVID-19 by their onset instead of skew and max thresholds: the mean of the
+    long-term trend rises by at least min_magnitude at a change point on or after since
+    :param df: google trend data frame with 'date' and one column per keyword
+    :param since: first date an onset may have
+    :param min_magnitude: smallest rise of the mean, on the 0-100 scale of google trend
+    :param options: penalty, max_change_points and min_size of change_points()
+    :return: list of items impacted by COVID-19
+    >>> df = pd.DataFrame({'date': pd.date_range('2019-12-01', periods=60), 'mask': [2] * 40 + [90] * 20,
+    ...                    'milk': [50] * 60, 'yeast': [90] * 20 + [2] * 40})
+    >>> select_changepoint_impacted(df)
+    ['mask']
+    """
+    keywords = list(df.columns[1:])
+    df = df.sort_values('date', kind='stable')
+    _, magnitudes, _ = detect_onsets(df['date'].values, df[keywords].to_numpy(dtype=float), since, **options)
+    return [kw for kw, magnitude in zip(keywords, magnitudes) if magnitude >= min_magnitude]
+
+
+def select_changepoint_representative(df: pd.DataFrame, impacted_item: list,
+                                      min_magnitude: float = Constant.CHANGEPOINT_MIN_MAGNITUDE,
+                                      **options) -> (list, dict):
+    """
+    Screen the representative items by their onset instead of window and max thresholds: the mean of the short-term
+    trend rises by at least min_magnitude at a change point
+    :param df: google trend data frame with 'date' and one column per keyword
+    :param impacted_item: items list of select_changepoint_impacted(), every item when empty
+    :param min_magnitude: smallest rise of the mean, on the 0-100 scale of google trend
+    :param options: penalty, max_change_points and min_size of change_points()
+    :return: representative keywords list and dictionary of items' trend max date, like select_representative_kw()
+    >>> df = pd.DataFrame({'date': pd.date_range('2020-01-01', periods=60), 'mask': [2] * 40 + [90] * 20,
+    ...                    'milk': [50] * 59 + [60]})
+    >>> items, max_dates = select_changepoint_representative(df, [])
+    >>> items, max_dates['milk']
+    (['mask'], Timestamp('2020-02-29 00:00:00'))
+    """
+    keywords = list(df.columns[1:]) if impacted_item == [] else list(impacted_item)
+    df = df.sort_values('date', kind='stable')
+    _, magnitudes, _ = detect_onsets(df['date'].values, df[keywords].to_numpy(dtype=float), None, **options)
+    max_dates = {kw: pd.Timestamp(df['date'].iloc[int(np.argmax(df[kw].to_numpy()))]) for kw in keywords}
+    return [kw for kw, magnitude in zip(keywords, magnitudes) if magnitude >= min_magnitude], max_dates
+
+
+def onset_table(since: str = None, options: dict = None, **trend_dfs) -> pd.DataFrame:
+    """
+    Onset of every keyword of every region at once: the keyword x region series are stacked into one matrix on the
+    dates every region has
+    :param since: first date an onset may have
+    :param options: penalty, max_change_points and min_size of change_points()
+    :param trend_dfs: region=google trend data frame with 'date' and one column per keyword
+    :return: tidy data frame with region, keyword, onset date, size of the rise and number of change points, sorted
+    by region and onset date
+    >>> dates = pd.date_range('2020-01-01', periods=40)
+    >>> table = onset_table(US=pd.DataFrame({'date': dates, 'mask': [0] * 30 + [100] * 10}),
+    ...                     TW=pd.DataFrame({'date': dates, 'mask': [0] * 10 + [100] * 30}))
+    >>> table[['region', 'onset_date']].to_dict('list')
+    {'region': ['TW', 'US'], 'onset_date': [Timestamp('2020-01-11 00:00:00'), Timestamp('2020-01-31 00:00:00')]}
+    """
+    regions = list(trend_dfs)
+    frames = {region: trend_dfs[region].set_index('date').sort_index() for region in regions}
+    dates = None
+    for df in frames.values():
+        dates = pd.DatetimeIndex(df.index) if dates is None else dates.intersection(pd.DatetimeIndex(df.index))
+
+    pairs = [(region, kw) for region in regions for kw in frames[region].columns]
+    if pairs == [] or len(dates) == 0:
+        return pd.DataFrame(columns=['region', 'keyword', 'onset_date', 'magnitude', 'change_points'])
+    values = np.column_stack([frames[region].loc[dates, kw].to_numpy(dtype=float) for region, kw in pairs])
+    onsets, magnitudes, counts = detect_onsets(dates.values, values, since, **({} if options is None else options))
+
+    table = pd.DataFrame({'region': [region for region, _ in pairs], 'keyword': [kw for _, kw in pairs],
+                          'onset_date': onsets, 'magnitude': magnitudes, 'change_points': counts})
+    return table.sort_values(['region', 'onset_date'], kind='stable').reset_index(drop=True)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Run the doctests under pytest --doctest-modules the way fixtures.py replay runs them: in a temporary data root seeded
+by seed_data_root(), replaying the JHU table and the Google Trend payloads recorded in FIXTURES instead of fetching.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import shutil
+import tempfile
+
+import pytest
+
+import Constant
+from fixtures import offline_run, project_dir, seed_data_root
+
+
+@pytest.fixture(scope='session')
+def offline_root():
+    """
+    A temporary data root seeded by seed_data_root(), removed at the end of the session
+    :return: path of the data root
+    """
+    root = tempfile.mkdtemp()
+    try:
+        seed_data_root(root)
+        yield root
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def replay_fixtures(offline_root):
+    """
+    Replay the checked-in fixtures in the seeded data root during every test, then restore the previous data root and
+    fixtures
+    :param offline_root: data root of the session
+    :return: None
+    """
+    with offline_run(offline_root, 'replay', project_dir() + Constant.FIXTURES_DIR):
+        yield
@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""
+Local store and ingestion of the JHU COVID-19 confirmed cases time series
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import datetime
+import json
+import os
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import Constant
+from data_cache import frame_columns, read_frame, write_frame
+from fixtures import fixture_mode, jhu_source
+from instrumentation import count_request
+from regions import REGIONS, get_region
+
+KEY_COLUMNS = [Constant.PROVINCE_STATE, Constant.COUNTRY_REGION]
+
+
+def parse_jhu_date(column: str) -> datetime.datetime:
+    """
+    Convert a date column name of the JHU table to datetime
+    :param column: column name such as '1/22/20'
+    :return: datetime of the column
+    >>> parse_jhu_date('1/22/20')
+    datetime.datetime(2020, 1, 22, 0, 0)
+    """
+    return datetime.datetime.strptime(column, Constant.JHU_DATE_FORMAT)
+
+
+def upstream_version(source: str = None) -> str:
+    """
+    Version of the JHU table, read without downloading it: modification time and size of a local file, ETag or
+    Last-Modified of a URL
+    :param source: URL or local path of the JHU table, default is the JHU Github repository or its recording
+    :return: the version, or None when it cannot be told
+    >>> import tempfile
+    >>> source = os.path.join(tempfile.mkdtemp(), 'upstream.csv')
+    >>> pd.DataFrame({'Country/Region': ['US'], '1/22/20': [1]}).to_csv(source, index=False)
+    >>> upstream_version(source) == upstream_version(source), upstream_version(source + '.missing')
+    (True, None)
+    """
+    if source is None:
+        source = Constant.DATA_URL + Constant.DATA_POSTFIX_CSV
+        if fixture_mode()[0] == 'replay':
+            source = jhu_source(source)
+
+    if os.path.exists(source):
+        stat = os.stat(source)
+        return str(stat.st_mtime_ns) + ":" + str(stat.st_size)
+    if not source.startswith(('http://', 'https://')):
+        return None
+
+    count_request(source)
+    try:
+        with urllib.request.urlopen(urllib.request.Request(source, method='HEAD'), timeout=30) as response:
+            return response.headers.get('ETag') or response.headers.get('Last-Modified')
+    except OSError:
+        return None
+
+
+def store_meta_path(store_path: str) -> str:
+    """
+    Path of the metadata of a local COVID-19 store
+    :param store_path: path of the local store
+    :return: path of the JSON file next to the store
+    >>> store_meta_path('data/COVID19_store.npz')
+    'data/COVID19_store.json'
+    """
+    return os.path.splitext(store_path)[0] + Constant.COVID_STORE_META_POSTFIX
+
+
+def write_store_meta(store_path: str, store_df: pd.DataFrame, version: str):
+    """
+    Record the last day of the JHU table and its version next to the store
+    :param store_path: path of the local store
+    :param store_df: the whole store, whose last column is the last day of the JHU table
+    :param version: version of the JHU table the store was synced from
+    :return: None
+    """
+    date_columns = store_df.columns[len(KEY_COLUMNS):]
+    meta = {'upstream_last_date': date_columns[-1] if len(date_columns) > 0 else None, 'upstream_version': version}
+    with open(store_meta_path(store_path), 'w') as f:
+        json.dump(meta, f)
+
+
+def read_store_meta(store_path: str) -> dict:
+    """
+    Metadata recorded by write_store_meta()
+    :param store_path: path of the local store
+    :return: dict with upstream_last_date and upstream_version, empty when nothing was recorded
+    """
+    try:
+        with open(store_meta_path(store_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def sync_COVID19_store(store_path: str, source: str = None) -> pd.DataFrame:
+    """
+    Bring the local COVID-19 store up to date with the JHU table. Only the date columns newer than the store are
+    parsed and appended; the store is rebuilt from scratch when the JHU table has new regions.
+    :param store_path: path of the local store
+    :param source: URL or local path of the JHU table, default is the JHU Github repository or its recording
+    :return: the whole store with Province/State, Country/Region and one int32 column per day
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> source, store_path = os.path.join(folder, 'upstream.csv'), os.path.join(folder, 'store.npz')
+    >>> upstream = pd.DataFrame({'Province/State': [None, 'Hubei'], 'Country/Region': ['Taiwan*', 'China'],
+    ...                          'Lat': [23.7, 30.9], 'Long': [121.0, 112.2], '1/22/20': [1, 444]})
+    >>> upstream.to_csv(source, index=False)
+    >>> sync_COVID19_store(store_path, source).shape
+    Synced 1 new date column(s) of COVID-19 data
+    (2, 3)
+    >>> upstream['1/23/20'] = [1, 444]
+    >>> upstream.to_csv(source, index=False)
+    >>> list(sync_COVID19_store(store_path, source).columns)
+    Synced 1 new date column(s) of COVID-19 data
+    ['Province/State', 'Country/Region', '1/22/20', '1/23/20']
+    """
+    # taken before the read, so a table updated in between is synced again next time
+    version = upstream_version(source)
+    if source is None:
+        source = jhu_source(Constant.DATA_URL + Constant.DATA_POSTFIX_CSV)
+
+    store_df = None
+    stored_dates = set()
+    if os.path.exists(store_path):
+        store_df = read_frame(store_path)
+        stored_dates = set(store_df.columns[len(KEY_COLUMNS):])
+
+    count_request(source)
+    new_df = pd.read_csv(source, usecols=lambda x: x in KEY_COLUMNS or (x not in Constant.JHU_NON_DATE_COLUMNS and
+                                                                        x not in stored_dates))
+    new_df[Constant.PROVINCE_STATE] = new_df[Constant.PROVINCE_STATE].fillna('').astype(str)
+    new_dates = [col for col in new_df.columns if col not in KEY_COLUMNS]
+    new_df[new_dates] = new_df[new_dates].fillna(0).astype(np.int32)
+    new_df = new_df[KEY_COLUMNS + new_dates]
+
+    if store_df is not None:
+        if new_dates == []:
+            write_store_meta(store_path, store_df, version)
+            return store_df
+
+        new_keys = pd.MultiIndex.from_frame(new_df[KEY_COLUMNS]).difference(
+            pd.MultiIndex.from_frame(store_df[KEY_COLUMNS]))
+        if len(new_keys) > 0:
+            # older days of the new regions are not in the store, so start over
+            print("Found " + str(len(new_keys)) + " new region(s), rebuilding the COVID-19 store")
+            os.remove(store_path)
+            return sync_COVID19_store(store_path, source)
+
+        new_df = store_df.merge(new_df, on=KEY_COLUMNS, how='left')
+        new_df[new_dates] = new_df[new_dates].fillna(0).astype(np.int32)
+
+    write_frame(store_path, new_df)
+    write_store_meta(store_path, new_df, version)
+    print("Synced " + str(len(new_dates)) + " new date column(s) of COVID-19 data")
+    return new_df
+
+
+def refresh_COVID19_store(end: datetime, store_path: str, source: str = None) -> pd.DataFrame:
+    """
+    Sync the local COVID-19 store when it does not reach the end date yet and the JHU table changed since the last
+    sync, so an end date beyond the last day of the JHU table does not download it again until it is updated. Only the
+    column names of the store are read to tell.
+    :param end: datetime of the last day needed
+    :param store_path: path of the local store
+    :param source: URL or local path of the JHU table, default is the JHU Github repository or its recording
+    :return: the whole store when it was synced, otherwise None
+    """
+    date_columns = frame_columns(store_path)[len(KEY_COLUMNS):] if os.path.exists(store_path) else []
+    if date_columns == []:
+        return sync_COVID19_store(store_path, source)
+    if parse_jhu_date(date_columns[-1]) >= end:
+        return None
+
+    meta = read_store_meta(store_path)
+    # the JHU table did not reach the end date either, it only can once it changes
+    if meta.get('upstream_last_date') != date_columns[-1] or meta.get('upstream_version') is None or \
+            upstream_version(source) != meta['upstream_version']:
+        return sync_COVID19_store(store_path, source)
+    return None
+
+
+def load_COVID19_store(end: datetime, store_path: str, source: str = None) -> pd.DataFrame:
+    """
+    Answer a query of COVID-19 data till the end date by slicing the local store, brought up to date by
+    refresh_COVID19_store() first
+    :param end: datetime of the last day needed
+    :param store_path: path of the local store
+    :param source: URL or local path of the JHU table, default is the JHU Github repository or its recording
+    :return: a data frame with Country/Region and one column per day till the end date
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> source, store_path = os.path.join(folder, 'upstream.csv'), os.path.join(folder, 'store.npz')
+    >>> pd.DataFrame({'Province/State': [None], 'Country/Region': ['Taiwan*'], 'Lat': [23.7], 'Long': [121.0],
+    ...               '1/22/20': [1], '1/23/20': [1]}).to_csv(source, index=False)
+    >>> list(load_COVID19_store(datetime.datetime(2020, 1, 22), store_path, source).columns)
+    Synced 2 new date column(s) of COVID-19 data
+    ['Country/Region', '1/22/20']
+    >>> load_COVID19_store(datetime.datetime(2020, 1, 23), store_path, source).shape
+    (1, 3)
+    >>> load_COVID19_store(datetime.datetime(2020, 1, 25), store_path, source).shape
+    (1, 3)
+    >>> pd.DataFrame({'Province/State': [None], 'Country/Region': ['Taiwan*'], 'Lat': [23.7], 'Long': [121.0],
+    ...               '1/22/20': [1], '1/23/20': [1], '1/24/20': [3]}).to_csv(source, index=False)
+    >>> load_COVID19_store(datetime.datetime(2020, 1, 25), store_path, source).shape
+    Synced 1 new date column(s) of COVID-19 data
+    (1, 4)
+    """
+    store_df = refresh_COVID19_store(end, store_path, source)
+    if store_df is None:
+        store_df = read_frame(store_path)
+
+    date_columns = [col for col in store_df.columns[len(KEY_COLUMNS):] if parse_jhu_date(col) <= end]
+    return store_df[[Constant.COUNTRY_REGION] + date_columns]
+
+
+def read_COVID19_long(source: str = None, countries: list = None, start: datetime = None, end: datetime = None,
+                      chunksize: int = Constant.JHU_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Read the JHU table straight into the long case table of build_case_table(), with the country and date filters
+    pushed into the read. A JHU CSV is read once chunk by chunk, only the date columns within [start, end] are parsed
+    and the rows of other countries are dropped before a chunk is summed; a store of sync_COVID19_store() only loads
+    those columns. Blank counts are taken as 0, provinces are summed per country and counts are kept as int32.
+    :param source: URL or local path of the JHU table or of the local store, default is the JHU Github repository or
+    its recording
+    :param countries: JHU country names to keep, default is every country
+    :param start: first day to keep, default is the first day of the table
+    :param end: last day to keep, default is the last day of the table
+    :param chunksize: number of rows of the JHU table parsed at a time
+    :return: a data frame with int32 Confirmed indexed by the sorted (Country, Date)
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> source = os.path.join(folder, 'upstream.csv')
+    >>> pd.DataFrame({'Province/State': [None, 'Hubei', 'Beijing'], 'Country/Region': ['Taiwan*', 'China', 'China'],
+    ...               'Lat': [23.7, 30.9, 40.1], 'Long': [121.0, 112.2, 116.4], '1/22/20': [1, 444, 14],
+    ...               '1/23/20': [1, 444, None], '1/24/20': [3, 549, 36]}).to_csv(source, index=False)
+    >>> case_table = read_COVID19_long(source, ['Taiwan*', 'China'], end=datetime.datetime(2020, 1, 23), chunksize=1)
+    >>> case_table.reset_index()
+      Country       Date  Confirmed
+    0   China 2020-01-22        458
+    1   China 2020-01-23        444
+    2  Taiwan 2020-01-22          1
+    3  Taiwan 2020-01-23          1
+    >>> case_table['Confirmed'].dtype
+    dtype('int32')
+    >>> store_path = os.path.join(folder, 'store.npz')
+    >>> sync_COVID19_store(store_path, source).shape
+    Synced 3 new date column(s) of COVID-19 data
+    (3, 5)
+    >>> read_COVID19_long(store_path, ['China'], datetime.datetime(2020, 1, 24)).equals(
+    ...     read_COVID19_long(source, ['China'], datetime.datetime(2020, 1, 24)))
+    True
+    """
+    if source is None:
+        source = jhu_source(Constant.DATA_URL + Constant.DATA_POSTFIX_CSV)
+
+    def needed(col: str) -> bool:
+        if col == Constant.COUNTRY_REGION:
+            return True
+        if col in Constant.JHU_NON_DATE_COLUMNS:
+            return False
+        date = parse_jhu_date(col)
+        return (start is None or date >= start) and (end is None or date <= end)
+
+    if source.endswith(Constant.CACHE_POSTFIX):
+        chunks = [read_frame(source, usecols=needed)]
+    else:
+        count_request(source)
+        chunks = pd.read_csv(source, usecols=needed, chunksize=chunksize)
+
+    country_sums = []
+    for chunk in chunks:
+        if countries is not None:
+            chunk = chunk[chunk[Constant.COUNTRY_REGION].isin(countries)]
+        date_columns = [col for col in chunk.columns if col != Constant.COUNTRY_REGION]
+        counts = chunk[date_columns].fillna(0).astype(np.int32)
+        country_sums.append(counts.groupby(chunk[Constant.COUNTRY_REGION], sort=False).sum())
+    # provinces of one country can be split over two chunks
+    wide_df = pd.concat(country_sums).groupby(level=0).sum().astype(np.int32)
+    wide_df = wide_df.rename(index={Constant.TAIWAN: Constant.TAIWAN_NAME}).sort_index()
+
+    dates = pd.to_datetime(wide_df.columns, format=Constant.JHU_DATE_FORMAT)
+    index = pd.MultiIndex.from_product([wide_df.index, dates], names=['Country', 'Date'])
+    return pd.DataFrame({'Confirmed': wide_df.to_numpy().ravel()}, index=index)
+
+
+def load_COVID19_cases(end: datetime, store_path: str, countries: list = None, source: str = None) -> pd.DataFrame:
+    """
+    Answer a query of the case table of some countries till the end date from the local store, brought up to date by
+    refresh_COVID19_store() first; only the rows of the countries and the days up to the end date are read
+    :param end: datetime of the last day needed
+    :param store_path: path of the local store
+    :param countries: JHU country names to keep, default is every country
+    :param source: URL or local path of the JHU table, default is the JHU Github repository or its recording
+    :return: a data frame with int32 Confirmed indexed by the sorted (Country, Date)
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> source, store_path = os.path.join(folder, 'upstream.csv'), os.path.join(folder, 'store.npz')
+    >>> pd.DataFrame({'Province/State': [None, None], 'Country/Region': ['Taiwan*', 'US'], 'Lat': [23.7, 40.0],
+    ...               'Long': [121.0, -100.0], '1/22/20': [1, 1], '1/23/20': [1, 1]}).to_csv(source, index=False)
+    >>> load_COVID19_cases(datetime.datetime(2020, 1, 22), store_path, ['Taiwan*'], source).reset_index()
+    Synced 2 new date column(s) of COVID-19 data
+      Country       Date  Confirmed
+    0  Taiwan 2020-01-22          1
+    """
+    refresh_COVID19_store(end, store_path, source)
+    return read_COVID19_long(store_path, countries, end=end)
+
+
+def build_case_table(origin_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn the wide JHU table of every country into one long table indexed by (Country, Date). Provinces are summed
+    per country, so the table is built once and every country is then a slice of the index.
+    :param origin_df: wide JHU table with Country/Region and one column per day
+    :return: a data frame with Confirmed indexed by the sorted (Country, Date)
+    >>> origin_df = pd.DataFrame({'Country/Region': ['Taiwan*', 'China', 'China'], '1/22/20': [1, 444, 14],
+    ...                           '1/23/20': [1, 444, 22]})
+    >>> case_table = build_case_table(origin_df)
+    >>> case_table.loc[('China', pd.Timestamp('2020-01-23')), 'Confirmed']
+    np.int64(466)
+    >>> len(case_table), list(case_table.index.names)
+    (4, ['Country', 'Date'])
+    """
+    date_columns = [col for col in origin_df.columns if col not in Constant.JHU_NON_DATE_COLUMNS]
+    wide_df = origin_df.groupby(Constant.COUNTRY_REGION)[date_columns].sum()
+    wide_df = wide_df.rename(index={Constant.TAIWAN: Constant.TAIWAN_NAME}).sort_index()
+
+    index = pd.MultiIndex.from_product([wide_df.index, pd.to_datetime(date_columns, format=Constant.JHU_DATE_FORMAT)],
+                                       names=['Country', 'Date'])
+    return pd.DataFrame({'Confirmed': wide_df.to_numpy().ravel()}, index=index)
+
+
+def get_country_cases(case_table: pd.DataFrame, country: str) -> pd.DataFrame:
+    """
+    Slice the COVID-19 data of one country out of the table from build_case_table()
+    :param case_table: long table indexed by (Country, Date)
+    :param country: JHU country name, or geo code of a registered region
+    :return: a data frame with Country, Date and Confirmed of the country
+    >>> case_table = build_case_table(pd.DataFrame({'Country/Region': ['Taiwan*', 'US'], '1/22/20': [1, 1]}))
+    >>> get_country_cases(case_table, 'TW')
+      Country       Date  Confirmed
+    0  Taiwan 2020-01-22          1
+    >>> get_country_cases(case_table, 'Some Country')
+    Traceback (most recent call last):
+    ValueError: No such country
+    >>> get_country_cases(case_table.drop('US', level='Country'), 'US')
+    Traceback (most recent call last):
+    ValueError: No such country
+    """
+    if country in REGIONS:
+        country = REGIONS[country].case_name
+    elif country == Constant.TAIWAN:
+        country = Constant.TAIWAN_NAME
+
+    # the levels of a sliced index still list the countries that were dropped, the rows are looked up instead
+    try:
+        country_df = case_table.xs(country, level='Country', drop_level=False)
+    except KeyError:
+        raise ValueError("No such country") from None
+
+    return country_df.reset_index()
+
+
+def first_confirmed_dates(case_table: pd.DataFrame, countries: list) -> dict:
+    """
+    Find the date of the first confirmed case of every country in the table from build_case_table() at once
+    :param case_table: long table indexed by (Country, Date)
+    :param countries: geo codes of registered regions
+    :return: dictionary of every country's first confirmed date
+    >>> case_table = build_case_table(pd.DataFrame({'Country/Region': ['Taiwan*', 'US', 'US'], '1/22/20': [1, 0, 0],
+    ...                                             '1/23/20': [1, 0, 1]}))
+    >>> first_confirmed_dates(case_table, ['TW', 'US'])
+    {'TW': datetime.date(2020, 1, 22), 'US': datetime.date(2020, 1, 23)}
+    >>> first_confirmed_dates(case_table, ['GB'])
+    Traceback (most recent call last):
+    ValueError: No confirmed case of GB
+    """
+    confirmed = case_table.index[case_table['Confirmed'].to_numpy() > 0].to_frame(index=False)
+    first_dates = confirmed.groupby('Country')['Date'].min()
+
+    dates = {}
+    for country in countries:
+        case_name = get_region(country).case_name
+        if case_name not in first_dates.index:
+            raise ValueError("No confirmed case of " + country)
+        dates[country] = first_dates[case_name].date()
+    return dates
+
+
+def read_US_state_cases(source: str = None, end: datetime = None,
+                        chunksize: int = Constant.JHU_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Read the county rows of the JHU US table and sum them per state chunk by chunk, so the ~3,000 counties are never
+    held as one frame. The table is read once, only the date columns up to end are parsed, blank counts are taken as 0
+    and counts are kept as int32.
+    :param source: URL or local path of the JHU US table, default is the JHU Github repository or its recording
+    :param end: last day to keep, default is the last day of the table
+    :param chunksize: number of county rows parsed at a time
+    :return: wide data frame with Province_State and one column per day, one row per state
+    >>> import tempfile
+    >>> source = os.path.join(tempfile.mkdtemp(), 'us.csv')
+    >>> pd.DataFrame({'UID': [1, 2, 3], 'Admin2': ['Los Angeles', 'King', 'Orange'],
+    ...               'Province_State': ['California', 'Washington', 'California'], 'Country_Region': 'US',
+    ...               'Combined_Key': ['a', 'b', 'c'], '1/22/20': [0, 1, 0], '1/23/20': [1, 1, 2],
+    ...               '1/24/20': [3, 2, 2]}).to_csv(source, index=False)
+    >>> read_US_state_cases(source, datetime.datetime(2020, 1, 23), chunksize=2)
+      Province_State  1/22/20  1/23/20
+    0     California        0        3
+    1     Washington        1        1
+    >>> pd.DataFrame({'Province_State': ['Oregon', 'Oregon'], '1/22/20': [2, None]}).to_csv(source, index=False)
+    >>> read_US_state_cases(source)['1/22/20'].tolist()
+    [2]
+    """
+    if source is None:
+        source = jhu_source(Constant.DATA_URL_US + Constant.DATA_POSTFIX_CSV)
+
+    def needed(col: str) -> bool:
+        if col == Constant.PROVINCE_STATE_US:
+            return True
+        return col not in Constant.JHU_US_NON_DATE_COLUMNS and (end is None or parse_jhu_date(col) <= end)
+
+    count_request(source)
+    state_sums = []
+    for chunk in pd.read_csv(source, usecols=needed, chunksize=chunksize):
+        date_columns = [col for col in chunk.columns if col != Constant.PROVINCE_STATE_US]
+        chunk[date_columns] = chunk[date_columns].fillna(0).astype(np.int32)
+        state_sums.append(chunk.groupby(Constant.PROVINCE_STATE_US, sort=False).sum())
+    # counties of one state can be split over two chunks
+    return pd.concat(state_sums).groupby(level=0).sum().astype(np.int32).reset_index()
+
+
+def build_state_case_table(us_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn the wide state table of read_US_state_cases() into the long table of build_case_table(), with the geo code
+    of every registered state as its Country, so states and countries share one table. Rows of places that are not
+    registered states, such as cruise ships, are dropped.
+    :param us_df: wide table with Province_State and one column per day
+    :return: a data frame with Confirmed indexed by the sorted (Country, Date)
+    >>> us_df = pd.DataFrame({'Province_State': ['Washington', 'Georgia', 'Grand Princess'], '1/22/20': [1, 0, 0],
+    ...                       '1/23/20': [1, 2, 5]})
+    >>> build_state_case_table(us_df).loc['US-GA', 'Confirmed'].tolist()
+    [0, 2]
+    >>> sorted(set(build_state_case_table(us_df).index.get_level_values('Country')))
+    ['US-GA', 'US-WA']
+    """
+    geos = {REGIONS[geo].jhu_name: geo for geo in REGIONS if REGIONS[geo].parent == Constant.US}
+    date_columns = [col for col in us_df.columns if col not in Constant.JHU_US_NON_DATE_COLUMNS]
+    wide_df = us_df.groupby(Constant.PROVINCE_STATE_US)[date_columns].sum()
+    wide_df = wide_df[wide_df.index.isin(list(geos))].rename(index=geos).sort_index()
+
+    index = pd.MultiIndex.from_product([wide_df.index, pd.to_datetime(date_columns, format=Constant.JHU_DATE_FORMAT)],
+                                       names=['Country', 'Date'])
+    return pd.DataFrame({'Confirmed': wide_df.to_numpy().ravel()}, index=index)
+
+
+def combine_case_tables(country_table: pd.DataFrame, state_table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Stack the country and state case tables into one table sorted by (Country, Date), on the days of the country table
+    :param country_table: table of build_case_table()
+    :param state_table: table of build_state_case_table()
+    :return: the combined table
+    >>> countries = build_case_table(pd.DataFrame({'Country/Region': ['US'], '1/22/20': [1], '1/23/20': [3]}))
+    >>> states = build_state_case_table(pd.DataFrame({'Province_State': ['Washington'], '1/22/20': [1],
+    ...                                               '1/23/20': [3], '1/24/20': [4]}))
+    >>> combine_case_tables(countries, states)['Confirmed'].tolist()
+    [1, 3, 1, 3]
+    """
+    days = country_table.index.get_level_values('Date').unique()
+    state_table = state_table[state_table.index.get_level_values('Date').isin(days)]
+    return pd.concat([country_table, state_table]).sort_index()
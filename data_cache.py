@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache for Google Trend and COVID-19 data frames
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import Constant
+from instrumentation import count
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+def query_key(source: str, keywords: list, geo: str, timeframe: str) -> str:
+    """
+    Hash a full query to the key of its cache entry
+    :param source: data source, e.g. 'google_trend' or 'jhu_confirmed_global'
+    :param keywords: keywords of the query, order matters
+    :param geo: region of the query
+    :param timeframe: "start_date end_date" of the query
+    :return: hex digest of the query
+    >>> query_key('google_trend', ['mask'], 'US', '2020-01-01 2020-04-22') == \
+        query_key('google_trend', ['mask'], 'US', '2020-01-01 2020-04-22')
+    True
+    >>> query_key('google_trend', ['mask'], 'US', '2020-01-01 2020-04-22') == \
+        query_key('google_trend', ['mask'], 'US', '2020-01-01 2020-04-23')
+    False
+    """
+    query = json.dumps([source, list(keywords), geo, timeframe], ensure_ascii=False)
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: str):
+    """
+    Hold an exclusive lock on a file, so processes sharing a folder take turns
+    :param lock_path: path of the lock file, created when missing
+    :return: context manager
+    """
+    with open(lock_path, 'a+b') as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_frame(file_path: str, df: pd.DataFrame):
+    """
+    Save a data frame column by column into a compressed numpy archive
+    :param file_path: path of the .npz file
+    :param df: data frame with numeric, datetime or string columns
+    :return: None
+    """
+    arrays = {'__columns__': np.array([str(col) for col in df.columns], dtype=np.str_)}
+    for i, col in enumerate(df.columns):
+        values = df[col].to_numpy()
+        if values.dtype == object or pd.api.types.is_string_dtype(df[col]):
+            values = values.astype(np.str_)
+        arrays['c' + str(i)] = values
+    with open(file_path, 'wb') as file:
+        np.savez_compressed(file, **arrays)
+
+
+def read_frame(file_path: str, usecols=None) -> pd.DataFrame:
+    """
+    Load a data frame saved by write_frame(). Every column is its own array in the archive, so the columns left out
+    are never decompressed.
+    :param file_path: path of the .npz file
+    :param usecols: optional function telling whether a column name is loaded, default is every column
+    :return: the data frame
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'frame.npz')
+    >>> df = pd.DataFrame({'date': pd.to_datetime(['2020-01-01', '2020-01-02']), 'mask': [3, 100]})
+    >>> write_frame(path, df)
+    >>> read_frame(path).equals(df)
+    True
+    >>> read_frame(path, usecols=lambda col: col != 'date').columns.tolist(), frame_columns(path)
+    (['mask'], ['date', 'mask'])
+    """
+    with np.load(file_path, allow_pickle=False) as archive:
+        columns = [str(col) for col in archive['__columns__']]
+        arrays = {col: archive['c' + str(i)] for i, col in enumerate(columns) if usecols is None or usecols(col)}
+        return pd.DataFrame(arrays, columns=list(arrays))
+
+
+def frame_columns(file_path: str) -> list:
+    """
+    Column names of a data frame saved by write_frame(), without loading any column
+    :param file_path: path of the .npz file
+    :return: list of column names
+    """
+    with np.load(file_path, allow_pickle=False) as archive:
+        return [str(col) for col in archive['__columns__']]
+
+
+class DataCache:
+    """
+    On-disk cache keyed by the hash of the full query. Every entry is one compressed columnar file, a manifest records
+    the size and last access time of every entry, and the least recently used entries are evicted once the cache
+    grows over max_bytes. Processes may share a cache folder: a look-up only notes the access time in memory, and
+    put() and close() merge the noted entries into the manifest on disk under a file lock.
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> cache, other = DataCache(folder), DataCache(folder)
+    >>> key = query_key('google_trend', ['mask'], 'US', '2020-01-01 2020-01-02')
+    >>> cache.get(key) is None
+    True
+    >>> df = pd.DataFrame({'date': pd.to_datetime(['2020-01-01', '2020-01-02']), 'mask': [3, 100]})
+    >>> cache.put(key, df)
+    >>> cache.get(key).equals(df), other.get(key).equals(df)
+    (True, True)
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> other.put(query_key('google_trend', ['milk'], 'US', '2020-01-01 2020-01-02'), df)
+    >>> cache.close()
+    >>> with open(os.path.join(folder, Constant.CACHE_MANIFEST), encoding='utf-8') as file:
+    ...     len(json.load(file))
+    2
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = Constant.CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._manifest_path = os.path.join(cache_dir, Constant.CACHE_MANIFEST)
+        self._lock_path = self._manifest_path + '.lock'
+        # entries put and access times noted since the manifest was last written
+        self._put = {}
+        self._accessed = {}
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + Constant.CACHE_POSTFIX)
+
+    def _read_manifest(self) -> dict:
+        if os.path.exists(self._manifest_path) is False:
+            return {}
+        with open(self._manifest_path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def _flush(self):
+        """
+        Merge the noted entries into the manifest on disk, evict over the size bound and write it back. Called with
+        self._lock held.
+        """
+        if self._put == {} and self._accessed == {}:
+            return
+
+        with file_lock(self._lock_path):
+            manifest = self._read_manifest()
+            manifest.update(self._put)
+            for key, last_access in self._accessed.items():
+                if key in manifest:
+                    manifest[key]['last_access'] = max(manifest[key]['last_access'], last_access)
+                elif os.path.exists(self._entry_path(key)):
+                    manifest[key] = {'bytes': os.path.getsize(self._entry_path(key)), 'last_access': last_access,
+                                     'query': {}}
+
+            total = sum(entry['bytes'] for entry in manifest.values())
+            for key in sorted(manifest, key=lambda k: manifest[k]['last_access']):
+                if total <= self.max_bytes:
+                    break
+                if key in self._put:
+                    continue
+                total -= manifest.pop(key)['bytes']
+                if os.path.exists(self._entry_path(key)):
+                    os.remove(self._entry_path(key))
+
+            tmp_path = self._manifest_path + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(manifest, file, ensure_ascii=False)
+            os.replace(tmp_path, self._manifest_path)
+        self._put, self._accessed = {}, {}
+
+    def get(self, key: str) -> pd.DataFrame:
+        """
+        Look up an entry and note it as recently used
+        :param key: key from query_key()
+        :return: the cached data frame, or None on a miss
+        """
+        with self._lock:
+            try:
+                df = read_frame(self._entry_path(key))
+            except FileNotFoundError:
+                self.misses += 1
+                count('cache_misses')
+                return None
+            self._accessed[key] = time.time()
+            self.hits += 1
+            count('cache_hits')
+            return df
+
+    def put(self, key: str, df: pd.DataFrame, query: dict = None):
+        """
+        Store an entry, then write the manifest and evict the least recently used entries over the size bound
+        :param key: key from query_key()
+        :param df: the data frame to store
+        :param query: readable description of the query kept in the manifest
+        :return: None
+        """
+        with self._lock:
+            path = self._entry_path(key)
+            # readers of other processes only ever see a whole entry
+            tmp_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+            write_frame(tmp_path, df)
+            os.replace(tmp_path, path)
+            self._put[key] = {'bytes': os.path.getsize(path), 'last_access': time.time(), 'query': query or {}}
+            self._flush()
+
+    def close(self):
+        """
+        Write the access times noted since the last put() into the manifest
+        :return: None
+        """
+        with self._lock:
+            self._flush()
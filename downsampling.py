@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Shape-preserving downsampling of long series before they are drawn. A figure only has a few hundred pixels per axis,
+so every series is cut to at most PLOT_MAX_POINTS points that keep its peaks and dips: min/max bucketing keeps the
+lowest and highest point of every bucket, LTTB (largest triangle three buckets) keeps the point of every bucket that
+spans the largest triangle with its neighbours. Both run on all columns of a (dates x series) matrix at once.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import numpy as np
+import pandas as pd
+
+import Constant
+
+
+def minmax_indices(values: np.ndarray, max_points: int = Constant.PLOT_MAX_POINTS) -> list:
+    """
+    Rows of the min and max of every column in (max_points - 2) / 2 equal buckets, with the first and last row
+    :param values: 2-D array (dates x series)
+    :param max_points: most rows kept per column
+    :return: sorted row indices of every column
+    >>> values = np.array([[0, 5], [9, 5], [1, 5], [2, 5], [-4, 5], [3, 5], [1, 5], [0, 5]])
+    >>> [indices.tolist() for indices in minmax_indices(values, 6)]
+    [[0, 1, 2, 4, 5, 7], [0, 1, 4, 7]]
+    """
+    values = np.asarray(values, dtype=float)
+    num_of_rows, num_of_columns = values.shape
+    if num_of_rows <= max_points:
+        return [np.arange(num_of_rows) for _ in range(num_of_columns)]
+
+    # equal buckets of the inner rows, the last one padded so NaN and padding are never picked
+    inner = values[1:-1]
+    size = -(-len(inner) // max(1, (max_points - 2) // 2))
+    padded = np.full((-(-len(inner) // size) * size, num_of_columns), np.nan)
+    padded[:len(inner)] = inner
+    buckets = padded.reshape(-1, size, num_of_columns)
+    offsets = 1 + np.arange(len(buckets))[:, np.newaxis] * size
+    lowest = np.where(np.isnan(buckets), np.inf, buckets).argmin(axis=1) + offsets
+    highest = np.where(np.isnan(buckets), -np.inf, buckets).argmax(axis=1) + offsets
+    ends = [0, num_of_rows - 1]
+    return [np.unique(np.concatenate([ends, lowest[:, c], highest[:, c]])) for c in range(num_of_columns)]
+
+
+def lttb_indices(values: np.ndarray, max_points: int = Constant.PLOT_MAX_POINTS) -> list:
+    """
+    Rows kept by largest triangle three buckets: the first and last row, and in each of max_points - 2 buckets the
+    row spanning the largest triangle with the row kept in the previous bucket and the mean of the next bucket. The
+    buckets are walked one after another, every step for all columns at once. Dates are taken evenly spaced.
+    :param values: 2-D array (dates x series)
+    :param max_points: most rows kept per column
+    :return: sorted row indices of every column
+    >>> values = np.array([[0, 5], [9, 5], [1, 5], [2, 5], [-4, 5], [3, 5], [1, 5], [0, 5]])
+    >>> [indices.tolist() for indices in lttb_indices(values, 4)]
+    [[0, 1, 4, 7], [0, 1, 4, 7]]
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    num_of_rows, num_of_columns = values.shape
+    if num_of_rows <= max_points or max_points < 3:
+        return [np.arange(num_of_rows) for _ in range(num_of_columns)]
+
+    edges = np.append(np.linspace(1, num_of_rows - 1, max_points - 1).astype(int), num_of_rows)
+    columns = np.arange(num_of_columns)
+    kept = np.zeros((max_points, num_of_columns), dtype=int)
+    kept[-1] = num_of_rows - 1
+    for b in range(max_points - 2):
+        start, end, next_end = edges[b], edges[b + 1], edges[b + 2]
+        next_x, next_y = (end + next_end - 1) / 2, values[end:next_end].mean(axis=0)
+        previous_x, previous_y = kept[b], values[kept[b], columns]
+        x = np.arange(start, end)[:, np.newaxis]
+        area = np.abs((previous_x - next_x) * (values[start:end] - previous_y) -
+                      (previous_x - x) * (next_y - previous_y))
+        kept[b + 1] = start + area.argmax(axis=0)
+    return [kept[:, c] for c in range(num_of_columns)]
+
+
+def downsample_indices(values: np.ndarray, max_points: int = Constant.PLOT_MAX_POINTS,
+                       method: str = Constant.PLOT_DOWNSAMPLING) -> list:
+    """
+    Rows to draw of every column
+    :param values: 2-D array (dates x series)
+    :param max_points: most rows kept per column
+    :param method: 'lttb' or 'minmax'
+    :return: sorted row indices of every column
+    """
+    if method not in ['lttb', 'minmax']:
+        raise ValueError("Unknown downsampling")
+    return (lttb_indices if method == 'lttb' else minmax_indices)(values, max_points)
+
+
+def downsample_frame(df: pd.DataFrame, columns: list, max_points: int = Constant.PLOT_MAX_POINTS,
+                     method: str = Constant.PLOT_DOWNSAMPLING) -> pd.DataFrame:
+    """
+    Keep the rows any of the columns needs, for figures that draw several columns on shared dates
+    :param df: data frame with one row per date
+    :param columns: columns to draw
+    :param max_points: most rows kept per column
+    :param method: 'lttb' or 'minmax'
+    :return: the kept rows of df
+    >>> df = pd.DataFrame({'date': pd.date_range('2020-01-01', periods=1000), 'mask': np.arange(1000) % 97})
+    >>> len(downsample_frame(df, ['mask'], 100)) <= 100, len(downsample_frame(df.head(50), ['mask'], 100))
+    (True, 50)
+    """
+    if len(df) <= max_points:
+        return df
+    indices = downsample_indices(df[columns].to_numpy(dtype=float), max_points, method)
+    return df.iloc[np.unique(np.concatenate(indices))]
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Figure rendering without pyplot state: figures are drawn on the non-interactive Agg canvas, released right after
+saving, and batches of figures can be rendered on a process pool
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+import Constant
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+PLOT_FUNCTIONS = ['plot_google_trend_of_item', 'plot_items_with_confirmed_case',
+                  'plot_confirmed_number_and_awareness_comparison']
+
+
+def new_figure(figsize: tuple) -> 'Figure':
+    """
+    Create a figure on its own Agg canvas. The figure is not registered in pyplot, so nothing keeps it alive once
+    the caller drops it.
+    :param figsize: (width, height) in inches
+    :return: the figure
+    >>> fig = new_figure((4, 3))
+    >>> type(fig.canvas).__name__
+    'FigureCanvasAgg'
+    """
+    # matplotlib is only imported once something is plotted
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def grid_shape(panels: int, aspect: float = Constant.GT_GRID_ASPECT) -> (int, int):
+    """
+    Rows and columns of a grid of small multiples sized to the number of panels, about aspect times more rows than
+    columns, so 10 keywords keep the 5 x 2 grid
+    :param panels: number of panels
+    :param aspect: rows per column
+    :return: (rows, columns)
+    >>> grid_shape(10), grid_shape(3), grid_shape(100)
+    ((5, 2), (3, 1), (17, 6))
+    """
+    ncols = max(1, int(round((max(panels, 1) / aspect) ** 0.5)))
+    return -(-max(panels, 1) // ncols), ncols
+
+
+def date_axis(ax):
+    """
+    Let matplotlib pick the date ticks of an axis for its range and label them concisely, instead of one tick per few
+    dates
+    :param ax: axes with dates on x
+    :return: None
+    """
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+
+    locator = AutoDateLocator(minticks=3, maxticks=8)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+
+
+def save_figure(fig: 'Figure', file_path: str):
+    """
+    Save the figure and release everything it holds
+    :param fig: figure from new_figure()
+    :param file_path: path of the image
+    :return: None
+    """
+    fig.savefig(file_path, bbox_inches="tight")
+    fig.clear()
+
+
+def plot_task(plot_name: str, **kwargs) -> tuple:
+    """
+    Pack a call of a plot function as a task of render_figures(), so plots can be pipeline stages
+    :param plot_name: name of the plot function
+    :param kwargs: arguments of the plot function
+    :return: (plot function name, dictionary of its arguments)
+    >>> plot_task('plot_google_trend_of_item', region='US')
+    ('plot_google_trend_of_item', {'region': 'US'})
+    """
+    if plot_name not in PLOT_FUNCTIONS:
+        raise ValueError("Unknown plot function")
+    return plot_name, kwargs
+
+
+def render_figure(task: tuple) -> str:
+    """
+    Render one figure with one of the plot functions of IS590PR_Final
+    :param task: (plot function name, dictionary of its arguments)
+    :return: the plot function name
+    """
+    plot_name, kwargs = task
+    if plot_name not in PLOT_FUNCTIONS:
+        raise ValueError("Unknown plot function")
+
+    import IS590PR_Final
+    getattr(IS590PR_Final, plot_name)(**kwargs)
+    return plot_name
+
+
+def render_figures(tasks: list, max_workers: int = None) -> list:
+    """
+    Render a batch of figures on a pool of processes
+    :param tasks: list of (plot function name, dictionary of its arguments)
+    :param max_workers: number of processes, default is the number of CPUs; 1 renders in this process
+    :return: list of the plot function names in the order of the tasks
+    >>> render_figures([('plt.show', {})], max_workers=1)
+    Traceback (most recent call last):
+    ValueError: Unknown plot function
+    """
+    if max_workers == 1 or len(tasks) <= 1:
+        return [render_figure(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(render_figure, tasks))
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Offline runs. Every data folder lives under a data root, the working directory unless set_data_root() moves it, and
+the two network sources can be recorded once and replayed: in record mode the JHU tables are downloaded into the
+fixtures folder and every Google Trend payload is saved next to them, in replay mode they are read back from there and
+nothing is fetched. The data root and the fixture mode are kept in environment variables, so worker processes of the
+batch runner and of the resampling see the same ones.
+
+    python fixtures.py seed        # record the JHU tables and the Google Trend payloads of main() from the checked-in
+                                   # tables, no network
+    python fixtures.py record      # run every doctest online once and record what it fetches
+    python fixtures.py replay      # run every doctest from the recordings in a temporary data root
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import contextlib
+import copy
+import os
+import shutil
+import tempfile
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import Constant
+from data_cache import query_key, read_frame, write_frame
+
+FIXTURE_MODES = ['record', 'replay']
+# data folders of a run, and the checked-in ones among them that the doctests read like a run of main() left them
+DATA_DIRS = [Constant.COVID_RAW_DATA_DIR, Constant.DATA_CACHE_DIR, Constant.GT_5_YR_DATA_DIR,
+             Constant.GT_RECENT_DATA_DIR, Constant.GT_FIGURE_DIR, Constant.MATRIX_STORE_DIR]
+CHECKED_IN_DATA_DIRS = [Constant.COVID_RAW_DATA_DIR, Constant.GT_5_YR_DATA_DIR, Constant.GT_RECENT_DATA_DIR]
+CHECKED_IN_COVID19_FILE = Constant.COVID_RAW_DATA_DIR + "/COVID19_till_2020-04-22" + Constant.DATA_POSTFIX_CSV
+
+
+def _set_env(name: str, value: str = None):
+    if value is None:
+        os.environ.pop(name, None)
+    else:
+        os.environ[name] = value
+
+
+def data_root() -> str:
+    """
+    Folder holding every data folder of a run
+    :return: the data root, the working directory unless one was set
+    >>> set_data_root('/tmp/study'); data_root()
+    '/tmp/study'
+    >>> set_data_root(None); data_root() == os.getcwd()
+    True
+    """
+    return os.environ.get(Constant.DATA_ROOT_ENV) or os.getcwd()
+
+
+def set_data_root(path: str = None):
+    """
+    Move the data root, also for the worker processes started afterwards
+    :param path: new data root, None for the working directory
+    :return: None
+    """
+    _set_env(Constant.DATA_ROOT_ENV, None if path is None else os.path.abspath(path))
+
+
+def data_path(sub_path: str) -> str:
+    """
+    Path of a data folder or file of Constant under the data root
+    :param sub_path: e.g. Constant.DATA_CACHE_DIR
+    :return: the absolute path
+    >>> set_data_root('/tmp/study'); data_path(Constant.DATA_CACHE_DIR)
+    '/tmp/study/DATA_CACHE'
+    >>> set_data_root(None)
+    """
+    return data_root() + sub_path
+
+
+def use_fixtures(mode: str = None, folder: str = None):
+    """
+    Record or replay the JHU tables and the Google Trend payloads from now on
+    :param mode: 'record', 'replay' or None to fetch from the network without recording
+    :param folder: fixtures folder, default is FIXTURES under the data root
+    :return: None
+    >>> use_fixtures('offline')
+    Traceback (most recent call last):
+    ValueError: Fixture mode is not well defined
+    """
+    if mode is not None and mode not in FIXTURE_MODES:
+        raise ValueError("Fixture mode is not well defined")
+    folder = data_path(Constant.FIXTURES_DIR) if folder is None else os.path.abspath(folder)
+    _set_env(Constant.FIXTURES_MODE_ENV, mode)
+    _set_env(Constant.FIXTURES_DIR_ENV, None if mode is None else folder)
+
+
+def fixture_mode() -> (str, str):
+    """
+    Current fixture mode and folder
+    :return: mode ('record', 'replay' or None) and folder of the fixtures
+    >>> use_fixtures('replay', '/tmp/fixtures'); fixture_mode()
+    ('replay', '/tmp/fixtures')
+    >>> use_fixtures(None); fixture_mode()
+    (None, None)
+    """
+    return os.environ.get(Constant.FIXTURES_MODE_ENV), os.environ.get(Constant.FIXTURES_DIR_ENV)
+
+
+def jhu_source(url: str) -> str:
+    """
+    Source to read a JHU table from: the URL itself without fixtures, its recording in replay mode, and in record mode
+    the recording made right now from the URL
+    :param url: URL or local path of the JHU table
+    :return: URL or local path to read
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> upstream = os.path.join(folder, 'time_series_covid19_confirmed_global.csv')
+    >>> pd.DataFrame({'Country/Region': ['US'], '1/22/20': [1]}).to_csv(upstream, index=False)
+    >>> use_fixtures('record', os.path.join(folder, 'fixtures'))
+    >>> recorded = jhu_source(upstream)
+    >>> use_fixtures('replay', os.path.join(folder, 'fixtures'))
+    >>> jhu_source(upstream) == recorded, pd.read_csv(recorded).shape
+    (True, (1, 2))
+    >>> jhu_source('https://example.com/time_series_covid19_confirmed_US.csv')
+    Traceback (most recent call last):
+    ValueError: No recorded JHU table time_series_covid19_confirmed_US.csv
+    >>> use_fixtures(None); jhu_source(upstream) == upstream
+    True
+    """
+    mode, folder = fixture_mode()
+    if mode is None:
+        return url
+
+    name = url.rstrip('/').split('/')[-1]
+    path = folder + Constant.FIXTURES_JHU_DIR + '/' + name
+    if mode == 'replay':
+        if not os.path.exists(path):
+            raise ValueError("No recorded JHU table " + name)
+        return path
+
+    os.makedirs(folder + Constant.FIXTURES_JHU_DIR, exist_ok=True)
+    if os.path.exists(url):
+        shutil.copyfile(url, path + '.part')
+    else:
+        with urllib.request.urlopen(url) as response, open(path + '.part', 'wb') as file:
+            shutil.copyfileobj(response, file)
+    os.replace(path + '.part', path)
+    return path
+
+
+def payload_path(folder: str, kw_list: list, geo: str, timeframe: str) -> str:
+    """
+    File of the recording of one Google Trend payload
+    :param folder: fixtures folder
+    :param kw_list: keywords of the payload, order matters
+    :param geo: region of the payload
+    :param timeframe: "start_date end_date"
+    :return: path of the .npz file
+    """
+    return folder + Constant.FIXTURES_GT_DIR + '/' + query_key(Constant.GT_SOURCE, kw_list, geo, timeframe) + \
+        Constant.CACHE_POSTFIX
+
+
+class ReplayTrendReq:
+    """
+    Stand-in for pytrends.request.TrendReq answering every payload from its recording, and failing on payloads that
+    were never recorded
+    >>> import tempfile
+    >>> from google_trend_fetcher import StubTrendReq
+    >>> folder = tempfile.mkdtemp()
+    >>> recorder = RecordingTrendReq(StubTrendReq(), folder)
+    >>> recorder.build_payload(kw_list=['mask', 'sanitizer'], timeframe='2020-01-01 2020-01-10', geo='US')
+    >>> recorded = recorder.interest_over_time()
+    >>> replay = ReplayTrendReq(folder)
+    >>> replay.build_payload(kw_list=['mask', 'sanitizer'], timeframe='2020-01-01 2020-01-10', geo='US')
+    >>> replay.interest_over_time().equals(recorded)
+    True
+    >>> replay.build_payload(kw_list=['mask'], timeframe='2020-01-01 2020-01-10', geo='TW')
+    >>> replay.interest_over_time()
+    Traceback (most recent call last):
+    ValueError: No recorded Google Trend of ['mask'] in TW for 2020-01-01 2020-01-10
+    """
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.kw_list = []
+        self.geo = ''
+        self.timeframe = ''
+
+    def build_payload(self, kw_list: list, cat=0, timeframe='today 5-y', geo='', gprop=''):
+        self.kw_list = list(kw_list)
+        self.timeframe = timeframe
+        self.geo = geo
+
+    def interest_over_time(self) -> pd.DataFrame:
+        path = payload_path(self.folder, self.kw_list, self.geo, self.timeframe)
+        if not os.path.exists(path):
+            raise ValueError("No recorded Google Trend of " + str(self.kw_list) + " in " + self.geo + " for " +
+                             self.timeframe)
+        return read_frame(path).set_index('date')
+
+
+class RecordingTrendReq(ReplayTrendReq):
+    """
+    Client fetching every payload with a private copy of a real client, such as TrendReq, and recording it for
+    ReplayTrendReq
+    """
+    def __init__(self, client, folder: str):
+        super().__init__(folder)
+        self.client = client
+
+    def interest_over_time(self) -> pd.DataFrame:
+        client = copy.copy(self.client)
+        client.build_payload(kw_list=self.kw_list, cat=0, timeframe=self.timeframe, geo=self.geo, gprop='')
+        df = client.interest_over_time()
+        os.makedirs(self.folder + Constant.FIXTURES_GT_DIR, exist_ok=True)
+        write_frame(payload_path(self.folder, self.kw_list, self.geo, self.timeframe),
+                    df.rename_axis('date').reset_index())
+        return df
+
+
+def project_dir() -> str:
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def seed_data_root(root: str):
+    """
+    Create every data folder in a data root and copy the checked-in Google Trend and COVID-19 tables of the project
+    into it
+    :param root: the data root
+    :return: None
+    >>> import tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> seed_data_root(root)
+    >>> sorted(os.listdir(root + Constant.GT_RECENT_DATA_DIR)), os.path.isdir(root + Constant.MATRIX_STORE_DIR)
+    (['GT_TW.csv', 'GT_US.csv'], True)
+    """
+    for sub_directory in DATA_DIRS:
+        os.makedirs(root + sub_directory, exist_ok=True)
+    for sub_directory in CHECKED_IN_DATA_DIRS:
+        source = project_dir() + sub_directory
+        for name in sorted(os.listdir(source)) if os.path.isdir(source) else []:
+            if name.endswith(Constant.DATA_POSTFIX_CSV) and not os.path.exists(root + sub_directory + '/' + name):
+                shutil.copyfile(source + '/' + name, root + sub_directory + '/' + name)
+
+
+def seed_fixtures(folder: str = None) -> str:
+    """
+    Record the JHU global table from the checked-in COVID19_till_2020-04-22.csv instead of the network. The checked-in
+    table lacks the province, latitude and longitude columns, so the provinces of a country with several rows are
+    named by the country and a number and the coordinates are left empty.
+    :param folder: fixtures folder, default is FIXTURES under the data root
+    :return: path of the recording
+    >>> import tempfile
+    >>> recorded = pd.read_csv(seed_fixtures(tempfile.mkdtemp()))
+    >>> list(recorded.columns[:4]), recorded.columns[-1]
+    (['Province/State', 'Country/Region', 'Lat', 'Long'], '4/22/20')
+    >>> first = recorded.drop_duplicates('Country/Region').set_index('Country/Region')['Province/State']
+    >>> first['China'], pd.isna(first['Taiwan*'])
+    ('China 1', True)
+    """
+    folder = data_path(Constant.FIXTURES_DIR) if folder is None else os.path.abspath(folder)
+    os.makedirs(folder + Constant.FIXTURES_JHU_DIR, exist_ok=True)
+    path = folder + Constant.FIXTURES_JHU_DIR + '/' + (Constant.DATA_URL + Constant.DATA_POSTFIX_CSV).split('/')[-1]
+
+    df = pd.read_csv(project_dir() + CHECKED_IN_COVID19_FILE)
+    countries = df[Constant.COUNTRY_REGION]
+    provinces = countries + ' ' + (countries.groupby(countries).cumcount() + 1).astype(str)
+    df.insert(0, Constant.PROVINCE_STATE, provinces.where(countries.duplicated(keep=False)))
+    df.insert(2, 'Lat', None)
+    df.insert(3, 'Long', None)
+    df.to_csv(path, header=True, index=False)
+    return path
+
+
+def seed_us_fixtures(folder: str = None) -> str:
+    """
+    Record a stand-in of the JHU US table from the US row of the checked-in COVID19_till_2020-04-22.csv, which has no
+    county or state rows: every state and DC is one county row with an equal share of the national count, the
+    remainder going to the first states, so the states add up to the US on every day.
+    :param folder: fixtures folder, default is FIXTURES under the data root
+    :return: path of the recording
+    >>> import tempfile
+    >>> recorded = pd.read_csv(seed_us_fixtures(tempfile.mkdtemp()))
+    >>> len(recorded), recorded.columns[-1], int(recorded['4/22/20'].sum())
+    (51, '4/22/20', 840351)
+    """
+    from regions import REGIONS, subregion_geos
+
+    folder = data_path(Constant.FIXTURES_DIR) if folder is None else os.path.abspath(folder)
+    os.makedirs(folder + Constant.FIXTURES_JHU_DIR, exist_ok=True)
+    path = folder + Constant.FIXTURES_JHU_DIR + '/' + (Constant.DATA_URL_US + Constant.DATA_POSTFIX_CSV).split('/')[-1]
+
+    df = pd.read_csv(project_dir() + CHECKED_IN_COVID19_FILE)
+    national = df[df[Constant.COUNTRY_REGION] == Constant.US].iloc[0, 1:].to_numpy(dtype=np.int64)
+    states = [REGIONS[geo].jhu_name for geo in subregion_geos(Constant.US)]
+    counts = national // len(states) + (np.arange(len(states))[:, np.newaxis] < national % len(states))
+
+    us_df = pd.DataFrame({col: None for col in Constant.JHU_US_NON_DATE_COLUMNS}, index=range(len(states)))
+    us_df[Constant.PROVINCE_STATE_US] = states
+    us_df['Country_Region'] = Constant.US
+    us_df['Combined_Key'] = [state + ', US' for state in states]
+    us_df = pd.concat([us_df, pd.DataFrame(counts, columns=df.columns[1:])], axis=1)
+    us_df.to_csv(path, header=True, index=False)
+    return path
+
+
+def seed_trend_fixtures(folder: str = None, timeframes: list = None) -> int:
+    """
+    Record the Google Trend payloads of the default study of main() without the network. A region with a checked-in
+    GT_5-YR_DATA or GT_RECENT_DATA table is answered from it, every other registered region by the synthetic series of
+    StubTrendReq. The keywords are packed into payloads as the scheduler packs them, and every checked-in keyword
+    peaks at 100, so replaying gives the checked-in tables back.
+    :param folder: fixtures folder, default is FIXTURES under the data root
+    :param timeframes: "start_date end_date" of the 5-year and of the short-term google trend
+    :return: number of payloads recorded
+    >>> import tempfile
+    >>> from regions import REGIONS
+    >>> folder = tempfile.mkdtemp()
+    >>> seed_trend_fixtures(folder) == 2 * 2 * len(REGIONS)
+    True
+    >>> replay = ReplayTrendReq(folder)
+    >>> replay.build_payload(kw_list=Constant.KEY_WORDS_LIST_EN[:5], timeframe='2020-01-01 2020-04-22', geo='US')
+    >>> checked_in = pd.read_csv(project_dir() + Constant.GT_RECENT_DATA_DIR + '/GT_US.csv')
+    >>> bool((replay.interest_over_time().to_numpy() == checked_in.iloc[:, 1:6].to_numpy()).all())
+    True
+    """
+    from google_trend_fetcher import StubTrendReq, split_keywords_into_batches
+    from regions import REGIONS
+
+    folder = data_path(Constant.FIXTURES_DIR) if folder is None else os.path.abspath(folder)
+    timeframes = Constant.FIXTURES_GT_TIMEFRAMES if timeframes is None else timeframes
+    os.makedirs(folder + Constant.FIXTURES_GT_DIR, exist_ok=True)
+    recorder = RecordingTrendReq(StubTrendReq(), folder)
+
+    payloads = 0
+    for geo, region in REGIONS.items():
+        for sub_directory, timeframe in zip([Constant.GT_5_YR_DATA_DIR, Constant.GT_RECENT_DATA_DIR], timeframes):
+            table_path = project_dir() + sub_directory + '/GT_' + geo + Constant.DATA_POSTFIX_CSV
+            table = None
+            if os.path.exists(table_path):
+                # the checked-in tables are named by the English keywords
+                table = pd.read_csv(table_path, parse_dates=['date'])
+                table = table.rename(columns={english: kw for kw, english in region.columns.items()})
+            for kw_list in split_keywords_into_batches(region.keywords):
+                if table is None:
+                    recorder.build_payload(kw_list=kw_list, timeframe=timeframe, geo=geo)
+                    recorder.interest_over_time()
+                else:
+                    write_frame(payload_path(folder, kw_list, geo, timeframe), table[['date'] + kw_list])
+                payloads += 1
+    return payloads
+
+
+@contextlib.contextmanager
+def offline_run(root: str, mode: str = 'replay', folder: str = None):
+    """
+    Move the data root and record or replay fixtures inside a with block, then restore the previous data root and
+    fixtures
+    :param root: data root of the block
+    :param mode: 'record' or 'replay'
+    :param folder: fixtures folder
+    :return: context manager
+    >>> previous = data_root(), fixture_mode()
+    >>> with offline_run('/tmp/study', folder='/tmp/fixtures'):
+    ...     data_root(), fixture_mode()
+    ('/tmp/study', ('replay', '/tmp/fixtures'))
+    >>> (data_root(), fixture_mode()) == previous
+    True
+    """
+    previous = {name: os.environ.get(name) for name in [Constant.DATA_ROOT_ENV, Constant.FIXTURES_MODE_ENV,
+                                                        Constant.FIXTURES_DIR_ENV]}
+    try:
+        set_data_root(root)
+        use_fixtures(mode, folder)
+        yield
+    finally:
+        for name, value in previous.items():
+            _set_env(name, value)
+
+
+def run_doctests(mode: str = 'replay', folder: str = None, modules: list = None) -> dict:
+    """
+    Run the doctests of the project modules in a new temporary data root seeded by seed_data_root(), recording or
+    replaying every fetch
+    :param mode: 'record' or 'replay'
+    :param folder: fixtures folder, default is FIXTURES under the current data root
+    :param modules: names of the modules, default is every module of the project
+    :return: module name -> (failed, attempted) of doctest.testmod()
+    """
+    import doctest
+    import importlib
+
+    folder = data_path(Constant.FIXTURES_DIR) if folder is None else os.path.abspath(folder)
+    if modules is None:
+        modules = [name[:-3] for name in sorted(os.listdir(project_dir())) if name.endswith('.py') and
+                   name != 'conftest.py']
+    root = tempfile.mkdtemp()
+    results = {}
+    try:
+        seed_data_root(root)
+        for name in modules:
+            # the doctests of a module may move the data root and switch fixtures, every module starts from the run's
+            with offline_run(root, mode, folder):
+                results[name] = tuple(doctest.testmod(importlib.import_module(name)))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv: list = None):
+    """
+    Seed the fixtures of the doctests, record them, or run the doctests offline from them
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Record or replay the JHU and Google Trend fixtures of the doctests")
+    parser.add_argument('mode', choices=['seed'] + FIXTURE_MODES)
+    parser.add_argument('modules', nargs='*', help="modules to test, default is every module")
+    parser.add_argument('--fixtures', default=data_path(Constant.FIXTURES_DIR), help="fixtures folder")
+    args = parser.parse_args(argv)
+    if args.mode == 'seed':
+        print("[Fixtures] recorded " + seed_fixtures(args.fixtures))
+        print("[Fixtures] recorded " + seed_us_fixtures(args.fixtures))
+        print("[Fixtures] recorded " + str(seed_trend_fixtures(args.fixtures)) + " Google Trend payload(s) in " +
+              os.path.abspath(args.fixtures) + Constant.FIXTURES_GT_DIR)
+        return
+
+    start_time = time.perf_counter()
+    results = run_doctests(args.mode, args.fixtures, args.modules or None)
+    for name, (failed, attempted) in results.items():
+        print("[Fixtures] " + name + ": " + str(attempted - failed) + " of " + str(attempted) + " passed")
+    print("[Fixtures] " + str(sum(failed for failed, _ in results.values())) + " failure(s) in %.2fs" %
+          (time.perf_counter() - start_time))
+
+
+if __name__ == '__main__':
+    main()
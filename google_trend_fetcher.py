@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Google Trend clients and the payloads of batched Google Trend queries, sent by the scheduler of trend_scheduler
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import copy
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import Constant
+from fixtures import RecordingTrendReq, ReplayTrendReq, fixture_mode
+
+
+class StubTrendReq:
+    """
+    Offline stand-in for pytrends.request.TrendReq. The search volume of a keyword only depends on (keyword, geo,
+    date), so overlapping queries are consistent with each other, and every payload is scaled to 0-100 by its own
+    maximum like Google Trend does. Copies made by copy.copy() share the same request log.
+    >>> stub = StubTrendReq()
+    >>> stub.build_payload(kw_list=['mask', 'sanitizer'], timeframe='2020-01-01 2020-01-10', geo='US')
+    >>> df = stub.interest_over_time()
+    >>> list(df.columns)
+    ['mask', 'sanitizer', 'isPartial']
+    >>> len(df), int(df[['mask', 'sanitizer']].max().max()), len(stub.request_log)
+    (10, 100, 1)
+    """
+    def __init__(self, hl='en-US', tz=360, latency: float = 0.0):
+        self.hl = hl
+        self.tz = tz
+        self.latency = latency
+        self.kw_list = []
+        self.geo = ''
+        self.timeframe = ''
+        self.request_log = []
+
+    def build_payload(self, kw_list: list, cat=0, timeframe='today 5-y', geo='', gprop=''):
+        self.kw_list = list(kw_list)
+        self.timeframe = timeframe
+        self.geo = geo
+
+    def interest_over_time(self) -> pd.DataFrame:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.request_log.append((tuple(self.kw_list), self.geo, self.timeframe))
+
+        start, end = [pd.Timestamp(d) for d in self.timeframe.split(' ')]
+        if (end - start).days < 270:
+            dates = pd.date_range(start, end, freq='D')
+        else:
+            dates = pd.date_range(start, end, freq='W-SUN')
+        volume = np.column_stack([synthetic_search_volume(kw, self.geo, dates) for kw in self.kw_list])
+        peak = volume.max()
+        values = np.rint(volume * 100 / peak).astype(int) if peak > 0 else np.zeros_like(volume, dtype=int)
+
+        df = pd.DataFrame(values, index=pd.DatetimeIndex(dates, name='date'), columns=self.kw_list)
+        df['isPartial'] = False
+        return df
+
+
+def synthetic_search_volume(keyword: str, geo: str, dates: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Deterministic absolute search volume of a keyword: a seasonal baseline, pseudo-random noise and a COVID-19 spike
+    in early 2020 whose size and timing depend on the keyword
+    :param keyword: search keyword
+    :param geo: region of the search
+    :param dates: dates to evaluate
+    :return: numpy array of non-negative volume, one value per date
+    >>> dates = pd.date_range("2020-01-01", periods=3)
+    >>> bool((synthetic_search_volume('mask', 'US', dates) == synthetic_search_volume('mask', 'US', dates)).all())
+    True
+    """
+    seed = zlib.crc32((geo + '|' + keyword).encode('utf-8'))
+    rng = np.random.default_rng(seed)
+    base, phase, spike_height, spike_offset = rng.uniform(5, 50), rng.uniform(0, 2 * np.pi), \
+        rng.uniform(0, 20), rng.integers(-30, 40)
+
+    day = (dates.values.astype('datetime64[D]').astype(np.int64)).astype(float)
+    seasonal = 1 + 0.3 * np.sin(2 * np.pi * day / 365.25 + phase)
+    noise = np.modf(np.abs(np.sin(day * 12.9898 + seed % 1000) * 43758.5453))[0]
+    spike_day = (np.datetime64('2020-03-10') - np.datetime64('1970-01-01')).astype(int) + spike_offset
+    spike = spike_height * np.exp(-((day - spike_day) / 12.0) ** 2)
+    return base * (seasonal + 0.2 * noise + spike)
+
+
+def default_trend_client():
+    """
+    Create the pytrends client used when no client is given. pytrends is only imported here, so nothing loads it
+    unless something has to be fetched. With fixtures in replay mode the client answers from the recorded payloads
+    without loading pytrends, in record mode it records every payload it fetches.
+    :return: a TrendReq client, or its recording or replaying stand-in
+    """
+    mode, folder = fixture_mode()
+    if mode == 'replay':
+        return ReplayTrendReq(folder)
+    from pytrends.request import TrendReq
+    client = TrendReq(hl='en-US', tz=360)
+    return RecordingTrendReq(client, folder) if mode == 'record' else client
+
+
+def split_keywords_into_batches(keywords: list, batch_size: int = Constant.GT_MAX_KEYWORDS_PER_PAYLOAD) -> list:
+    """
+    Split keywords into payloads of at most batch_size keywords. Google Trend scales a payload to 0-100 by its
+    largest keyword; the scheduler scales every keyword to 0-100 by its own max afterwards, so no keyword is shared
+    between payloads to put them on one scale.
+    :param keywords: a list of keywords, duplicates are sent once
+    :param batch_size: max number of keywords in one payload (Google Trend allows 5)
+    :return: a list of keyword lists
+    >>> split_keywords_into_batches(['a', 'b', 'c', 'd', 'e', 'a'], 2)
+    [['a', 'b'], ['c', 'd'], ['e']]
+    >>> split_keywords_into_batches(['a', 'b'], 0)
+    Traceback (most recent call last):
+    ValueError: Batch size must be at least 1
+    """
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1")
+
+    unique = list(dict.fromkeys(keywords))
+    return [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+
+
+def fetch_payload(pytrend, kw_list: list, region: str, timeframe: str) -> pd.DataFrame:
+    """
+    Send one payload to Google Trend with a private copy of the client, so payloads can be fetched by several threads
+    :param pytrend: TrendReq or any client with the same interface
+    :param kw_list: keywords of the payload
+    :param region: the region for search
+    :param timeframe: "start_date end_date"
+    :return: a data frame indexed by date with one column per keyword
+    """
+    client = copy.copy(pytrend)
+    client.build_payload(kw_list=kw_list, cat=0, timeframe=timeframe, geo=region, gprop='')
+    df = client.interest_over_time()
+    if df.empty:
+        return pd.DataFrame(columns=kw_list, dtype=int)
+    return df.drop(['isPartial'], axis=1, errors='ignore')
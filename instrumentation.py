@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage instrumentation: wall and CPU time, peak RSS growth, rows, HTTP requests and cache hits of every stage,
+written as JSON lines, and an optional cProfile dump of chosen stages
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import contextvars
+import cProfile
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+# counters of the stage running in the current thread, None outside of a stage
+_stage_counters = contextvars.ContextVar('stage_counters', default=None)
+
+COUNTERS = ['http_requests', 'cache_hits', 'cache_misses']
+
+
+def count(counter: str, n: int = 1):
+    """
+    Add to a counter of the stage running in this thread. Does nothing outside of a stage.
+    :param counter: one of COUNTERS
+    :param n: amount to add
+    :return: None
+    """
+    counters = _stage_counters.get()
+    if counters is not None:
+        counters[counter] = counters.get(counter, 0) + n
+
+
+def count_request(source):
+    """
+    Count one HTTP request when the source of a read is a URL
+    :param source: URL or local path
+    :return: None
+    """
+    if isinstance(source, str) and source.startswith(('http://', 'https://')):
+        count('http_requests')
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident set size of this process so far
+    :return: bytes, or None where the resource module does not exist
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def count_rows(output) -> int:
+    """
+    Number of rows of a stage's output: the length of a data frame, or the total of the data frames in a tuple or list
+    :param output: output of a stage
+    :return: number of rows, or None when the output has no data frame
+    >>> count_rows(pd.DataFrame({'a': [1, 2, 3]}))
+    3
+    >>> count_rows((pd.DataFrame({'a': [1]}), ['mask'])), count_rows({'mask': 1})
+    (1, None)
+    """
+    if isinstance(output, (pd.DataFrame, pd.Series)):
+        return len(output)
+    if isinstance(output, (tuple, list)):
+        rows = [len(item) for item in output if isinstance(item, (pd.DataFrame, pd.Series))]
+        return sum(rows) if rows != [] else None
+    return None
+
+
+class StageRecorder:
+    """
+    Run stages and record one JSON line per stage. Counters are kept per thread, so stages running concurrently on a
+    thread pool do not mix their counts; the CPU time is the time of the thread running the stage and the peak RSS
+    delta is how much the stage raised the peak of the whole process.
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> recorder = StageRecorder(os.path.join(folder, 'metrics.jsonl'), profile_stages=['double'], profile_dir=folder)
+    >>> def double(df):
+    ...     count('cache_hits')
+    ...     return pd.concat([df, df])
+    >>> len(recorder.run('double', double, {'df': pd.DataFrame({'a': [1, 2]})}))
+    4
+    >>> record = recorder.records[-1]
+    >>> record['stage'], record['status'], record['rows'], record['cache_hits'], record['http_requests']
+    ('double', 'ok', 4, 1, 0)
+    >>> sorted(os.listdir(folder))
+    ['double.prof', 'metrics.jsonl']
+    """
+    def __init__(self, log_path: str = None, profile_stages: list = None, profile_dir: str = None):
+        self.log_path = log_path
+        self.profile_stages = set(profile_stages or [])
+        self.profile_dir = profile_dir
+        self.records = []
+        self._lock = threading.Lock()
+        if self.profile_stages and profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def _write(self, record: dict):
+        with self._lock:
+            self.records.append(record)
+            if self.log_path is not None:
+                with open(self.log_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def _profile_path(self, name: str) -> str:
+        file_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name) + '.prof'
+        return os.path.join(self.profile_dir or os.getcwd(), file_name)
+
+    def run(self, name: str, func, kwargs: dict = None, source: str = 'computed'):
+        """
+        Run one stage and record its metrics, also when it raises
+        :param name: stage name
+        :param func: function of the stage
+        :param kwargs: keyword arguments of func
+        :param source: 'computed' for a stage that runs, 'loaded' for a stage read back from the pipeline store
+        :return: output of func
+        """
+        kwargs = kwargs or {}
+        token = _stage_counters.set({})
+        profiler = cProfile.Profile() if name in self.profile_stages else None
+        record = {'stage': name, 'source': source, 'start': datetime.datetime.now().isoformat(timespec='milliseconds')}
+        rss_before = peak_rss_bytes()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        output = None
+        try:
+            if profiler is not None:
+                output = profiler.runcall(func, **kwargs)
+            else:
+                output = func(**kwargs)
+            record['status'] = 'ok'
+            return output
+        except Exception as error:
+            record['status'] = 'error'
+            record['error'] = repr(error)
+            raise
+        finally:
+            counters = _stage_counters.get()
+            _stage_counters.reset(token)
+            rss_after = peak_rss_bytes()
+            record['wall_time'] = time.perf_counter() - wall_start
+            record['cpu_time'] = time.thread_time() - cpu_start
+            record['peak_rss_delta_bytes'] = rss_after - rss_before if rss_before is not None else None
+            record['rows'] = count_rows(output)
+            for counter in COUNTERS:
+                record[counter] = counters.get(counter, 0)
+            if profiler is not None:
+                record['profile'] = self._profile_path(name)
+                profiler.dump_stats(record['profile'])
+            self._write(record)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized screening of google trend keywords: every statistic is computed for all keywords at once on the
+(dates x keywords) matrix
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import numpy as np
+import pandas as pd
+
+import Constant
+
+
+def column_skew(values: np.ndarray) -> np.ndarray:
+    """
+    Bias-corrected sample skewness of every column, the same estimator as pandas.Series.skew()
+    :param values: 2-D array (dates x keywords), NaN is skipped
+    :return: skewness of every column
+    >>> values = np.array([[1., 0.], [2., 0.], [10., 0.], [1., 0.]])
+    >>> bool(np.isclose(column_skew(values)[0], pd.Series(values[:, 0]).skew())), float(column_skew(values)[1])
+    (True, 0.0)
+    """
+    nan_mask = np.isnan(values)
+    has_nan = nan_mask.any()
+    count = values.shape[0] - np.sum(nan_mask, axis=0).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (np.where(nan_mask, 0, values) if has_nan else values).sum(axis=0) / count
+        adjusted = values - mean
+        if has_nan:
+            adjusted[nan_mask] = 0
+        adjusted2 = adjusted * adjusted
+        m2 = adjusted2.sum(axis=0)
+        m3 = (adjusted2 * adjusted).sum(axis=0)
+        # drop floating point noise the same way pandas does
+        m2[np.abs(m2) < 1e-14] = 0
+        m3[np.abs(m3) < 1e-14] = 0
+        skew = (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2 ** 1.5)
+    skew[m2 == 0] = 0
+    skew[count < 3] = np.nan
+    return skew
+
+
+def masked_column_max(values: np.ndarray, row_mask: np.ndarray) -> np.ndarray:
+    """
+    Max of every column over the selected rows
+    :param values: 2-D array (dates x keywords)
+    :param row_mask: boolean array selecting the rows
+    :return: max of every column, NaN when no row is selected
+    >>> masked_column_max(np.array([[1., 5.], [3., 2.]]), np.array([True, False]))
+    array([1., 5.])
+    """
+    if not row_mask.any():
+        return np.full(values.shape[1], np.nan)
+    return np.nanmax(values[row_mask], axis=0)
+
+
+def screen_impacted(dates: np.ndarray, values: np.ndarray, cutoff: str = Constant.COVID19_CUTOFF_DATE,
+                    min_skew: float = Constant.IMPACTED_MIN_SKEW,
+                    max_past_trend: float = Constant.IMPACTED_MAX_PAST_TREND) -> np.ndarray:
+    """
+    Flag the keywords impacted by COVID-19: high skew over the whole range and low max before the cutoff date
+    :param dates: datetime64 array, one per row
+    :param values: 2-D array (dates x keywords)
+    :param cutoff: first day of COVID-19
+    :param min_skew: skew a keyword has to exceed
+    :param max_past_trend: max trend before the cutoff a keyword has to stay under
+    :return: boolean array, one per keyword
+    """
+    values = np.asarray(values, dtype=float)
+    past_max = masked_column_max(values, dates < np.datetime64(cutoff))
+    with np.errstate(invalid='ignore'):
+        return (column_skew(values) > min_skew) & (past_max < max_past_trend)
+
+
+def screen_representative(dates: np.ndarray, values: np.ndarray,
+                          window_days: int = Constant.REPRESENTATIVE_WINDOW_DAYS,
+                          max_past_trend: float = Constant.REPRESENTATIVE_MAX_PAST_TREND,
+                          min_current_trend: float = Constant.REPRESENTATIVE_MIN_CURRENT_TREND) \
+        -> (np.ndarray, np.ndarray):
+    """
+    Flag the keywords with a sharp increase: low max before the window ending at the peak and high max after the
+    window start. The past max comes from running maxima, so all keywords are screened without a loop.
+    :param dates: sorted datetime64 array, one per row
+    :param values: 2-D array (dates x keywords)
+    :param window_days: length of the sharp increase before the peak
+    :param max_past_trend: max trend before the window a keyword has to stay under
+    :param min_current_trend: max trend after the window start a keyword has to exceed
+    :return: boolean array and peak date of every keyword
+    >>> dates = pd.date_range('2020-01-01', periods=40).values
+    >>> values = np.zeros((40, 2))
+    >>> values[35, 0], values[35, 1], values[5, 1] = 100, 100, 80
+    >>> flags, peak_dates = screen_representative(dates, values)
+    >>> flags, str(peak_dates[0])[:10]
+    (array([ True, False]), '2020-02-05')
+    """
+    values = np.asarray(values, dtype=float)
+    columns = np.arange(values.shape[1])
+
+    filled = np.where(np.isnan(values), -np.inf, values) if np.isnan(values).any() else values
+    peak_rows = np.argmax(filled, axis=0)
+    peak_dates = dates[peak_rows]
+    date_bounds = peak_dates - np.timedelta64(window_days, 'D')
+
+    # the peak is after the window start, so the max after the window start is the peak itself
+    current_max = filled[peak_rows, columns]
+    current_max[np.isinf(current_max)] = np.nan
+
+    # the max before the window is the running max at the last row strictly before the window start
+    past_end = np.searchsorted(dates, date_bounds, side='left') - 1
+    prefix_max = np.fmax.accumulate(values, axis=0)
+    past_max = np.where(past_end >= 0, prefix_max[np.clip(past_end, 0, None), columns], np.nan)
+
+    with np.errstate(invalid='ignore'):
+        return (past_max < max_past_trend) & (current_max > min_current_trend), peak_dates
+
+
+def select_impacted_keywords(df: pd.DataFrame, **thresholds) -> list:
+    """
+    Vectorized select_item_impacted_by_covid19()
+    :param df: google trend data frame with 'date' and one column per keyword
+    :param thresholds: keyword arguments of screen_impacted()
+    :return: list of items impacted by COVID-19
+    >>> df = pd.DataFrame({'date': pd.date_range('2019-12-01', periods=60), 'mask': [1] * 59 + [100],
+    ...                    'milk': [50] * 60})
+    >>> select_impacted_keywords(df)
+    ['mask']
+    """
+    keywords = list(df.columns[1:])
+    flags = screen_impacted(df['date'].values.astype('datetime64[ns]'), df[keywords].to_numpy(dtype=float),
+                            **thresholds)
+    return [kw for kw, flag in zip(keywords, flags) if flag]
+
+
+def select_representative_keywords(df: pd.DataFrame, **thresholds) -> (list, dict):
+    """
+    Vectorized select_representative_kw() over every keyword column of the data frame
+    :param df: google trend data frame with 'date' and one column per keyword
+    :param thresholds: keyword arguments of screen_representative()
+    :return: representative keywords list and dictionary of items' trend max date
+    >>> df = pd.DataFrame({'date': pd.date_range('2020-01-01', periods=40), 'mask': [0] * 35 + [100] * 5})
+    >>> select_representative_keywords(df)
+    (['mask'], {'mask': Timestamp('2020-02-05 00:00:00')})
+    """
+    keywords = list(df.columns[1:])
+    df = df.sort_values('date', kind='stable')
+    flags, peak_dates = screen_representative(df['date'].values.astype('datetime64[ns]'),
+                                              df[keywords].to_numpy(dtype=float), **thresholds)
+    keywords_maxdate_pairs = {kw: pd.Timestamp(date) for kw, date in zip(keywords, peak_dates)}
+    return [kw for kw, flag in zip(keywords, flags) if flag], keywords_maxdate_pairs
+
+
+class IncrementalScreener:
+    """
+    Keep the screening of select_impacted_keywords() and select_representative_keywords() up to date while new rows
+    of google trend arrive. Running moments give the skew, running maxima are split at the cutoff date, and the peak
+    of every keyword is tracked, so one new row costs O(keywords). Rows must arrive in date order.
+    >>> screener = IncrementalScreener(['mask', 'milk'], cutoff='2020-01-01')
+    >>> for day in pd.date_range('2019-12-01', periods=40):
+    ...     changes = screener.update(day, [1, 50])
+    >>> changes = screener.update(pd.Timestamp('2020-01-10'), [100, 50])
+    >>> changes['impacted_added'], changes['representative_added']
+    (['mask'], ['mask'])
+    >>> screener.impacted_keywords(), screener.peak_dates()['mask']
+    (['mask'], Timestamp('2020-01-10 00:00:00'))
+    """
+    def __init__(self, keywords: list, cutoff: str = Constant.COVID19_CUTOFF_DATE,
+                 min_skew: float = Constant.IMPACTED_MIN_SKEW,
+                 max_past_trend: float = Constant.IMPACTED_MAX_PAST_TREND,
+                 window_days: int = Constant.REPRESENTATIVE_WINDOW_DAYS,
+                 max_window_past_trend: float = Constant.REPRESENTATIVE_MAX_PAST_TREND,
+                 min_current_trend: float = Constant.REPRESENTATIVE_MIN_CURRENT_TREND):
+        self.keywords = list(keywords)
+        self.cutoff = np.datetime64(cutoff, 'ns')
+        self.min_skew = min_skew
+        self.max_past_trend = max_past_trend
+        self.window = np.timedelta64(window_days, 'D')
+        self.max_window_past_trend = max_window_past_trend
+        self.min_current_trend = min_current_trend
+
+        num_of_kw = len(self.keywords)
+        # running moments: count, mean and sums of squared and cubed deviations
+        self._count = np.zeros(num_of_kw)
+        self._mean = np.zeros(num_of_kw)
+        self._m2 = np.zeros(num_of_kw)
+        self._m3 = np.zeros(num_of_kw)
+        self._pre_cutoff_max = np.full(num_of_kw, np.nan)
+        self._peak = np.full(num_of_kw, -np.inf)
+        self._peak_dates = np.full(num_of_kw, np.datetime64('NaT'), dtype='datetime64[ns]')
+        self._window_past_max = np.full(num_of_kw, np.nan)
+
+        # running max of every row, kept to look up the max before a new peak's window in O(log rows)
+        self._num_of_rows = 0
+        self._dates = np.empty(64, dtype='datetime64[ns]')
+        self._prefix_max = np.empty((64, num_of_kw))
+
+        self.impacted = np.zeros(num_of_kw, dtype=bool)
+        self.representative = np.zeros(num_of_kw, dtype=bool)
+
+    def _append_row(self, date: np.datetime64, values: np.ndarray):
+        if self._num_of_rows == len(self._dates):
+            self._dates = np.concatenate([self._dates, np.empty_like(self._dates)])
+            self._prefix_max = np.concatenate([self._prefix_max, np.empty_like(self._prefix_max)])
+        previous = self._prefix_max[self._num_of_rows - 1] if self._num_of_rows > 0 else values
+        self._dates[self._num_of_rows] = date
+        self._prefix_max[self._num_of_rows] = np.fmax(previous, values)
+        self._num_of_rows += 1
+
+    def _skew(self) -> np.ndarray:
+        count, m2, m3 = self._count, self._m2.copy(), self._m3.copy()
+        m2[np.abs(m2) < 1e-14] = 0
+        m3[np.abs(m3) < 1e-14] = 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            skew = (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2 ** 1.5)
+        skew[m2 == 0] = 0
+        skew[count < 3] = np.nan
+        return skew
+
+    def _changes(self, name: str, before: np.ndarray, after: np.ndarray) -> dict:
+        return {name + '_added': [kw for kw, flag in zip(self.keywords, after & ~before) if flag],
+                name + '_removed': [kw for kw, flag in zip(self.keywords, before & ~after) if flag]}
+
+    def update(self, date, values) -> dict:
+        """
+        Add one row of google trend and update the screening
+        :param date: date of the row, later than every row before
+        :param values: trend of every keyword, NaN for missing
+        :return: dictionary of keywords entering or leaving the impacted and representative sets
+        """
+        date = np.datetime64(pd.Timestamp(date), 'ns')
+        values = np.asarray(values, dtype=float)
+        if self._num_of_rows > 0 and date <= self._dates[self._num_of_rows - 1]:
+            raise ValueError("Rows must arrive in date order")
+        valid = ~np.isnan(values)
+
+        # one step of the running central moments
+        count = self._count + valid
+        delta = np.where(valid, values - self._mean, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta_n = np.where(valid, delta / count, 0)
+        term = delta * delta_n * self._count
+        self._m3 += term * delta_n * (count - 2) - 3 * delta_n * self._m2
+        self._m2 += term
+        self._mean += delta_n
+        self._count = count
+
+        if date < self.cutoff:
+            self._pre_cutoff_max = np.fmax(self._pre_cutoff_max, values)
+
+        self._append_row(date, values)
+        new_peak = valid & (values > self._peak)
+        if new_peak.any():
+            self._peak[new_peak] = values[new_peak]
+            self._peak_dates[new_peak] = date
+            dates = self._dates[:self._num_of_rows]
+            past_end = np.searchsorted(dates, self._peak_dates[new_peak] - self.window, side='left') - 1
+            columns = np.flatnonzero(new_peak)
+            self._window_past_max[new_peak] = np.where(
+                past_end >= 0, self._prefix_max[np.clip(past_end, 0, None), columns], np.nan)
+
+        with np.errstate(invalid='ignore'):
+            impacted = (self._skew() > self.min_skew) & (self._pre_cutoff_max < self.max_past_trend)
+            representative = (self._window_past_max < self.max_window_past_trend) & \
+                             (self._peak > self.min_current_trend)
+        changes = self._changes('impacted', self.impacted, impacted)
+        changes.update(self._changes('representative', self.representative, representative))
+        self.impacted, self.representative = impacted, representative
+        return changes
+
+    def update_frame(self, df: pd.DataFrame) -> list:
+        """
+        Add every row of a google trend data frame
+        :param df: google trend data frame with 'date' and the screener's keywords
+        :return: list of (date, changes) for the rows that changed a set
+        """
+        events = []
+        for date, values in zip(df['date'], df[self.keywords].to_numpy(dtype=float)):
+            changes = self.update(date, values)
+            if any(changes.values()):
+                events.append((date, changes))
+        return events
+
+    def impacted_keywords(self) -> list:
+        return [kw for kw, flag in zip(self.keywords, self.impacted) if flag]
+
+    def representative_keywords(self) -> list:
+        return [kw for kw, flag in zip(self.keywords, self.representative) if flag]
+
+    def peak_dates(self) -> dict:
+        return {kw: pd.Timestamp(date) for kw, date in zip(self.keywords, self._peak_dates)}
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Lagged cross-correlation between the search interest of every keyword and the new cases of every country, computed
+with FFTs over the whole keyword x country matrix at once. Daily trends are compared with daily new cases and weekly
+trends with weekly sums of new cases.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import numpy as np
+import pandas as pd
+
+import Constant
+from alignment import align_cases, covered_periods, series_frequency
+from regions import get_region
+
+
+def standardize(values: np.ndarray) -> np.ndarray:
+    """
+    Scale every series of the last axis to mean 0 and standard deviation 1. Constant series become all 0, so they
+    correlate with nothing.
+    :param values: array of series
+    :return: standardized array of float
+    >>> standardize(np.array([[1.0, 2.0, 3.0], [5.0, 5.0, 5.0]]))
+    array([[-1.22474487,  0.        ,  1.22474487],
+           [ 0.        ,  0.        ,  0.        ]])
+    """
+    values = np.asarray(values, dtype=float)
+    centered = values - values.mean(axis=-1, keepdims=True)
+    std = centered.std(axis=-1, keepdims=True)
+    return np.divide(centered, std, out=np.zeros_like(centered), where=std > 0)
+
+
+def cross_correlation(x: np.ndarray, y: np.ndarray, max_lag: int) -> (np.ndarray, np.ndarray):
+    """
+    Correlation of x[t] and y[t + lag] for every lag in [-max_lag, max_lag], by multiplying the spectra of the
+    zero-padded series instead of looping over lags. Series are standardized over their whole length and the sums
+    are divided by the length, so lag 0 is the Pearson correlation and longer lags shrink toward 0.
+    A positive lag means x leads y.
+    :param x: array of series, the last axis is time
+    :param y: array of series broadcastable with x
+    :param max_lag: largest lag in both directions
+    :return: the lags and the correlation of every series pair at every lag
+    >>> t = np.arange(60)
+    >>> x = np.sin(t / 5.0)
+    >>> lags, corr = cross_correlation(x, np.roll(x, 3), 5)
+    >>> int(lags[corr.argmax()])
+    3
+    >>> bool(np.isclose(corr[lags == 0][0], np.corrcoef(x, np.roll(x, 3))[0, 1]))
+    True
+    """
+    length = np.shape(x)[-1]
+    if max_lag >= length:
+        raise ValueError("Lag window is longer than the series")
+
+    # padding to 2 * length - 1 at least keeps the circular correlation from wrapping around
+    size = 1 << (2 * length - 2).bit_length()
+    spectrum = np.conj(np.fft.rfft(standardize(x), size)) * np.fft.rfft(standardize(y), size)
+    full = np.fft.irfft(spectrum, size)
+
+    lags = np.arange(-max_lag, max_lag + 1)
+    return lags, full[..., lags % size] / length
+
+
+def lag_table(case_table: pd.DataFrame, max_lag: int = Constant.LAG_MAX_DAYS,
+              chunk_size: int = Constant.LAG_CHUNK_PAIRS, **trend_dfs) -> pd.DataFrame:
+    """
+    Cross-correlate the google trend of every keyword of every region with the new cases of the region. The new cases
+    are summed over the period of every google trend date, so daily and weekly trends both compare like with like;
+    only the periods wholly inside the case data are used. The keyword x region series are stacked into one matrix
+    and correlated chunk_size pairs at a time.
+    :param case_table: long table indexed by (Country, Date)
+    :param max_lag: largest lag in days in both directions, rounded down to whole periods
+    :param chunk_size: number of keyword x region pairs transformed at once
+    :param trend_dfs: region=google trend data frame with 'date' and one column per keyword, all of one frequency
+    :return: tidy data frame with region, keyword, best lag in days, correlation at the best lag, correlation at lag 0
+    and number of days, sorted by region and correlation. A positive lag means the search interest leads the cases.
+    >>> from covid19_data import build_case_table
+    >>> dates = pd.date_range('2020-01-22', periods=40)
+    >>> cases = np.cumsum(np.exp(-0.5 * ((np.arange(40) - 25) / 4.0) ** 2) * 100).round()
+    >>> case_table = build_case_table(pd.DataFrame([['US'] + list(cases)], columns=['Country/Region'] +
+    ...                                            [str(d.month) + '/' + str(d.day) + '/20' for d in dates]))
+    >>> trend = np.exp(-0.5 * ((np.arange(40) - 18) / 4.0) ** 2) * 100
+    >>> gt_df = pd.DataFrame({'date': dates, 'mask': trend, 'milk': np.cos(np.arange(40))})
+    >>> table = lag_table(case_table, max_lag=10, US=gt_df)
+    >>> table.loc[0, 'region'], table.loc[0, 'keyword'], int(table.loc[0, 'best_lag'])
+    ('US', 'mask', 7)
+    >>> dates = pd.date_range('2020-01-22', periods=150)
+    >>> cases = np.cumsum(np.exp(-0.5 * ((np.arange(150) - 84) / 10.0) ** 2) * 100).round()
+    >>> case_table = build_case_table(pd.DataFrame([['US'] + list(cases)], columns=['Country/Region'] +
+    ...                                            [str(d.month) + '/' + str(d.day) + '/20' for d in dates]))
+    >>> weekly_df = pd.DataFrame({'date': dates[::7], 'mask': np.exp(-0.5 * ((np.arange(0, 150, 7) - 70) / 10.0) ** 2)})
+    >>> table = lag_table(case_table, max_lag=28, US=weekly_df)
+    >>> int(table.loc[0, 'best_lag']), int(table.loc[0, 'days'])
+    (14, 140)
+    """
+    regions = list(trend_dfs)
+    frames = {region: trend_dfs[region].set_index('date') for region in regions}
+    keywords = list(dict.fromkeys(kw for df in frames.values() for kw in df.columns))
+    steps = {series_frequency(df.index) for df in frames.values()}
+    if len(steps) > 1:
+        raise ValueError("Google trend frames have different frequencies")
+    step = steps.pop() if steps else 1
+
+    # dates every series has, whose period lies inside the case data
+    dates = None
+    for df in frames.values():
+        dates = pd.DatetimeIndex(df.index) if dates is None else dates.intersection(pd.DatetimeIndex(df.index))
+    dates = pd.DatetimeIndex([] if dates is None else dates)
+    dates = dates[covered_periods(dates, case_table.index.levels[1].sort_values()[1:])]
+
+    # region x keyword matrix of search interest, the pairs a region does not search are left out
+    case_names = [get_region(region).case_name for region in regions]
+    cases = align_cases(dates, case_table, case_names, how='sum').to_numpy().T
+    max_lag //= step
+    trends = np.stack([frames[region].reindex(index=dates, columns=keywords).to_numpy(dtype=float).T
+                       for region in regions])
+    region_index, keyword_index = np.nonzero(~np.isnan(trends).any(axis=2))
+
+    best_lags, best_corrs, zero_corrs = [], [], []
+    for start in range(0, len(region_index), chunk_size):
+        rows = region_index[start:start + chunk_size]
+        lags, corr = cross_correlation(trends[rows, keyword_index[start:start + chunk_size]], cases[rows], max_lag)
+        best = corr.argmax(axis=1)
+        best_lags.append(lags[best] * step)
+        best_corrs.append(corr[np.arange(len(rows)), best])
+        zero_corrs.append(corr[:, max_lag])
+
+    table = pd.DataFrame({'region': np.array(regions, dtype=object)[region_index],
+                          'keyword': np.array(keywords, dtype=object)[keyword_index],
+                          'best_lag': np.concatenate(best_lags) if best_lags != [] else [],
+                          'correlation': np.concatenate(best_corrs) if best_corrs != [] else [],
+                          'lag0_correlation': np.concatenate(zero_corrs) if zero_corrs != [] else [],
+                          'days': len(dates) * step})
+    return table.sort_values(['region', 'correlation'], ascending=[True, False], kind='stable').reset_index(drop=True)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Compact memory-mapped store of Google Trend and COVID-19 case matrices. Trend values are kept as uint8 and case
+counts as int32 in .npy files with one row per keyword or country and one column per day of an integer day index;
+a small JSON file next to each matrix holds the row labels, the first day and the step in days. Matrices are opened
+with memory mapping, so reading a few rows never loads the whole matrix.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import Constant
+
+MATRIX_DTYPES = {'trend': np.uint8, 'cases': np.int32}
+MISSING_VALUES = {'trend': Constant.TREND_MISSING, 'cases': Constant.CASES_MISSING}
+
+
+class StoredMatrix:
+    """
+    A matrix of the store: values[row, day] with day i being start + i * step days
+    """
+    def __init__(self, values: np.ndarray, kind: str, rows: list, start: np.datetime64, step: int):
+        self.values = values
+        self.kind = kind
+        self.rows = list(rows)
+        self.start = np.datetime64(start, 'D')
+        self.step = step
+        self._row_index = {row: i for i, row in enumerate(self.rows)}
+
+    @property
+    def dates(self) -> np.ndarray:
+        """
+        Date of every column, from the integer day index
+        """
+        return self.start + np.arange(self.values.shape[1]) * np.timedelta64(self.step, 'D')
+
+    def row_indices(self, labels: list) -> np.ndarray:
+        if any(label not in self._row_index for label in labels):
+            raise ValueError("No such row")
+        return np.array([self._row_index[label] for label in labels], dtype=np.intp)
+
+    def to_frame(self, labels: list = None) -> pd.DataFrame:
+        """
+        Rows of the matrix as a data frame with 'date' and one column per row label, like the frames of
+        create_google_trend_df()
+        :param labels: rows to read, default is every row
+        :return: data frame
+        """
+        labels = self.rows if labels is None else labels
+        values = self.values[self.row_indices(labels)].T
+        df = pd.DataFrame(values, columns=labels)
+        df.insert(0, 'date', pd.DatetimeIndex(self.dates))
+        return df
+
+
+class MatrixStore:
+    """
+    Folder of memory-mapped matrices
+    >>> import tempfile
+    >>> store = MatrixStore(tempfile.mkdtemp())
+    >>> gt_df = pd.DataFrame({'date': pd.date_range('2020-01-01', periods=3), 'mask': [1, 50, 100],
+    ...                       'milk': [2, 3, None]})
+    >>> matrix = store.write_trend('GT_US', gt_df)
+    >>> matrix = store.open('GT_US')
+    >>> matrix.values.dtype, type(matrix.values).__name__, matrix.rows, matrix.values[1].tolist()
+    (dtype('uint8'), 'memmap', ['mask', 'milk'], [2, 3, 255])
+    >>> frame = matrix.to_frame(['mask'])
+    >>> frame['mask'].tolist(), str(frame['date'].iloc[-1].date())
+    ([1, 50, 100], '2020-01-03')
+    """
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _paths(self, name: str) -> (str, str):
+        path = os.path.join(self.folder, name)
+        return path + Constant.MATRIX_POSTFIX, path + Constant.MATRIX_META_POSTFIX
+
+    def create(self, name: str, kind: str, rows: list, start, days: int, step: int = 1) -> StoredMatrix:
+        """
+        Create an empty matrix on disk, filled with the missing value, so a matrix larger than the memory can be
+        written in pieces through its values
+        :param name: matrix name
+        :param kind: 'trend' or 'cases'
+        :param rows: label of every row
+        :param start: date of the first column
+        :param days: number of columns
+        :param step: days between two columns, 7 for weekly google trend
+        :return: the writable matrix
+        """
+        if kind not in MATRIX_DTYPES:
+            raise ValueError("Unknown matrix kind")
+        values_path, meta_path = self._paths(name)
+        values = np.lib.format.open_memmap(values_path, mode='w+', dtype=MATRIX_DTYPES[kind], shape=(len(rows), days))
+        values[:] = MISSING_VALUES[kind]
+        start = np.datetime64(start, 'D')
+        with open(meta_path, 'w', encoding='utf-8') as file:
+            json.dump({'kind': kind, 'rows': list(rows), 'start': str(start), 'step': step}, file, ensure_ascii=False)
+        return StoredMatrix(values, kind, rows, start, step)
+
+    def open(self, name: str, mode: str = 'r') -> StoredMatrix:
+        """
+        Open a matrix with memory mapping; nothing is read until it is used
+        :param name: matrix name
+        :param mode: 'r' to read, 'r+' to update in place
+        :return: the matrix
+        """
+        values_path, meta_path = self._paths(name)
+        with open(meta_path, encoding='utf-8') as file:
+            meta = json.load(file)
+        values = np.load(values_path, mmap_mode=mode)
+        return StoredMatrix(values, meta['kind'], meta['rows'], np.datetime64(meta['start'], 'D'), meta['step'])
+
+    def write_trend(self, name: str, df: pd.DataFrame) -> StoredMatrix:
+        """
+        Store a google trend data frame with 'date' and one column per keyword
+        :param name: matrix name
+        :param df: data frame with evenly spaced dates and values from 0 to 100
+        :return: the matrix
+        """
+        dates = pd.DatetimeIndex(df['date']).values.astype('datetime64[D]')
+        step = int((dates[1] - dates[0]).astype(int)) if len(dates) > 1 else 1
+        if len(dates) > 1 and (np.diff(dates).astype(int) != step).any():
+            raise ValueError("Dates are not evenly spaced")
+
+        keywords = list(df.columns[1:])
+        matrix = self.create(name, 'trend', keywords, dates[0], len(dates), step)
+        values = df[keywords].to_numpy(dtype=float).T
+        missing = np.isnan(values)
+        matrix.values[:] = np.where(missing, Constant.TREND_MISSING, np.clip(np.rint(values), 0, 100))
+        matrix.values.flush()
+        return matrix
+
+    def write_cases(self, name: str, case_table: pd.DataFrame) -> StoredMatrix:
+        """
+        Store the table from build_case_table() as a country x day matrix
+        :param name: matrix name
+        :param case_table: long table indexed by (Country, Date)
+        :return: the matrix
+        """
+        wide = case_table['Confirmed'].unstack(level=1).sort_index(axis=1)
+        dates = wide.columns.values.astype('datetime64[D]')
+        matrix = self.create(name, 'cases', list(wide.index), dates[0], len(dates))
+        matrix.values[:, (dates - dates[0]).astype(int)] = wide.fillna(Constant.CASES_MISSING).to_numpy(np.int32)
+        matrix.values.flush()
+        return matrix
+
+
+def store_analysis_matrices(folder: str, case_table: pd.DataFrame, **trend_dfs) -> list:
+    """
+    Write the case matrix and every google trend frame of the pipeline into the store
+    :param folder: folder of the store
+    :param case_table: long table indexed by (Country, Date)
+    :param trend_dfs: matrix name=google trend data frame
+    :return: names of the stored matrices
+    """
+    store = MatrixStore(folder)
+    store.write_cases(Constant.CASES_MATRIX, case_table)
+    for name, df in trend_dfs.items():
+        store.write_trend(name, df)
+    return [Constant.CASES_MATRIX] + list(trend_dfs)
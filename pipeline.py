@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Memoized stage DAG: every stage is a function with declared inputs and parameters, its output is persisted under a
+fingerprint of its code, its parameters and its inputs' fingerprints, and only stages whose fingerprint changed are run
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import dis
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import site
+import sysconfig
+import threading
+import types
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import Constant
+from instrumentation import StageRecorder
+
+
+# code of the standard library and of installed packages is left out of the fingerprints
+LIBRARY_DIRS = tuple({os.path.abspath(sysconfig.get_paths()[name]) for name in ['stdlib', 'platstdlib', 'purelib',
+                                                                                'platlib']} |
+                     ({os.path.abspath(site.USER_SITE)} if site.USER_SITE else set()))
+
+
+def _is_project_code(code: types.CodeType) -> bool:
+    return not os.path.abspath(code.co_filename).startswith(LIBRARY_DIRS)
+
+
+def _project_module_source(name: str) -> str:
+    """
+    Source file of a module of the project, found without importing it
+    :param name: module name
+    :return: path of the .py file, None for the standard library, installed packages or an unknown module
+    """
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or spec.origin is None or not spec.origin.endswith('.py'):
+        return None
+    return None if os.path.abspath(spec.origin).startswith(LIBRARY_DIRS) else spec.origin
+
+
+def _functions(value) -> list:
+    """
+    Functions of the project behind a global name: the function itself, or every method of a class
+    """
+    if isinstance(value, type):
+        members = [getattr(member, '__func__', member) for member in vars(value).values()]
+        return [member for member in members if isinstance(member, types.FunctionType)]
+    if isinstance(value, types.FunctionType):
+        return [value]
+    return []
+
+
+def code_hash(*funcs) -> str:
+    """
+    Hash of the bytecode, names and constants of functions, of the functions defined inside them and of the project
+    functions and classes they refer to by a global name, directly or as an attribute of a project module, all the way
+    down. A project module imported inside a function is hashed by its source file, so the fingerprint is the same
+    whether or not the module was imported yet. Editing a stage function or anything of the project it calls changes
+    its fingerprint; the standard library and installed packages are not followed.
+    :param funcs: function of a stage, and optionally more functions it depends on
+    :return: hex digest, empty for callables without code such as builtins
+    >>> def add_one(x): return x + 1
+    >>> def add_two(x): return x + 2
+    >>> code_hash(add_one) == code_hash(add_two), code_hash(add_one) == code_hash(add_one)
+    (False, True)
+    >>> def calls_add(x): return add_one(x)
+    >>> before = code_hash(calls_add)
+    >>> def add_one(x): return x + 10
+    >>> code_hash(calls_add) == before
+    False
+    >>> code_hash(len)
+    ''
+    >>> def imports_inside(): from regions import get_region; return get_region('TW')
+    >>> before = code_hash(imports_inside)
+    >>> import importlib
+    >>> module = importlib.import_module('regions')
+    >>> code_hash(imports_inside) == before
+    True
+    """
+    digest = hashlib.sha256()
+    seen, sources = set(), set()
+    pending = [(func.__code__, func.__globals__) for func in reversed(funcs) if hasattr(func, '__code__')]
+    while pending:
+        code, namespace = pending.pop()
+        if code in seen:
+            continue
+        seen.add(code)
+        digest.update(code.co_code)
+        digest.update(repr(code.co_names).encode('utf-8'))
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                pending.append((const, namespace))
+            elif isinstance(const, frozenset):
+                # the order of a set depends on the hash seed of the process
+                digest.update(repr(sorted(const, key=repr)).encode('utf-8'))
+            else:
+                digest.update(repr(const).encode('utf-8'))
+
+        # modules imported inside a function are not globals of its module and may not be imported yet
+        for instruction in dis.get_instructions(code):
+            if instruction.opname == 'IMPORT_NAME':
+                source = _project_module_source(instruction.argval)
+                if source is not None and source not in sources:
+                    sources.add(source)
+                    with open(source, 'rb') as file:
+                        digest.update(file.read())
+
+        callees = []
+        for name in code.co_names:
+            value = namespace.get(name)
+            if isinstance(value, types.ModuleType):
+                file_name = getattr(value, '__file__', None)
+                if file_name is not None and not os.path.abspath(file_name).startswith(LIBRARY_DIRS):
+                    callees += [callee for attr in code.co_names for callee in _functions(getattr(value, attr, None))]
+            else:
+                callees += _functions(value)
+        pending += [(callee.__code__, callee.__globals__) for callee in callees if _is_project_code(callee.__code__)]
+    return digest.hexdigest() if seen else ''
+
+
+class Stage:
+    """
+    One step of the pipeline
+    - inputs: argument name of func -> upstream stage name, or (stage name, key) to pass output[key]
+    - params: keyword arguments of func that are part of the fingerprint
+    - resources: keyword arguments of func that are not, such as caches or clients
+    - code: more functions whose code is part of the fingerprint, such as the plot function a plot task is drawn with
+    """
+    def __init__(self, name: str, func, inputs: dict = None, params: dict = None, resources: dict = None,
+                 code: list = None):
+        self.name = name
+        self.func = func
+        self.code = code or []
+        self.inputs = {arg: (spec, None) if isinstance(spec, str) else tuple(spec)
+                       for arg, spec in (inputs or {}).items()}
+        self.params = params or {}
+        self.resources = resources or {}
+
+
+class Pipeline:
+    """
+    Run stages in dependency order. A stage whose fingerprint has a persisted output is loaded instead of run, and
+    then its inputs are not needed at all. Stages whose inputs are ready run concurrently on a thread pool, so
+    independent per-country branches overlap. With a StageRecorder, every computed or loaded stage is recorded.
+    Saving a stage removes the outputs of its older fingerprints, unless prune_stale is False because other
+    pipelines with other parameters share the store.
+    >>> import tempfile
+    >>> def load(n): return list(range(n))
+    >>> def total(values, scale=1): return sum(values) * scale
+    >>> pipeline = Pipeline(tempfile.mkdtemp())
+    >>> pipeline.add_stage('load', load, params={'n': 4})
+    >>> pipeline.add_stage('total', total, inputs={'values': 'load'}, params={'scale': 2})
+    >>> pipeline.run(['total'])
+    {'total': 12}
+    >>> pipeline.computed
+    ['load', 'total']
+    >>> pipeline.add_stage('total', total, inputs={'values': 'load'}, params={'scale': 3})
+    >>> pipeline.run(['total']), pipeline.computed
+    ({'total': 18}, ['total'])
+    >>> def total(values, scale=1): return sum(values) * scale + 1
+    >>> pipeline.add_stage('total', total, inputs={'values': 'load'}, params={'scale': 3})
+    >>> pipeline.run(['total']), pipeline.computed
+    ({'total': 19}, ['total'])
+    >>> def square(value): return value ** 2
+    >>> def sum_of_squares(values): return sum(square(value) for value in values)
+    >>> pipeline.add_stage('squares', sum_of_squares, inputs={'values': 'load'})
+    >>> pipeline.run(['squares']), pipeline.computed
+    ({'squares': 14}, ['squares'])
+    >>> def square(value): return value ** 3
+    >>> pipeline.run(['squares']), pipeline.computed
+    ({'squares': 36}, ['squares'])
+    """
+    def __init__(self, store_dir: str, max_workers: int = Constant.PIPELINE_MAX_WORKERS,
+                 recorder: StageRecorder = None, prune_stale: bool = True):
+        self.store_dir = store_dir
+        self.max_workers = max_workers
+        self.recorder = recorder
+        self.prune_stale = prune_stale
+        self.stages = {}
+        self.computed = []
+        self.loaded = []
+        os.makedirs(store_dir, exist_ok=True)
+
+    def add_stage(self, name: str, func, inputs: dict = None, params: dict = None, resources: dict = None,
+                  code: list = None):
+        """
+        Add a stage, replacing any stage of the same name
+        :param name: unique stage name
+        :param func: function run by the stage
+        :param inputs: argument name -> upstream stage name, or (stage name, key)
+        :param params: fingerprinted keyword arguments
+        :param resources: keyword arguments left out of the fingerprint
+        :param code: more functions whose code is fingerprinted, e.g. functions func only reaches by name
+        :return: None
+        """
+        self.stages[name] = Stage(name, func, inputs, params, resources, code)
+
+    def fingerprint(self, name: str, memo: dict = None) -> str:
+        """
+        Hash of the stage's function and its code, parameters and the fingerprints of its inputs
+        :param name: stage name
+        :param memo: fingerprints already computed
+        :return: hex digest
+        """
+        memo = {} if memo is None else memo
+        if name not in memo:
+            stage = self.stages[name]
+            upstream = {arg: [self.fingerprint(input_name, memo), key]
+                        for arg, (input_name, key) in stage.inputs.items()}
+            content = json.dumps([name, stage.func.__module__, stage.func.__qualname__,
+                                  code_hash(stage.func, *stage.code), stage.params, upstream],
+                                 sort_keys=True, default=str, ensure_ascii=False)
+            memo[name] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return memo[name]
+
+    def output_paths(self) -> dict:
+        """
+        Files the outputs of the stages are saved in under their current fingerprints
+        :return: stage name -> path
+        """
+        memo = {}
+        return {name: self._output_path(name, self.fingerprint(name, memo)) for name in self.stages}
+
+    def _output_prefix(self, name: str) -> str:
+        return os.path.join(self.store_dir, ''.join(c if c.isalnum() or c in '-_' else '_' for c in name) + '-')
+
+    def _output_path(self, name: str, fingerprint: str) -> str:
+        return self._output_prefix(name) + fingerprint[:32] + Constant.PIPELINE_POSTFIX
+
+    def _save(self, name: str, fingerprint: str, output):
+        path = self._output_path(name, fingerprint)
+        # a private temporary file, so processes saving the same stage do not write into each other's file
+        tmp_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(output, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if self.prune_stale is False:
+            return
+
+        # outputs of older fingerprints of the stage are stale now
+        folder, prefix = os.path.split(self._output_prefix(name))
+        for file_name in os.listdir(folder):
+            stale = os.path.join(folder, file_name)
+            if file_name.startswith(prefix) and stale != path and len(file_name) == len(os.path.basename(path)):
+                os.remove(stale)
+
+    def _load(self, name: str, fingerprint: str):
+        with open(self._output_path(name, fingerprint), 'rb') as file:
+            return pickle.load(file)
+
+    def _run_stage(self, stage: Stage, outputs: dict):
+        kwargs = {arg: outputs[input_name] if key is None else outputs[input_name][key]
+                  for arg, (input_name, key) in stage.inputs.items()}
+        kwargs.update(stage.params)
+        kwargs.update(stage.resources)
+        if self.recorder is not None:
+            return self.recorder.run(stage.name, stage.func, kwargs)
+        return stage.func(**kwargs)
+
+    def run(self, targets: list) -> dict:
+        """
+        Bring the target stages up to date
+        :param targets: names of the stages to return
+        :return: dictionary of each target's output
+        """
+        fingerprints = {}
+        to_load, to_run = [], []
+
+        def plan(name: str):
+            if name in to_load or name in to_run:
+                return
+            if os.path.exists(self._output_path(name, self.fingerprint(name, fingerprints))):
+                to_load.append(name)
+                return
+            for input_name, _ in self.stages[name].inputs.values():
+                plan(input_name)
+            to_run.append(name)
+
+        for target in targets:
+            plan(target)
+
+        outputs = {}
+        for name in to_load:
+            if self.recorder is not None:
+                outputs[name] = self.recorder.run(name, self._load, {'name': name, 'fingerprint': fingerprints[name]},
+                                                  source='loaded')
+            else:
+                outputs[name] = self._load(name, fingerprints[name])
+        self.loaded, self.computed = to_load, []
+        pending = list(to_run)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while pending or running:
+                for name in list(pending):
+                    if all(input_name in outputs for input_name, _ in self.stages[name].inputs.values()):
+                        pending.remove(name)
+                        running[executor.submit(self._run_stage, self.stages[name], outputs)] = name
+                if running == {}:
+                    raise ValueError("Stage inputs form a cycle")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs[name] = future.result()
+                    self._save(name, fingerprints[name], outputs[name])
+                    self.computed.append(name)
+
+        return {target: outputs[target] for target in targets}
+
+
+def prune_store(pipelines: list) -> int:
+    """
+    Remove the stale outputs of pipelines sharing one store with prune_stale False: every saved output of a stage of
+    theirs except the outputs of the fingerprints one of them has now. Outputs of other stages are left alone.
+    :param pipelines: pipelines on the same store
+    :return: number of files removed
+    >>> import tempfile
+    >>> def load(n): return list(range(n))
+    >>> store_dir = tempfile.mkdtemp()
+    >>> pipelines = [Pipeline(store_dir, prune_stale=False) for _ in range(2)]
+    >>> for n, pipeline in enumerate(pipelines):
+    ...     pipeline.add_stage('load', load, params={'n': n})
+    ...     _ = pipeline.run(['load'])
+    >>> pipelines[1].add_stage('load', load, params={'n': 5})
+    >>> _ = pipelines[1].run(['load'])
+    >>> len(os.listdir(store_dir)), prune_store(pipelines), len(os.listdir(store_dir))
+    (3, 1, 2)
+    """
+    keep = set()
+    prefixes = {}
+    for pipeline in pipelines:
+        for name, path in pipeline.output_paths().items():
+            keep.add(path)
+            folder, prefix = os.path.split(pipeline._output_prefix(name))
+            prefixes.setdefault(folder, set()).add(prefix)
+
+    removed = 0
+    for folder, folder_prefixes in prefixes.items():
+        for file_name in os.listdir(folder):
+            path = os.path.join(folder, file_name)
+            if not file_name.endswith(Constant.PIPELINE_POSTFIX) or path in keep:
+                continue
+            # the file name is the stage prefix, 32 characters of the fingerprint and the postfix
+            if file_name[:-32 - len(Constant.PIPELINE_POSTFIX)] in folder_prefixes:
+                os.remove(path)
+                removed += 1
+    return removed
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the regions the analysis runs on: Google Trend geo code, JHU country name, local-language keywords and
+the English column of every keyword. Subregions such as the US states ('US-CA') are regions with a parent country;
+their cases come from the JHU US file and their Google Trend from the subregion geo.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import Constant
+
+
+class Region:
+    """
+    One region of the analysis
+    - geo: Google Trend geo code, also the name of the region in the pipeline and the figures
+    - jhu_name: Country/Region of the region in the JHU table
+    - keywords: keywords searched on Google Trend, in the local language
+    - columns: local keyword -> English column name
+    - parent: geo code of the country of a subregion, None for a country
+    """
+    def __init__(self, geo: str, jhu_name: str, keywords: list, english_keywords: list = None, parent: str = None):
+        english_keywords = keywords if english_keywords is None else english_keywords
+        if len(english_keywords) != len(keywords):
+            raise ValueError("Every keyword needs an English column")
+        self.geo = geo
+        self.jhu_name = jhu_name
+        self.keywords = list(keywords)
+        self.columns = dict(zip(keywords, english_keywords))
+        self.parent = parent
+
+    @property
+    def case_name(self) -> str:
+        """
+        Name of the region in the case table of build_case_table(), where Taiwan* is renamed. Subregions are named by
+        their geo code, so a state never meets a country of the same name such as Georgia.
+        """
+        if self.parent is not None:
+            return self.geo
+        return Constant.TAIWAN_NAME if self.jhu_name == Constant.TAIWAN else self.jhu_name
+
+
+REGIONS = {}
+
+
+def register_region(geo: str, jhu_name: str, keywords: list, english_keywords: list = None,
+                    parent: str = None) -> Region:
+    """
+    Add a region to the registry, replacing any region of the same geo code
+    :param geo: Google Trend geo code
+    :param jhu_name: Country/Region of the region in the JHU table, Province_State of a US state
+    :param keywords: keywords in the local language
+    :param english_keywords: English column of every keyword, default is the keywords themselves
+    :param parent: geo code of the country of a subregion
+    :return: the region
+    >>> register_region('NZ', 'New Zealand', Constant.KEY_WORDS_LIST_EN).case_name
+    'New Zealand'
+    >>> del REGIONS['NZ']
+    """
+    REGIONS[geo] = Region(geo, jhu_name, keywords, english_keywords, parent)
+    return REGIONS[geo]
+
+
+def country_geos() -> list:
+    """
+    Geo codes of the registered countries, the default regions of a run
+    :return: list of geo codes
+    >>> country_geos()
+    ['TW', 'US', 'GB', 'CA', 'AU']
+    """
+    return [geo for geo, region in REGIONS.items() if region.parent is None]
+
+
+def subregion_geos(parent: str) -> list:
+    """
+    Geo codes of the registered subregions of a country
+    :param parent: geo code of the country
+    :return: list of geo codes
+    >>> len(subregion_geos('US')), subregion_geos('US')[:2]
+    (51, ['US-AL', 'US-AK'])
+    """
+    return [geo for geo, region in REGIONS.items() if region.parent == parent]
+
+
+def get_region(geo: str) -> Region:
+    """
+    Look up a region by its geo code or JHU name
+    :param geo: geo code such as 'TW', or JHU name such as 'Taiwan*'
+    :return: the region
+    >>> get_region('TW').jhu_name, get_region('Taiwan*').geo
+    ('Taiwan*', 'TW')
+    >>> get_region('Spain')
+    Traceback (most recent call last):
+    ValueError: Region is not well defined
+    """
+    if geo in REGIONS:
+        return REGIONS[geo]
+    for region in REGIONS.values():
+        if geo in [region.jhu_name, region.case_name]:
+            return region
+    raise ValueError("Region is not well defined")
+
+
+register_region(Constant.TW, Constant.TAIWAN, Constant.KEY_WORDS_LIST_TW, Constant.KEY_WORDS_LIST_EN)
+register_region(Constant.US, Constant.US, Constant.KEY_WORDS_LIST_EN)
+register_region('GB', 'United Kingdom', Constant.KEY_WORDS_LIST_EN)
+register_region('CA', 'Canada', Constant.KEY_WORDS_LIST_EN)
+register_region('AU', 'Australia', Constant.KEY_WORDS_LIST_EN)
+# the 50 states and DC, with their Province_State in the JHU US file
+for state_code, state_name in Constant.US_STATES.items():
+    register_region('US-' + state_code, state_name, Constant.KEY_WORDS_LIST_EN, parent=Constant.US)
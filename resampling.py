@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Uncertainty of the awareness time gaps. The gap of a region is the mean of the gaps of its items, so it gets a
+bootstrap confidence interval from resampling its items, and the difference of two regions gets a bootstrap interval
+and a permutation-test p-value. Resamples are vectorized NumPy draws over every region or region pair at once, cut
+into shards of RESAMPLING_SHARD_SIZE resamples. Every shard has its own child of one SeedSequence, so the results
+only depend on the seed and not on how many processes run the shards.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import Constant
+
+
+def awareness_gaps(first_confirmed_dates: dict, **keywords_max_dates_pairs) -> dict:
+    """
+    Time gap in days between the first confirmed date and the max date of every item, like awareness_table()
+    :param first_confirmed_dates: dictionary of every region's first confirmed date
+    :param keywords_max_dates_pairs: region=dictionary of each item's google trend max date
+    :return: region -> array of the gaps of its items, regions without items are left out
+    >>> import datetime
+    >>> awareness_gaps({'US': datetime.date(2020, 1, 22)}, US={'mask': pd.Timestamp('2020-03-15 10:00')}, TW={})
+    {'US': array([53.])}
+    """
+    gaps = {}
+    for region, pairs in keywords_max_dates_pairs.items():
+        if len(pairs) == 0:
+            continue
+        dates = pd.to_datetime(pd.Series(list(pairs.values()))).dt.normalize()
+        gaps[region] = (dates - pd.Timestamp(first_confirmed_dates[region])).dt.days.to_numpy(dtype=float)
+    return gaps
+
+
+def _padded(groups: list) -> (np.ndarray, np.ndarray):
+    """
+    Stack arrays of different lengths into one matrix padded with 0, with the length of every row
+    """
+    counts = np.array([len(group) for group in groups])
+    matrix = np.zeros((len(groups), counts.max() if len(groups) > 0 else 0))
+    matrix[np.arange(matrix.shape[1]) < counts[:, np.newaxis]] = np.concatenate(groups) if len(groups) > 0 else []
+    return matrix, counts
+
+
+def _chunks(resamples: int, elements_per_resample: int) -> list:
+    """
+    Split the resamples of a shard into chunks of at most RESAMPLING_CHUNK_ELEMENTS draws
+    """
+    size = max(1, Constant.RESAMPLING_CHUNK_ELEMENTS // max(elements_per_resample, 1))
+    return [min(size, resamples - start) for start in range(0, resamples, size)]
+
+
+def bootstrap_means(values: np.ndarray, counts: np.ndarray, resamples: int, seed) -> np.ndarray:
+    """
+    Means of bootstrap resamples of every row of a padded matrix: every resample draws counts[g] items of row g with
+    replacement, for every row at once
+    :param values: matrix (groups x items) padded with 0
+    :param counts: number of items of every row
+    :param resamples: number of resamples
+    :param seed: seed or SeedSequence of the generator
+    :return: matrix (resamples x groups) of the resampled means
+    >>> means = bootstrap_means(np.array([[1.0, 3.0], [5.0, 0.0]]), np.array([2, 1]), 1000, 0)
+    >>> means.shape, sorted(set(means[:, 0].tolist())), set(means[:, 1].tolist())
+    ((1000, 2), [1.0, 2.0, 3.0], {5.0})
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.arange(len(values))[:, np.newaxis]
+    inside = np.arange(values.shape[1]) < counts[:, np.newaxis]
+    means = []
+    for size in _chunks(resamples, values.size):
+        draws = (rng.random((size,) + values.shape) * counts[:, np.newaxis]).astype(int)
+        means.append(np.where(inside, values[rows, draws], 0).sum(axis=2) / counts)
+    return np.concatenate(means) if means != [] else np.zeros((0, len(values)))
+
+
+def permutation_differences(pooled: np.ndarray, first_counts: np.ndarray, counts: np.ndarray, resamples: int,
+                            seed) -> np.ndarray:
+    """
+    Differences of means under random relabeling of every pair of groups at once: every pooled item of a pair gets a
+    random key and the first_counts[p] items with the smallest keys form the first group, the rest the second
+    :param pooled: matrix (pairs x items) of the items of both groups of every pair, padded with 0
+    :param first_counts: number of items of the first group of every pair
+    :param counts: number of pooled items of every pair
+    :param resamples: number of permutations
+    :param seed: seed or SeedSequence of the generator
+    :return: matrix (resamples x pairs) of mean of the second group minus mean of the first group
+    >>> differences = permutation_differences(np.array([[0.0, 0.0, 10.0, 10.0]]), np.array([2]), np.array([4]), 600, 0)
+    >>> sorted(set(differences[:, 0].tolist()))
+    [-10.0, 0.0, 10.0]
+    """
+    rng = np.random.default_rng(seed)
+    padding = np.arange(pooled.shape[1]) >= counts[:, np.newaxis]
+    totals = pooled.sum(axis=1)
+    differences = []
+    for size in _chunks(resamples, pooled.size):
+        # padding gets keys above 1, so it never falls among the smallest keys
+        keys = rng.random((size,) + pooled.shape) + padding
+        cutoff = np.take_along_axis(np.sort(keys, axis=2), (first_counts - 1)[np.newaxis, :, np.newaxis], axis=2)
+        first_sums = np.einsum('rpi,pi->rp', keys <= cutoff, pooled)
+        differences.append((totals - first_sums) / (counts - first_counts) - first_sums / first_counts)
+    return np.concatenate(differences) if differences != [] else np.zeros((0, len(pooled)))
+
+
+def run_sharded(func, args: tuple, resamples: int, seed: int, max_workers: int = None) -> np.ndarray:
+    """
+    Run func(*args, shard_resamples, shard_seed) on shards of RESAMPLING_SHARD_SIZE resamples, each with its own child
+    of SeedSequence(seed), and stack the results in shard order
+    :param func: resampling function of this module
+    :param args: arguments of func before the resamples and the seed
+    :param resamples: total number of resamples
+    :param seed: entropy of the root SeedSequence
+    :param max_workers: number of processes, default is the number of CPUs; 1 runs in this process
+    :return: stacked results, one row per resample
+    >>> args = (np.array([[1.0, 3.0, 8.0]]), np.array([3]))
+    >>> serial = run_sharded(bootstrap_means, args, 2500, 1, max_workers=1)
+    >>> bool((serial == run_sharded(bootstrap_means, args, 2500, 1, max_workers=2)).all()), serial.shape
+    (True, (2500, 1))
+    """
+    sizes = [min(Constant.RESAMPLING_SHARD_SIZE, resamples - start)
+             for start in range(0, resamples, Constant.RESAMPLING_SHARD_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if max_workers == 1 or len(sizes) <= 1:
+        return np.concatenate([func(*args, size, shard_seed) for size, shard_seed in zip(sizes, seeds)])
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(func, *args, size, shard_seed) for size, shard_seed in zip(sizes, seeds)]
+        return np.concatenate([future.result() for future in futures])
+
+
+def awareness_significance(first_confirmed_dates: dict, resamples: int = Constant.RESAMPLING_RESAMPLES,
+                           confidence: float = Constant.RESAMPLING_CONFIDENCE, seed: int = Constant.RESAMPLING_SEED,
+                           max_workers: int = None, **keywords_max_dates_pairs) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Bootstrap confidence interval of the awareness time gap of every region, and bootstrap interval and two-sided
+    permutation p-value of the difference of the gaps of every pair of regions
+    :param first_confirmed_dates: dictionary of every region's first confirmed date
+    :param resamples: number of bootstrap resamples and of permutations
+    :param confidence: coverage of the intervals
+    :param seed: entropy of the SeedSequence of the resamples
+    :param max_workers: number of processes, default is the number of CPUs; 1 runs in this process
+    :param keywords_max_dates_pairs: region=dictionary of each item's google trend max date
+    :return: data frame indexed by region with the mean gap, its interval and the number of items, from the most
+    aware region, and data frame of every pair with the difference of the gaps (second minus first), its interval and
+    p-value
+    >>> import datetime
+    >>> first = {'TW': datetime.date(2020, 1, 21), 'US': datetime.date(2020, 1, 22)}
+    >>> def max_dates(first_date, gaps):
+    ...     return {kw: pd.Timestamp(first_date) + pd.Timedelta(days=gap) for kw, gap in zip('abcdef', gaps)}
+    >>> TW, US = max_dates('2020-01-21', [8, 10, 11, 12, 13, 15]), max_dates('2020-01-22', [48, 50, 53, 55, 56, 60])
+    >>> intervals, differences = awareness_significance(first, resamples=2000, max_workers=1, TW=TW, US=US)
+    >>> intervals['awareness_time_gap(days)'].round(1).to_dict(), bool(intervals.loc['TW', 'ci_high'] < 15)
+    ({'TW': 11.5, 'US': 53.7}, True)
+    >>> differences[['region_a', 'region_b']].values.tolist(), bool(differences['p_value'].iloc[0] < 0.01)
+    ([['TW', 'US']], True)
+    """
+    if resamples < 1 or not 0 < confidence < 1:
+        raise ValueError("Resampling is not well defined")
+    gaps = awareness_gaps(first_confirmed_dates, **keywords_max_dates_pairs)
+    regions = sorted(gaps, key=lambda region: gaps[region].mean())
+    tails = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    intervals = pd.DataFrame(columns=['awareness_time_gap(days)', 'ci_low', 'ci_high', 'items'])
+    differences = pd.DataFrame(columns=['region_a', 'region_b', 'difference(days)', 'ci_low', 'ci_high', 'p_value'])
+    if regions == []:
+        return intervals, differences
+
+    values, counts = _padded([gaps[region] for region in regions])
+    observed = np.array([gaps[region].mean() for region in regions])
+    means = run_sharded(bootstrap_means, (values, counts), resamples, seed, max_workers)
+    low, high = np.percentile(means, tails, axis=0)
+    intervals = pd.DataFrame({'awareness_time_gap(days)': observed, 'ci_low': low, 'ci_high': high, 'items': counts},
+                             index=pd.Index(regions, name='region'))
+
+    first, second = np.triu_indices(len(regions), k=1)
+    if len(first) == 0:
+        return intervals, differences
+    pooled, pooled_counts = _padded([np.concatenate([gaps[regions[a]], gaps[regions[b]]])
+                                     for a, b in zip(first, second)])
+    # the permutations get their own children of the seed, apart from the bootstrap ones
+    permuted = run_sharded(permutation_differences, (pooled, counts[first], pooled_counts), resamples,
+                           [seed, 1], max_workers)
+    difference = observed[second] - observed[first]
+    extreme = (np.abs(permuted) >= np.abs(difference) - 1e-9).sum(axis=0)
+    low, high = np.percentile(means[:, second] - means[:, first], tails, axis=0)
+    differences = pd.DataFrame({'region_a': [regions[a] for a in first], 'region_b': [regions[b] for b in second],
+                                'difference(days)': difference, 'ci_low': low, 'ci_high': high,
+                                'p_value': (extreme + 1) / (len(permuted) + 1)})
+    return intervals, differences
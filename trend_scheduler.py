@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+Rate-limit-aware Google Trend fetching: an asyncio scheduler with a token bucket, a cap on requests in flight and
+jittered exponential backoff on 429 responses. Finished payloads are cached right away, so a run that gives up can
+be resumed. A local HTTP stub that injects latency and 429 responses makes the scheduler testable offline.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import Constant
+from data_cache import DataCache, query_key
+from google_trend_fetcher import StubTrendReq, default_trend_client, fetch_payload, split_keywords_into_batches
+from instrumentation import count
+
+
+class RateLimitError(Exception):
+    """
+    Google Trend, or the stub, answered 429 Too Many Requests
+    """
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    Tell whether a failed request was rejected by the rate limit. pytrends raises TooManyRequestsError or a
+    ResponseError holding the response, depending on its version.
+    :param error: exception raised by a client
+    :return: True for a 429 response
+    >>> is_rate_limited(RateLimitError()), is_rate_limited(ValueError())
+    (True, False)
+    """
+    if isinstance(error, RateLimitError) or type(error).__name__ == 'TooManyRequestsError':
+        return True
+    return getattr(getattr(error, 'response', None), 'status_code', None) == 429
+
+
+def backoff_delay(attempt: int, base: float = Constant.GT_BACKOFF_BASE, cap: float = Constant.GT_BACKOFF_CAP,
+                  rng: random.Random = None) -> float:
+    """
+    Full-jitter exponential backoff: a uniform delay between 0 and min(cap, base * 2 ** attempt), so clients rejected
+    together do not come back together
+    :param attempt: number of failed attempts so far, from 0
+    :param base: delay bound of the first retry in seconds
+    :param cap: largest delay bound in seconds
+    :param rng: random generator, default is the module one
+    :return: seconds to wait
+    >>> rng = random.Random(0)
+    >>> [round(backoff_delay(attempt, 1.0, 4.0, rng), 2) for attempt in range(4)]
+    [0.84, 1.52, 1.68, 1.04]
+    """
+    return (rng or random).uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Token bucket: rate tokens per second, at most capacity of them saved up for bursts. Tokens are reserved under a
+    thread lock and waited for on the caller's event loop, so one bucket can be shared by the event loops of several
+    threads, e.g. the Google Trend stages the pipeline runs at the same time.
+    >>> async def take(bucket, n):
+    ...     start = time.perf_counter()
+    ...     for _ in range(n):
+    ...         await bucket.acquire()
+    ...     return time.perf_counter() - start
+    >>> 0.15 < asyncio.run(take(TokenBucket(rate=20, capacity=2), 6)) < 0.4
+    True
+    >>> bucket = TokenBucket(rate=20, capacity=2)
+    >>> threads = [threading.Thread(target=asyncio.run, args=(take(bucket, 3),)) for _ in range(2)]
+    >>> start = time.perf_counter()
+    >>> for thread in threads: thread.start()
+    >>> for thread in threads: thread.join()
+    >>> 0.15 < time.perf_counter() - start < 0.4
+    True
+    """
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("Rate must be positive and capacity at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take the next token, which may only come in the future
+        :return: seconds until the token is there
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.updated is not None:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        """
+        Wait for a token and take it. Waiters are served in the order they reserved.
+        :return: None
+        """
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_SHARED_BUCKETS = {}
+_SHARED_BUCKETS_LOCK = threading.Lock()
+
+
+def shared_bucket(rate: float = Constant.GT_REQUESTS_PER_SECOND, burst: int = Constant.GT_BURST) -> TokenBucket:
+    """
+    The process-wide token bucket of a rate limit, shared by every Google Trend query of the process
+    :param rate: requests per second
+    :param burst: requests let through at once
+    :return: the same bucket for the same rate limit
+    >>> shared_bucket(2.0, 4) is shared_bucket(2.0, 4), shared_bucket(2.0, 4) is shared_bucket(3.0, 4)
+    (True, False)
+    """
+    with _SHARED_BUCKETS_LOCK:
+        if (rate, burst) not in _SHARED_BUCKETS:
+            _SHARED_BUCKETS[(rate, burst)] = TokenBucket(rate, burst)
+        return _SHARED_BUCKETS[(rate, burst)]
+
+
+class SharedTrendClient:
+    """
+    One client for queries fetched together, such as the windows of a stitched range: the given client, or a
+    default_trend_client() created on first use only, so nothing is created when everything is cached
+    >>> shared = SharedTrendClient(StubTrendReq())
+    >>> shared.get() is shared.get()
+    True
+    """
+    def __init__(self, pytrend=None):
+        self._client = pytrend
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        :return: the client
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = default_trend_client()
+            return self._client
+
+
+class HttpTrendClient:
+    """
+    Minimal Google Trend client of the local stub server with the interface of pytrends.request.TrendReq
+    """
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.kw_list = []
+        self.geo = ''
+        self.timeframe = ''
+
+    def build_payload(self, kw_list: list, cat=0, timeframe='today 5-y', geo='', gprop=''):
+        self.kw_list = list(kw_list)
+        self.timeframe = timeframe
+        self.geo = geo
+
+    def interest_over_time(self) -> pd.DataFrame:
+        query = urllib.parse.urlencode({'kw': self.kw_list, 'geo': self.geo, 'timeframe': self.timeframe}, doseq=True)
+        try:
+            with urllib.request.urlopen(self.base_url + '/trends?' + query, timeout=self.timeout) as response:
+                content = json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as error:
+            if error.code == 429:
+                raise RateLimitError("The request failed: Google returned a response with code 429") from None
+            raise
+
+        df = pd.DataFrame({kw: content[kw] for kw in self.kw_list},
+                          index=pd.DatetimeIndex(pd.to_datetime(content['date']), name='date'))
+        df['isPartial'] = False
+        return df
+
+
+class TrendStubServer:
+    """
+    Local HTTP server answering /trends?kw=..&geo=..&timeframe=.. with the search volume of StubTrendReq. Every
+    request waits latency seconds and a reject_ratio share of the requests is answered with 429.
+    >>> with TrendStubServer(latency=0.0, reject_ratio=0.0) as server:
+    ...     client = HttpTrendClient(server.url)
+    ...     client.build_payload(kw_list=['mask'], timeframe='2020-01-01 2020-01-10', geo='US')
+    ...     len(client.interest_over_time()), server.requests
+    (10, 1)
+    """
+    def __init__(self, latency: float = 0.0, reject_ratio: float = 0.0, seed: int = 0, port: int = 0):
+        self.latency = latency
+        self.reject_ratio = reject_ratio
+        self.requests = 0
+        self.rejected = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:' + str(self._httpd.server_address[1])
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        with self._lock:
+            self.requests += 1
+            rejected = self._rng.random() < self.reject_ratio
+            self.rejected += rejected
+        time.sleep(self.latency)
+        if rejected:
+            request.send_error(429, "Too Many Requests")
+            return
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(request.path).query)
+        stub = StubTrendReq()
+        stub.build_payload(kw_list=query['kw'], timeframe=query['timeframe'][0], geo=query.get('geo', [''])[0])
+        df = stub.interest_over_time()
+        content = {kw: df[kw].tolist() for kw in query['kw']}
+        content['date'] = [date.strftime(Constant.PLOT_DATE_FORMAT) for date in df.index]
+
+        body = json.dumps(content).encode('utf-8')
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self) -> 'TrendStubServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def normalize_payload(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Scale every keyword of a payload to 0-100 by its own max, which is what one request per keyword returns
+    :param df: data frame indexed by date with one column per keyword
+    :return: data frame of int
+    """
+    peak = df.astype(float).max().replace(0, float('nan'))
+    return (df.astype(float) * 100 / peak).fillna(0).round().astype(int)
+
+
+async def fetch_payload_with_retry(pytrend, kw_list: list, region: str, timeframe: str, bucket: TokenBucket,
+                                   semaphore: asyncio.Semaphore, stats: dict,
+                                   max_retries: int = Constant.GT_MAX_RETRIES,
+                                   backoff_base: float = Constant.GT_BACKOFF_BASE,
+                                   backoff_cap: float = Constant.GT_BACKOFF_CAP) -> pd.DataFrame:
+    """
+    Send one payload when the token bucket and the concurrency cap allow it, and retry it after a jittered backoff
+    while it is rejected by the rate limit
+    :return: a data frame indexed by date with one column per keyword
+    """
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        async with semaphore:
+            stats['requests'] += 1
+            try:
+                return await asyncio.to_thread(fetch_payload, pytrend, kw_list, region, timeframe)
+            except Exception as error:
+                if is_rate_limited(error) is False or attempt == max_retries:
+                    raise
+                stats['rate_limited'] += 1
+        await asyncio.sleep(backoff_delay(attempt, backoff_base, backoff_cap))
+
+
+async def fetch_google_trend_async(pytrend, keywords: list, region: str, timeframe: str, cache: DataCache = None,
+                                   rate: float = Constant.GT_REQUESTS_PER_SECOND, burst: int = Constant.GT_BURST,
+                                   max_concurrency: int = Constant.GT_FETCH_MAX_WORKERS,
+                                   max_retries: int = Constant.GT_MAX_RETRIES,
+                                   backoff_base: float = Constant.GT_BACKOFF_BASE,
+                                   backoff_cap: float = Constant.GT_BACKOFF_CAP,
+                                   batch_size: int = Constant.GT_MAX_KEYWORDS_PER_PAYLOAD,
+                                   bucket: TokenBucket = None, semaphore: asyncio.Semaphore = None) \
+        -> (pd.DataFrame, dict):
+    """
+    Fetch the google trend of keywords on the scheduler. Keywords are packed batch_size per payload by
+    split_keywords_into_batches() and every keyword is scaled to 0-100 by its own max, like one request per keyword,
+    so a keyword's series does not depend on the payload it came in and is cached as soon as it arrives. When a payload still fails after max_retries,
+    the others are finished and cached first, so running the same query again only fetches what is missing.
+    :param pytrend: TrendReq or any client with the same interface, a SharedTrendClient, or None for a new TrendReq
+    :param keywords: a list contains keywords used to search on google trend
+    :param region: the region for search
+    :param timeframe: "start_date end_date"
+    :param cache: optional DataCache holding every keyword's trend
+    :param rate: requests per second allowed by the token bucket
+    :param burst: requests the token bucket lets through at once
+    :param max_concurrency: max number of requests in flight
+    :param max_retries: retries of a payload rejected by the rate limit
+    :param backoff_base: delay bound of the first retry in seconds
+    :param backoff_cap: largest delay bound in seconds
+    :param batch_size: max number of keywords in one payload
+    :param bucket: token bucket of the requests, default is the process-wide bucket of (rate, burst)
+    :param semaphore: concurrency cap shared with other queries running at the same time, default is a new one
+    :return: a wide data frame with 'date' and one column per keyword, and the fetch statistics
+    """
+    if keywords is None or keywords == []:
+        raise ValueError("Keyword list is empty")
+
+    keys = {kw: query_key(Constant.GT_SOURCE, [kw], region, timeframe) for kw in keywords}
+    series = {}
+    if cache is not None:
+        for kw in keywords:
+            cached_df = cache.get(keys[kw])
+            if cached_df is not None:
+                series[kw] = cached_df.set_index('date')[kw]
+
+    missing = [kw for kw in dict.fromkeys(keywords) if kw not in series]
+    batches = split_keywords_into_batches(missing, batch_size)
+    stats = {'region': region, 'keywords': len(keywords), 'payloads': len(batches), 'requests': 0,
+             'rate_limited': 0, 'cache_hits': len(keywords) - len(missing), 'cache_misses': len(missing)}
+    if batches != [] and isinstance(pytrend, SharedTrendClient):
+        pytrend = pytrend.get()
+    elif batches != [] and pytrend is None:
+        pytrend = default_trend_client()
+
+    bucket = shared_bucket(rate, burst) if bucket is None else bucket
+    semaphore = asyncio.Semaphore(max_concurrency) if semaphore is None else semaphore
+
+    async def fetch_batch(kw_list: list):
+        batch_df = normalize_payload(await fetch_payload_with_retry(pytrend, kw_list, region, timeframe, bucket,
+                                                                    semaphore, stats, max_retries, backoff_base,
+                                                                    backoff_cap))
+        for kw in kw_list:
+            series[kw] = batch_df[kw]
+            if cache is not None:
+                cache.put(keys[kw], batch_df[[kw]].reset_index(),
+                          {'source': Constant.GT_SOURCE, 'keywords': [kw], 'geo': region, 'timeframe': timeframe})
+
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*[fetch_batch(kw_list) for kw_list in batches], return_exceptions=True)
+    stats['wall_time'] = time.perf_counter() - start_time
+    stats['throughput'] = len(batches) / stats['wall_time'] if stats['wall_time'] > 0 else 0.0
+    count('http_requests', stats['requests'])
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    # only throttled payloads are worth running again, any other error is raised as it is
+    for error in errors:
+        if is_rate_limited(error) is False:
+            raise error
+    if errors != []:
+        done = len(batches) - len(errors)
+        raise RateLimitError(str(len(errors)) + " of " + str(len(batches)) + " payload(s) still rate limited, " +
+                             str(done) + " cached; run again to resume") from errors[0]
+
+    google_trend_df = pd.DataFrame({kw: series[kw] for kw in keywords}).fillna(0).astype(int).reset_index()
+    google_trend_df.columns = ['date'] + list(keywords)
+    return google_trend_df, stats
+
+
+def fetch_google_trend_scheduled(pytrend, keywords: list, region: str, timeframe: str, cache: DataCache = None,
+                                 **scheduler_options) -> (pd.DataFrame, dict):
+    """
+    Run fetch_google_trend_async() to the end from synchronous code
+    :param pytrend: TrendReq or any client with the same interface, None for a new TrendReq
+    :param keywords: a list contains keywords used to search on google trend
+    :param region: the region for search
+    :param timeframe: "start_date end_date"
+    :param cache: optional DataCache holding every keyword's trend
+    :param scheduler_options: rate, burst, max_concurrency, max_retries, backoff_base, backoff_cap, batch_size
+    :return: a wide data frame with 'date' and one column per keyword, and the fetch statistics
+    >>> import tempfile
+    >>> cache = DataCache(tempfile.mkdtemp())
+    >>> keywords = ['k' + str(i) for i in range(12)]
+    >>> with TrendStubServer(reject_ratio=1.0) as server:
+    ...     fetch_google_trend_scheduled(HttpTrendClient(server.url), keywords, 'US', '2020-01-01 2020-03-31', cache,
+    ...                                  max_retries=1, backoff_base=0.01)
+    Traceback (most recent call last):
+    trend_scheduler.RateLimitError: 3 of 3 payload(s) still rate limited, 0 cached; run again to resume
+    >>> from fixtures import ReplayTrendReq
+    >>> fetch_google_trend_scheduled(ReplayTrendReq(tempfile.mkdtemp()), ['mask'], 'US', '2020-01-01 2020-03-31')
+    Traceback (most recent call last):
+    ValueError: No recorded Google Trend of ['mask'] in US for 2020-01-01 2020-03-31
+    >>> with TrendStubServer(reject_ratio=0.3, seed=1) as server:
+    ...     df, stats = fetch_google_trend_scheduled(HttpTrendClient(server.url), keywords, 'US',
+    ...                                              '2020-01-01 2020-03-31', cache, rate=50, backoff_base=0.01)
+    >>> list(df.columns) == ['date'] + keywords, int(df['k7'].max())
+    (True, 100)
+    >>> stats['payloads'], stats['requests'] == stats['payloads'] + stats['rate_limited']
+    (3, True)
+    """
+    return asyncio.run(fetch_google_trend_async(pytrend, keywords, region, timeframe, cache, **scheduler_options))
+
+
+def prefetch_google_trends(pytrend, queries: list, cache: DataCache, rate: float = Constant.GT_REQUESTS_PER_SECOND,
+                           burst: int = Constant.GT_BURST, max_concurrency: int = Constant.GT_FETCH_MAX_WORKERS,
+                           **scheduler_options) -> dict:
+    """
+    Fetch many queries, e.g. one per subregion, into the cache at the same time on the process-wide token bucket,
+    one concurrency cap and one client. The queries that fail are left for the next run; every other one is cached.
+    :param pytrend: TrendReq or any client with the same interface, None for a new TrendReq
+    :param queries: list of (keywords, region, timeframe)
+    :param cache: DataCache holding every keyword's trend
+    :param rate: requests per second allowed by the token bucket
+    :param burst: requests the token bucket lets through at once
+    :param max_concurrency: max number of requests in flight
+    :param scheduler_options: max_retries, backoff_base, backoff_cap, batch_size
+    :return: the summed fetch statistics with the number of queries, failed queries and wall time
+    >>> import tempfile
+    >>> from google_trend_fetcher import StubTrendReq
+    >>> queries = [(['mask', 'milk'], geo, '2020-01-01 2020-03-31') for geo in ['US-CA', 'US-NY', 'US-WA']]
+    >>> stats = prefetch_google_trends(StubTrendReq(), queries, DataCache(tempfile.mkdtemp()), rate=100)
+    >>> stats['queries'], stats['requests'], stats['failed']
+    (3, 3, 0)
+    """
+    async def fetch_all():
+        bucket = shared_bucket(rate, burst)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        client = SharedTrendClient(pytrend)
+        return await asyncio.gather(*[fetch_google_trend_async(client, keywords, region, timeframe, cache,
+                                                               bucket=bucket, semaphore=semaphore, **scheduler_options)
+                                      for keywords, region, timeframe in queries], return_exceptions=True)
+
+    start_time = time.perf_counter()
+    results = asyncio.run(fetch_all())
+    done = [result[1] for result in results if not isinstance(result, BaseException)]
+    stats = {'queries': len(queries), 'failed': len(results) - len(done), 'wall_time': time.perf_counter() - start_time}
+    for key in ['payloads', 'requests', 'rate_limited', 'cache_hits', 'cache_misses']:
+        stats[key] = sum(query_stats[key] for query_stats in done)
+    return stats
+
+
+def main(argv: list = None):
+    """
+    Fetch synthetic keywords from the local stub and report the achieved throughput
+    :param argv: command line arguments, default is sys.argv
+    :return: None
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Throughput of the Google Trend scheduler against a local stub")
+    parser.add_argument('--keywords', type=int, default=50)
+    parser.add_argument('--timeframe', default="2020-01-01 2020-04-22")
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds the stub takes to answer")
+    parser.add_argument('--reject-ratio', type=float, default=0.2, help="share of requests answered with 429")
+    parser.add_argument('--rate', type=float, default=Constant.GT_REQUESTS_PER_SECOND)
+    parser.add_argument('--burst', type=int, default=Constant.GT_BURST)
+    parser.add_argument('--max-concurrency', type=int, default=Constant.GT_FETCH_MAX_WORKERS)
+    parser.add_argument('--max-retries', type=int, default=Constant.GT_MAX_RETRIES)
+    parser.add_argument('--backoff-base', type=float, default=Constant.GT_BACKOFF_BASE)
+    args = parser.parse_args(argv)
+
+    keywords = ['keyword ' + str(i) for i in range(args.keywords)]
+    with TrendStubServer(latency=args.latency, reject_ratio=args.reject_ratio) as server:
+        df, stats = fetch_google_trend_scheduled(HttpTrendClient(server.url), keywords, Constant.US, args.timeframe,
+                                                 rate=args.rate, burst=args.burst,
+                                                 max_concurrency=args.max_concurrency, max_retries=args.max_retries,
+                                                 backoff_base=args.backoff_base)
+    print("[GT] %d keyword(s) in %d payload(s): %d request(s), %d rate limited, %.2fs, %.2f payload(s)/s, "
+          "%.2f keyword(s)/s" % (stats['keywords'], stats['payloads'], stats['requests'], stats['rate_limited'],
+                                 stats['wall_time'], stats['throughput'], stats['keywords'] / stats['wall_time']))
+
+
+if __name__ == '__main__':
+    main()
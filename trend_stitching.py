@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Daily Google Trend over ranges longer than Google Trend serves daily. The range is cut into overlapping daily windows
+that are fetched concurrently on one rate limit; every window is scaled 0-100 on its own, so consecutive windows are
+put on one scale by the ratio of their sums over the overlap, for all windows and keywords at once.
+
+@author: Jasmine Kuo, Alan Chen
+"""
+
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+import Constant
+from data_cache import DataCache
+from trend_scheduler import RateLimitError, SharedTrendClient, fetch_google_trend_async, is_rate_limited, shared_bucket
+
+
+def daily_windows(start_date: str, end_date: str, window_days: int = Constant.GT_STITCH_WINDOW_DAYS,
+                  overlap_days: int = Constant.GT_STITCH_OVERLAP_DAYS) -> list:
+    """
+    Cut a date range into windows of window_days days, each sharing overlap_days days with the previous one
+    :param start_date: first day, "YYYY-MM-DD"
+    :param end_date: last day, "YYYY-MM-DD"
+    :param window_days: days of a window, short enough for daily google trend
+    :param overlap_days: days shared by consecutive windows
+    :return: list of "start_date end_date" timeframes
+    >>> daily_windows('2020-01-01', '2020-01-20', window_days=10, overlap_days=3)
+    ['2020-01-01 2020-01-10', '2020-01-08 2020-01-17', '2020-01-15 2020-01-20']
+    """
+    if not 0 < overlap_days < window_days <= Constant.GT_DAILY_MAX_DAYS:
+        raise ValueError("Windows are not well defined")
+
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    timeframes = []
+    window_start = start
+    while True:
+        window_end = min(window_start + pd.Timedelta(days=window_days - 1), end)
+        timeframes.append(window_start.strftime(Constant.PLOT_DATE_FORMAT) + " " +
+                          window_end.strftime(Constant.PLOT_DATE_FORMAT))
+        if window_end >= end:
+            return timeframes
+        window_start = window_end - pd.Timedelta(days=overlap_days - 1)
+
+
+def stitch_windows(window_dfs: list, keywords: list) -> (pd.DataFrame, dict):
+    """
+    Put overlapping windows on one scale and join them into one series per keyword. Window w + 1 is scaled by the
+    sum of window w over their overlap divided by its own, the scales are chained with a cumulative product and
+    overlapping days take the mean of the scaled windows. A keyword that is 0 over an overlap keeps the scale of the
+    previous window. The stitching error of a keyword is the mean absolute difference of two consecutive scaled
+    windows over their overlap, on the final 0-100 scale.
+    :param window_dfs: data frames with 'date' and one column per keyword, sorted by start date
+    :param keywords: keywords to stitch
+    :return: data frame with 'date' and one column per keyword scaled 0-100, and the stitching error of every keyword
+    >>> dates = pd.date_range('2020-01-01', periods=6)
+    >>> first = pd.DataFrame({'date': dates[:4], 'mask': [25, 50, 100, 50]})
+    >>> second = pd.DataFrame({'date': dates[2:], 'mask': [50, 25, 100, 50]})
+    >>> df, errors = stitch_windows([first, second], ['mask'])
+    >>> df['mask'].tolist(), errors
+    ([12, 25, 50, 25, 100, 50], {'mask': 0.0})
+    """
+    dates = pd.DatetimeIndex(sorted(set().union(*[pd.DatetimeIndex(df['date']) for df in window_dfs])))
+    windows = np.full((len(window_dfs), len(dates), len(keywords)), np.nan)
+    for w, df in enumerate(window_dfs):
+        windows[w, dates.get_indexer(pd.DatetimeIndex(df['date']))] = df[keywords].to_numpy(dtype=float)
+
+    # scale of every window relative to the first one, from the overlap of every consecutive pair
+    earlier, later = windows[:-1], windows[1:]
+    overlap = ~np.isnan(earlier) & ~np.isnan(later)
+    earlier_sum = np.where(overlap, earlier, 0).sum(axis=1)
+    later_sum = np.where(overlap, later, 0).sum(axis=1)
+    ratio = np.divide(earlier_sum, later_sum, out=np.ones_like(earlier_sum), where=(earlier_sum > 0) & (later_sum > 0))
+    scales = np.concatenate([np.ones((1, len(keywords))), np.cumprod(ratio, axis=0)])
+    scaled = windows * scales[:, np.newaxis, :]
+
+    combined = np.nanmean(scaled, axis=0)
+    peak = combined.max(axis=0)
+    factor = np.divide(100.0, peak, out=np.zeros_like(peak), where=peak > 0)
+
+    difference = np.where(overlap, np.abs(scaled[:-1] - scaled[1:]), 0).sum(axis=(0, 1))
+    overlap_days = overlap.sum(axis=(0, 1))
+    error = np.divide(difference * factor, overlap_days, out=np.zeros_like(difference), where=overlap_days > 0)
+
+    stitched_df = pd.DataFrame(np.rint(combined * factor).astype(int), columns=keywords)
+    stitched_df.insert(0, 'date', dates)
+    return stitched_df, {kw: round(float(e), 4) for kw, e in zip(keywords, error)}
+
+
+async def fetch_google_trend_stitched_async(pytrend, keywords: list, region: str, start_date: str, end_date: str,
+                                            cache: DataCache = None,
+                                            window_days: int = Constant.GT_STITCH_WINDOW_DAYS,
+                                            overlap_days: int = Constant.GT_STITCH_OVERLAP_DAYS,
+                                            rate: float = Constant.GT_REQUESTS_PER_SECOND,
+                                            burst: int = Constant.GT_BURST,
+                                            max_concurrency: int = Constant.GT_FETCH_MAX_WORKERS,
+                                            **scheduler_options) -> (pd.DataFrame, dict):
+    """
+    Fetch every daily window with fetch_google_trend_async() on the process-wide token bucket, one concurrency cap
+    and one client, then stitch them. Every window is cached per keyword, so a run that gives up resumes from the
+    missing windows.
+    :param pytrend: TrendReq or any client with the same interface, None for a new TrendReq
+    :param keywords: a list contains keywords used to search on google trend
+    :param region: the region for search
+    :param start_date: first day, "YYYY-MM-DD"
+    :param end_date: last day, "YYYY-MM-DD"
+    :param cache: optional DataCache holding every keyword's trend of every window
+    :param window_days: days of a window
+    :param overlap_days: days shared by consecutive windows
+    :param rate: requests per second allowed by the token bucket
+    :param burst: requests the token bucket lets through at once
+    :param max_concurrency: max number of requests in flight
+    :param scheduler_options: max_retries, backoff_base, backoff_cap, batch_size
+    :return: a daily data frame with 'date' and one column per keyword, and the fetch and stitching statistics
+    """
+    timeframes = daily_windows(start_date, end_date, window_days, overlap_days)
+    bucket = shared_bucket(rate, burst)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    client = SharedTrendClient(pytrend)
+
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*[fetch_google_trend_async(client, keywords, region, timeframe, cache,
+                                                              bucket=bucket, semaphore=semaphore, **scheduler_options)
+                                     for timeframe in timeframes], return_exceptions=True)
+    wall_time = time.perf_counter() - start_time
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    # only throttled windows are worth running again, any other error is raised as it is
+    for error in errors:
+        if is_rate_limited(error) is False:
+            raise error
+    if errors != []:
+        raise RateLimitError(str(len(errors)) + " of " + str(len(timeframes)) + " window(s) still rate limited; run "
+                             "again to resume") from errors[0]
+
+    stitched_df, stitch_errors = stitch_windows([window_df for window_df, _ in results], keywords)
+    window_stats = [window_stat for _, window_stat in results]
+    stats = {'region': region, 'keywords': len(keywords), 'windows': len(timeframes), 'wall_time': wall_time,
+             'stitch_error': float(np.mean(list(stitch_errors.values()))), 'stitch_errors': stitch_errors}
+    for key in ['payloads', 'requests', 'rate_limited', 'cache_hits', 'cache_misses']:
+        stats[key] = sum(window_stat[key] for window_stat in window_stats)
+    return stitched_df, stats
+
+
+def fetch_google_trend_stitched(pytrend, keywords: list, region: str, start_date: str, end_date: str,
+                                cache: DataCache = None, **options) -> (pd.DataFrame, dict):
+    """
+    Run fetch_google_trend_stitched_async() to the end from synchronous code
+    :param pytrend: TrendReq or any client with the same interface, None for a new TrendReq
+    :param keywords: a list contains keywords used to search on google trend
+    :param region: the region for search
+    :param start_date: first day, "YYYY-MM-DD"
+    :param end_date: last day, "YYYY-MM-DD"
+    :param cache: optional DataCache holding every keyword's trend of every window
+    :param options: window_days, overlap_days and the options of the scheduler
+    :return: a daily data frame with 'date' and one column per keyword, and the fetch and stitching statistics
+    >>> from google_trend_fetcher import StubTrendReq, synthetic_search_volume
+    >>> df, stats = fetch_google_trend_stitched(StubTrendReq(), ['mask', 'milk'], 'US', '2019-01-01', '2020-04-22',
+    ...                                         rate=100)
+    >>> len(df), stats['windows'], stats['requests'], stats['stitch_error'] < 1
+    (478, 3, 3, True)
+    >>> truth = synthetic_search_volume('mask', 'US', pd.DatetimeIndex(df['date']))
+    >>> bool(np.abs(df['mask'] - truth * 100 / truth.max()).max() <= 2)
+    True
+    >>> import tempfile
+    >>> from fixtures import ReplayTrendReq
+    >>> fetch_google_trend_stitched(ReplayTrendReq(tempfile.mkdtemp()), ['mask'], 'US', '2020-01-01', '2020-04-22')
+    Traceback (most recent call last):
+    ValueError: No recorded Google Trend of ['mask'] in US for 2020-01-01 2020-04-22
+    """
+    return asyncio.run(fetch_google_trend_stitched_async(pytrend, keywords, region, start_date, end_date, cache,
+                                                         **options))